@@ -0,0 +1,155 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import warnings
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "pipeline"))
+from preprocess import read_raw, preprocess, save_cleaned
+from qc import run_qc
+from columnar import load_cleaned
+from snapshot_compare import key_frame, diff_frames
+from streaming import stream_preprocess_qc
+from preprocess_qc_runner import run_pipeline
+from logging_utils import instrument, peak_rss_mb, rss_mb
+from schema import read_csv
+from synth_cohort import parse_size, write_versions
+
+# Usage: python benchmarks/bench_pipeline.py [--sizes 10k,1m,10m] [--edit-fraction F] [--tolerance T]
+#            [--baseline PATH] [--update-baseline]
+#
+# Each size is generated into a scratch work tree (data/raw, data/cleaned, ...)
+# and every stage is timed there. Peak memory is the resident-set high-water
+# mark reached during the stage (see logging_utils.instrument), above what the
+# process held when it started.
+# The run exits with status 1 when a stage is slower or needs more memory than
+# its stored baseline allows.
+BASELINE_PATH = os.path.join(BENCH_DIR, "baselines.json")
+DATASET = "synth"
+TOLERANCE = 0.5
+MIN_SECONDS = 0.01  # time regressions smaller than this are noise
+MIN_MB = 16.0
+
+
+def measure(fn, *args):
+    """Run fn(*args) quietly; returns (result, seconds, peak MB above the starting RSS)"""
+    start_mb = rss_mb() or peak_rss_mb()
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        with instrument("bench", DATASET, metrics_path=None) as metrics:
+            result = fn(*args)
+    return result, metrics.wall_s, max(0.0, metrics.peak_rss_mb - start_mb)
+
+
+def _make_tree(root):
+    for d in ["data/raw", "data/cleaned", "data/snapshots", "data/audit", "data/metadata", "docs"]:
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+
+
+def bench_size(n_rows, edit_fraction):
+    """Time every stage on an n_rows cohort; returns {stage: {seconds, rows_per_sec, peak_mb}}"""
+    results = {}
+
+    def record(stage, fn, *args, rows=n_rows):
+        result, seconds, peak_mb = measure(fn, *args)
+        results[stage] = {"seconds": round(seconds, 4), "rows_per_sec": round(rows / seconds) if seconds else None,
+                          "peak_mb": round(peak_mb, 1)}
+        return result
+
+    cwd = os.getcwd()
+    root = tempfile.mkdtemp(prefix="bench_pipeline_")
+    try:
+        _make_tree(root)
+        os.chdir(root)
+        raw_path = f"data/raw/{DATASET}.csv"
+        v1_path, v2_path = write_versions(n_rows, "data/raw", DATASET, edit_fraction=edit_fraction)
+
+        df_raw = record("read_raw", read_raw, raw_path, DATASET)
+        df_clean = record("preprocess", preprocess, df_raw)
+        record("save_cleaned", save_cleaned, df_clean, DATASET)
+        record("qc", run_qc, df_clean, DATASET)
+        record("load_columnar", load_cleaned, DATASET)
+        record("load_csv", read_csv, f"data/cleaned/{DATASET}_cleaned.csv", DATASET)
+        del df_clean
+
+        df_v2 = read_raw(v2_path, DATASET)
+        record("snapshot_diff", diff_frames, key_frame(df_raw), key_frame(df_v2), "bench")
+        del df_raw, df_v2
+
+        # A full first run, then the nightly case: the edited version arrives and QC is updated by delta
+        with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            run_pipeline(DATASET)
+        shutil.copyfile(v2_path, raw_path)
+        record("pipeline_update", run_pipeline, DATASET)
+
+        record("stream_preprocess_qc", stream_preprocess_qc, DATASET)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def format_table(all_results):
+    lines = [f"{'rows':>10}  {'stage':<22} {'seconds':>9} {'rows/sec':>12} {'peak MB':>9}"]
+    for size, stages in all_results.items():
+        for stage, r in stages.items():
+            rate = f"{r['rows_per_sec']:,}" if r["rows_per_sec"] else "-"
+            lines.append(f"{size:>10}  {stage:<22} {r['seconds']:>9.3f} {rate:>12} {r['peak_mb']:>9.1f}")
+    return "\n".join(lines)
+
+
+def find_regressions(all_results, baselines, tolerance=TOLERANCE):
+    """Stages slower or hungrier than baseline * (1 + tolerance), ignoring sub-noise differences"""
+    regressions = []
+    for size, stages in all_results.items():
+        for stage, r in stages.items():
+            base = baselines.get(size, {}).get(stage)
+            if base is None:
+                continue
+            for key, floor in (("seconds", MIN_SECONDS), ("peak_mb", MIN_MB)):
+                limit = base[key] * (1 + tolerance)
+                if r[key] > limit and r[key] - base[key] > floor:
+                    regressions.append(f"{size} rows / {stage}: {key} {r[key]} > {limit:.3f} (baseline {base[key]})")
+    return regressions
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+
+    def option(flag, default):
+        return args[args.index(flag) + 1] if flag in args else default
+
+    sizes = [parse_size(s) for s in option("--sizes", "10k").split(",")]
+    edit_fraction = float(option("--edit-fraction", 0.001))
+    tolerance = float(option("--tolerance", TOLERANCE))
+    baseline_path = option("--baseline", BASELINE_PATH)
+
+    all_results = {}
+    for n_rows in sizes:
+        print(f"⏱️ Benchmarking {n_rows:,} rows...")
+        all_results[str(n_rows)] = bench_size(n_rows, edit_fraction)
+    print(format_table(all_results))
+
+    baselines = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baselines = json.load(f)
+
+    if "--update-baseline" in args:
+        baselines.update(all_results)
+        with open(baseline_path, "w") as f:
+            json.dump(baselines, f, indent=2)
+        print(f"📌 Baselines updated in {baseline_path}")
+        sys.exit(0)
+
+    regressions = find_regressions(all_results, baselines, tolerance)
+    if regressions:
+        print("❌ Regressions against stored baselines:")
+        print("\n".join(f"- {r}" for r in regressions))
+        sys.exit(1)
+    print("✅ No regressions against stored baselines.")
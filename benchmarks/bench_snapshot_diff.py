@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pipeline"))
+from snapshot_compare import diff_frames, diff_streams
+
+# Usage: python benchmarks/bench_snapshot_diff.py [n_rows ...]
+# The legacy loop is skipped above LOOP_LIMIT rows, where it takes minutes.
+LOOP_LIMIT = 20_000
+# Rows per chunk fed to the out-of-core diff
+RUN_ROWS = 100_000
+SITES = ["NYU", "UCLA", "Yale", "SDSU", "UM_1", "MIT", "Harvard", "BCH"]
+SCANNERS = ["GE", "Siemens", "Philips"]
+
+
+def make_versions(n_rows, edit_fraction=0.01, seed=0):
+    """Build an ABIDE-shaped frame and an edited copy, both indexed by subjectkey"""
+    rng = np.random.default_rng(seed)
+    df_prev = pd.DataFrame({
+        "subjectkey": [f"sub-{i:07d}" for i in range(n_rows)],
+        "interview_date": pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 1500, n_rows), unit="D"),
+        "sex": rng.choice(["M", "F"], n_rows),
+        "age": rng.normal(17, 7, n_rows).round(1),
+        "IQ": rng.normal(105, 15, n_rows).round(),
+        "site": rng.choice(SITES, n_rows),
+        "diagnosis": rng.choice(["ASD", "TD"], n_rows),
+        "scanner_type": rng.choice(SCANNERS, n_rows),
+    })
+    df_prev["interview_date"] = df_prev["interview_date"].dt.strftime("%m/%d/%Y")
+    df_prev.loc[rng.random(n_rows) < 0.02, "age"] = np.nan
+    df_prev = df_prev.set_index("subjectkey")
+
+    df_current = df_prev.copy()
+    n_edits = max(1, int(n_rows * edit_fraction))
+    rows = rng.integers(0, n_rows, n_edits)
+    df_current.iloc[rows, df_current.columns.get_loc("IQ")] += 1
+    df_current = df_current.drop(df_current.index[:n_edits // 2])
+    return df_prev, df_current
+
+
+def legacy_diff(df_prev, df_current, timestamp):
+    """The original row-by-row comparison, kept here as the reference"""
+    changes = []
+    common_keys = set(df_prev.index) & set(df_current.index)
+    df_old_common = df_prev.loc[list(common_keys)]
+    df_new_common = df_current.loc[list(common_keys)]
+    for subject in common_keys:
+        row_old = df_old_common.loc[subject]
+        row_new = df_new_common.loc[subject]
+        for col in df_current.columns:
+            old_val = row_old.get(col)
+            new_val = row_new.get(col)
+            if pd.isnull(old_val) and pd.isnull(new_val):
+                continue
+            if old_val != new_val:
+                changes.append((subject, col))
+    return changes
+
+
+def out_of_core_diff(df_prev, df_current, timestamp):
+    """diff_streams() over the two frames cut into RUN_ROWS chunks, as the raw reader would feed it"""
+    chunks = lambda df: (df.iloc[start:start + RUN_ROWS] for start in range(0, len(df), RUN_ROWS))
+    return [change for changes in diff_streams(chunks(df_prev), chunks(df_current), timestamp) for change in changes]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]] or [1_000, 10_000, 100_000, 1_000_000]
+    print(f"{'rows':>10} {'loop (s)':>10} {'vectorized (s)':>15} {'speedup':>8} {'out-of-core (s)':>16}")
+    for n in sizes:
+        df_prev, df_current = make_versions(n)
+        t_vec, changes = timed(diff_frames, df_prev, df_current, "bench")
+        t_ooc, streamed = timed(out_of_core_diff, df_prev, df_current, "bench")
+        key = lambda c: (c["subjectkey"], c["column"], str(c["old_value"]), str(c["new_value"]))
+        assert sorted(map(key, streamed)) == sorted(map(key, changes)), "out-of-core diff disagrees with diff_frames"
+        if n <= LOOP_LIMIT:
+            t_loop, legacy = timed(legacy_diff, df_prev, df_current, "bench")
+            modified = {(c["subjectkey"], c["column"]) for c in changes if c["column"] != "ROW_STATUS"}
+            assert modified == set(legacy), "vectorized diff disagrees with the legacy loop"
+            print(f"{n:>10} {t_loop:>10.3f} {t_vec:>15.3f} {t_loop / t_vec:>7.0f}x {t_ooc:>16.3f}")
+        else:
+            print(f"{n:>10} {'-':>10} {t_vec:>15.3f} {'-':>8} {t_ooc:>16.3f}")
@@ -0,0 +1,124 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# Usage: python benchmarks/synth_cohort.py <n_rows|10k|1m|10m> [--name NAME] [--out DIR] [--seed S]
+#            [--edit-fraction F] [--churn F] [--missing F] [--sentinels F] [--mixed-dates F]
+#
+# Writes <out>/<name>.csv and an edited second version <out>/<name>_v2.csv in
+# the layout of data/raw/pseudo_abide_dataset.csv. Rows are generated and
+# written in chunks, so even 10M-row cohorts never sit in memory whole; every
+# chunk has its own seed, so a given seed always produces the same files.
+SITES = ["NYU", "UCLA", "Yale", "SDSU", "UM_1", "MIT", "Harvard", "BCH", "ABCD"]
+SCANNERS = ["GE", "Siemens", "Philips"]
+COLUMNS = ["subjectkey", "interview_date", "sex", "age", "IQ", "site", "diagnosis", "scanner_type"]
+NULLABLE = ["interview_date", "sex", "age", "IQ", "diagnosis", "scanner_type"]
+SENTINEL_COLUMNS = ["age", "IQ"]
+CHUNK_ROWS = 500_000
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+
+
+def parse_size(text):
+    """Turn "10k", "1m" or "250000" into a row count"""
+    text = str(text).lower().replace("_", "")
+    return SIZES[text] if text in SIZES else int(text)
+
+
+def _keys(ids):
+    return "sub-" + pd.Series(ids).astype(str).str.zfill(8)
+
+
+def _dates(rng, n, mixed_dates):
+    """Interview dates as m/d/yy like the raw exports, with a fraction in other formats"""
+    days = np.datetime64("2019-01-01") + rng.integers(0, 1800, n).astype("timedelta64[D]")
+    year = days.astype("datetime64[Y]").astype(int) + 1970
+    month = days.astype("datetime64[M]").astype(int) % 12 + 1
+    day = (days - days.astype("datetime64[M]")).astype(int) + 1
+    y, m, d = (pd.Series(a).astype(str) for a in (year, month, day))
+
+    dates = m + "/" + d + "/" + y.str[2:]
+    style = rng.random(n)
+    long_us = style < mixed_dates / 2
+    iso = (style >= mixed_dates / 2) & (style < mixed_dates)
+    dates[long_us] = (m.str.zfill(2) + "/" + d.str.zfill(2) + "/" + y)[long_us]
+    dates[iso] = (y + "-" + m.str.zfill(2) + "-" + d.str.zfill(2))[iso]
+    return dates
+
+
+def generate_rows(ids, rng, missing=0.03, sentinels=0.01, mixed_dates=0.05):
+    """ABIDE-shaped raw rows (all values as strings) for the given subject numbers"""
+    n = len(ids)
+    df = pd.DataFrame({
+        "subjectkey": _keys(ids),
+        "interview_date": _dates(rng, n, mixed_dates),
+        "sex": rng.choice(["M", "F"], n),
+        "age": rng.normal(17, 7, n).round(1).astype(str),
+        "IQ": rng.normal(105, 15, n).round().astype(int).astype(str),
+        "site": rng.choice(SITES, n),
+        "diagnosis": rng.choice(["ASD", "TD"], n),
+        "scanner_type": rng.choice(SCANNERS, n),
+    })
+    for col in NULLABLE:
+        df.loc[rng.random(n) < missing, col] = ""
+    for col in SENTINEL_COLUMNS:
+        df.loc[rng.random(n) < sentinels, col] = "-9999"
+    return df
+
+
+def edit_rows(df, ids_added, rng, edit_fraction=0.01, churn=0.001, **options):
+    """Second version of a chunk: edited cells, a few removed rows and a few new subjects"""
+    replacement = generate_rows(np.arange(len(df)), rng, **options)
+    edited = df.copy()
+    for col in COLUMNS[1:]:
+        mask = rng.random(len(df)) < edit_fraction
+        edited.loc[mask, col] = replacement.loc[mask, col].to_numpy()
+
+    edited = edited[rng.random(len(df)) >= churn / 2]
+    added = generate_rows(ids_added, rng, **options)
+    return pd.concat([edited, added], ignore_index=True)
+
+
+def write_versions(n_rows, out_dir="data/raw", name=None, edit_fraction=0.01, churn=0.001, missing=0.03,
+                   sentinels=0.01, mixed_dates=0.05, seed=0, chunk_rows=CHUNK_ROWS):
+    """Write a synthetic cohort and an edited second version; returns both paths"""
+    name = name or f"synth_{n_rows}"
+    os.makedirs(out_dir, exist_ok=True)
+    paths = (os.path.join(out_dir, f"{name}.csv"), os.path.join(out_dir, f"{name}_v2.csv"))
+    options = {"missing": missing, "sentinels": sentinels, "mixed_dates": mixed_dates}
+    n_added = 0
+
+    for i, start in enumerate(range(0, max(n_rows, 1), chunk_rows)):
+        rng = np.random.default_rng([seed, i])
+        ids = np.arange(start, min(start + chunk_rows, n_rows))
+        df = generate_rows(ids, rng, **options)
+
+        # New subjects get numbers past the first version's range
+        k = rng.binomial(len(ids), churn / 2)
+        ids_added = np.arange(n_rows + n_added, n_rows + n_added + k)
+        n_added += k
+        df_v2 = edit_rows(df, ids_added, rng, edit_fraction, churn, **options)
+
+        for frame, path in zip((df, df_v2), paths):
+            frame.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    return paths
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python benchmarks/synth_cohort.py <n_rows|10k|1m|10m> [--name NAME] [--out DIR] [--seed S] "
+              "[--edit-fraction F] [--churn F] [--missing F] [--sentinels F] [--mixed-dates F]")
+        sys.exit(1)
+
+    args = sys.argv[2:]
+    options = {}
+    for flag, key, cast in [("--name", "name", str), ("--out", "out_dir", str), ("--seed", "seed", int),
+                            ("--edit-fraction", "edit_fraction", float), ("--churn", "churn", float),
+                            ("--missing", "missing", float), ("--sentinels", "sentinels", float),
+                            ("--mixed-dates", "mixed_dates", float)]:
+        if flag in args:
+            options[key] = cast(args[args.index(flag) + 1])
+
+    n_rows = parse_size(sys.argv[1])
+    for path in write_versions(n_rows, **options):
+        print(f"🧪 Wrote {path}")
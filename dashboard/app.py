@@ -1,12 +1,26 @@
 import pandas as pd
 import streamlit as st
-import matplotlib.pyplot as plt
 import os
 import glob
-import subprocess
+import shutil
 import sys
-import numpy as np
-from scipy.stats import norm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pipeline"))
+from job_queue import submit, ensure_workers, latest_job
+from ingest_daemon import load_status, is_alive, is_current
+from loaders import read_csv, read_text, overview_figures, stage_metrics
+from tables import paged_table
+from audit_store import count_changes, query_changes
+from subject_index import subject_history, search
+from storage import atomic_write, exists, glob_csv
+from schema import read_header
+from version_compare import comparison_matrix, subject_diff, presence
+from logging_utils import append_version_comparison_to_changelog
+
+AUDIT_PAGE_SIZE = 50
+REQUIRED_COLUMNS = {"subjectkey", "age", "IQ", "diagnosis"}
+UPLOAD_CHUNK_BYTES = 8 << 20
+JOB_POLL_SECONDS = 2
 
 st.set_page_config(page_title="Clinical Data QC Dashboard", layout="centered")
 
@@ -14,30 +28,33 @@ st.set_page_config(page_title="Clinical Data QC Dashboard", layout="centered")
 st.sidebar.markdown("### 📤 Upload a New Dataset")
 uploaded_file = st.sidebar.file_uploader("Upload CSV", type=["csv"])
 
-if uploaded_file:
+# The uploader keeps returning the same file on every rerun; handle each upload once
+if uploaded_file and st.session_state.get("handled_upload") != uploaded_file.file_id:
+    st.session_state["handled_upload"] = uploaded_file.file_id
     uploaded_name = uploaded_file.name.replace(" ", "_")
     save_path = os.path.join("data/raw", uploaded_name)
 
-    with open(save_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-
     try:
-        df_uploaded = pd.read_csv(save_path)
-        required_cols = {"subjectkey", "age", "IQ", "diagnosis"}
-        if not required_cols.issubset(df_uploaded.columns):
-            st.sidebar.error("Missing required columns.")
-            os.remove(save_path)
+        # Only the header line is read to check the required columns
+        missing_cols = REQUIRED_COLUMNS - set(read_header(uploaded_file))
+        if missing_cols:
+            st.sidebar.error(f"Missing required columns: {', '.join(sorted(missing_cols))}")
             st.stop()
-        else:
-            st.sidebar.success(f"✅ Uploaded and saved as: {uploaded_name}")
-            st.rerun()
+
+        # Compressed as it is copied, under a temporary name so the file never appears half-written in data/raw
+        uploaded_file.seek(0)
+        with atomic_write(save_path, "wb") as f:
+            shutil.copyfileobj(uploaded_file, f, UPLOAD_CHUNK_BYTES)
+
+        job_id = submit("pipeline", uploaded_name.replace(".csv", ""), rerun=True)
+        ensure_workers()
+        st.sidebar.success(f"✅ Uploaded and saved as: {uploaded_name} (pipeline job {job_id} queued)")
     except Exception as e:
         st.sidebar.error(f"Error reading file: {e}")
-        os.remove(save_path)
         st.stop()
 
 # --- Dataset Selection ---
-available_datasets = sorted(glob.glob("data/raw/*.csv"))
+available_datasets = glob_csv("data/raw/*.csv")
 dataset_choices = [os.path.basename(f) for f in available_datasets]
 
 if not dataset_choices:
@@ -59,17 +76,62 @@ flagged_path = f"data/cleaned/{dataset_id}_qc_flags.csv"
 diff_log_path = f"data/audit/{dataset_id}_column_diff_history.csv"
 hash_log_path = "docs/data_change_log.csv"
 
-# --- Preprocessing Runner (only runs once per dataset switch) ---
+# --- Preprocessing Runner (queued once per dataset switch, run by background workers) ---
+# Nothing is queued when the ingestion service (ingest_daemon.py) already processed the file as it is now
 if st.session_state.get("last_run_dataset") != dataset_id:
     try:
-        subprocess.run([sys.executable, "pipeline/preprocess_qc_runner.py", dataset_id], check=True)
-        subprocess.run([sys.executable, "pipeline/snapshot_compare.py", dataset_id], check=True)
+        if not is_current(dataset_id):
+            st.session_state["watched_job"] = submit("pipeline", dataset_id)
+            ensure_workers()
         st.session_state["last_run_dataset"] = dataset_id
     except Exception as e:
         st.warning(f"⚠️ Pipeline error: {e}")
 
+
+def ingest_status(dataset_id):
+    """One line on the ingestion service, and a note while the dataset's file is still being written"""
+    status = load_status()
+    if not is_alive(status):
+        st.caption("🛰️ Ingestion service not running — datasets are processed when selected.")
+        return
+    st.caption(f"🛰️ Ingestion service watching data/raw (since {status['started_at']})")
+    entry = status["files"].get(dataset_id)
+    if entry is not None and entry["state"] == "settling":
+        st.caption("📥 This file is still changing; it is processed once it has been stable "
+                   f"for {status['settle_s']:g}s.")
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def pipeline_status(dataset_id):
+    """Poll the dataset's latest pipeline job; rerun the page once a job it saw running has finished"""
+    ingest_status(dataset_id)
+    job = latest_job(dataset_id)
+    if job is None:
+        return
+    if job["status"] in ("queued", "running"):
+        st.session_state["watched_job"] = job["id"]
+        label = "queued" if job["status"] == "queued" else f"running {job['stage'] or ''}".strip()
+        st.progress(job["progress"], text=f"⏳ Pipeline job {job['id']}: {label}")
+    elif job["status"] == "failed":
+        st.error(f"⚠️ Pipeline job {job['id']} failed: {job['error']}")
+    if job["status"] in ("done", "failed") and st.session_state.get("watched_job") == job["id"]:
+        st.session_state["watched_job"] = None
+        st.rerun()
+
+
+with st.sidebar:
+    pipeline_status(dataset_id)
+
+if not os.path.exists(cleaned_path):
+    job = latest_job(dataset_id)
+    if job is not None and job["status"] == "failed":
+        st.error(f"⚠️ This dataset could not be processed: {job['error']}")
+    else:
+        st.info("⏳ This dataset is still being processed. The page refreshes when its pipeline job finishes.")
+    st.stop()
+
 # --- Tab Navigation ---
-tabs = ["📋 Data Overview", "🧪 Data QC", "🧾 Data Audit Trail"]
+tabs = ["📋 Data Overview", "🧪 Data QC", "🧾 Data Audit Trail", "📈 Pipeline Performance"]
 selected_tab = st.sidebar.radio("Choose a Page", tabs)
 
 # --- Page 1: Data Overview ---
@@ -78,77 +140,39 @@ if selected_tab == "📋 Data Overview":
     
 
     try:
-        
-        df_raw = pd.read_csv(raw_path)
-        df_clean = pd.read_csv(cleaned_path)
+        figures = overview_figures(dataset_id)
 
         st.subheader("🆚 Raw vs Cleaned Dataset Preview")
 
         st.markdown("###  Raw Dataset")
-        st.dataframe(df_raw, height=300)
+        paged_table(raw_path, dataset_id, key="raw")
 
         st.markdown("###  Cleaned Dataset")
-        st.dataframe(df_clean, height=300)
+        paged_table(cleaned_path, dataset_id, key="cleaned")
 
         st.markdown("---")
         st.subheader("🎯 Age Distribution (Cleaned Data)")
-
-        fig_age, ax_age = plt.subplots()
-        df_clean["age"].dropna().hist(bins=15, density=True, alpha=0.6, ax=ax_age, color="skyblue", edgecolor="black")
-
-        # Overlay normal distribution curve
-        age_mean = df_clean["age"].mean()
-        age_std = df_clean["age"].std()
-        x_vals = np.linspace(df_clean["age"].min(), df_clean["age"].max(), 100)
-        ax_age.plot(x_vals, norm.pdf(x_vals, age_mean, age_std), color="red", lw=2, label="Normal Dist")
-        ax_age.set_title("Age Histogram with Normal Curve")
-        ax_age.legend()
-        st.pyplot(fig_age)
+        st.image(figures["age"])
 
         st.subheader("🧠 IQ Distribution (Cleaned Data)")
-
-        fig_iq, ax_iq = plt.subplots()
-        df_clean["IQ"].dropna().hist(bins=15, density=True, alpha=0.6, ax=ax_iq, color="lightgreen", edgecolor="black")
-
-        # Overlay normal distribution curve
-        iq_mean = df_clean["IQ"].mean()
-        iq_std = df_clean["IQ"].std()
-        x_vals = np.linspace(df_clean["IQ"].min(), df_clean["IQ"].max(), 100)
-        ax_iq.plot(x_vals, norm.pdf(x_vals, iq_mean, iq_std), color="red", lw=2, label="Normal Dist")
-        ax_iq.set_title("IQ Histogram with Normal Curve")
-        ax_iq.legend()
-        st.pyplot(fig_iq)
+        st.image(figures["IQ"])
 
         st.subheader("🏥 Site, Scanner, and Sex Distributions")
 
         # --- Site Distribution ---
-        fig_site, ax_site = plt.subplots()
-        df_clean["site"].value_counts().plot(kind="barh", ax=ax_site, color="lightcoral", edgecolor="black")
-        ax_site.set_title("Site Distribution")
-        st.pyplot(fig_site)
+        st.image(figures["site"])
 
         # --- Scanner Type Distribution ---
-        if "scanner_type" in df_clean.columns:
-            fig_scanner, ax_scanner = plt.subplots()
-            df_clean["scanner_type"].value_counts().plot(kind="barh", ax=ax_scanner, color="mediumseagreen", edgecolor="black")
-            ax_scanner.set_title("Scanner Type Distribution")
-            st.pyplot(fig_scanner)
+        if "scanner_type" in figures:
+            st.image(figures["scanner_type"])
 
         # --- Sex Distribution (as pie chart) ---
-        fig_sex, ax_sex = plt.subplots()
-        sex_counts = df_clean["sex"].map({1: "Male", 2: "Female"}).value_counts()
-        ax_sex.pie(sex_counts, labels=sex_counts.index, autopct="%1.1f%%", startangle=90, colors=["#8ecae6", "#f7a1a1"])
-        ax_sex.set_title("Sex Distribution")
-        st.pyplot(fig_sex)
+        st.image(figures["sex"])
 
         # --- ASD vs TD Pie Chart ---
         st.subheader("🧠 ASD Diagnosis Distribution")
-        if "diagnosis" in df_clean.columns:
-            fig_diag, ax_diag = plt.subplots()
-            diag_counts = df_clean["diagnosis"].map({1: "ASD", 0: "TD"}).value_counts()
-            ax_diag.pie(diag_counts, labels=diag_counts.index, autopct="%1.1f%%", startangle=90, colors=["#ffb703", "#8ecae6"])
-            ax_diag.set_title("ASD vs TD Distribution")
-            st.pyplot(fig_diag)
+        if "diagnosis" in figures:
+            st.image(figures["diagnosis"])
 
     except Exception as e:
         st.warning(f"Could not load datasets: {e}")
@@ -158,17 +182,16 @@ elif selected_tab == "🧪 Data QC":
     st.title("🧪 Data Quality Control")
 
     try:
-        with open(qc_report_path) as f:
-            st.text_area("📋 QC Report", f.read(), height=300)
+        st.text_area("📋 QC Report", read_text(qc_report_path), height=300)
 
         with open(qc_report_path, "rb") as f:
             st.download_button(label="📥 Download QC Report", data=f, 
             file_name=os.path.basename(qc_report_path))
 
-        df_flags = pd.read_csv(flagged_path)
-        if not df_flags.empty:
+        # Only the first row is read to check whether anything was flagged
+        if len(read_csv(flagged_path, dataset_id, nrows=1)):
             st.subheader("⚠️ Flagged Rows")
-            st.dataframe(df_flags)
+            paged_table(flagged_path, dataset_id, key="flags")
         else:
             st.success("No missing or outlier rows.")
 
@@ -179,47 +202,140 @@ elif selected_tab == "🧪 Data QC":
 elif selected_tab == "🧾 Data Audit Trail":
     st.title("🧾 Data Audit Trail")
     st.markdown("This section tracks all pipeline activity, version comparisons, and column-level changes.")
-    
-    
+
+    # --- Version comparison (cached subject-ID signatures) ---
+    st.subheader("🆚 Version Comparison")
+    cleaned_versions = sorted(glob.glob("data/cleaned/*_cleaned.csv"))
+    version_names = [os.path.basename(f) for f in cleaned_versions]
+    selected_versions = st.multiselect("Cleaned datasets to compare", version_names,
+                                       default=version_names[:2])
+    if len(selected_versions) >= 2:
+        selected_paths = [cleaned_versions[version_names.index(name)] for name in selected_versions]
+        try:
+            st.dataframe(comparison_matrix(selected_paths), hide_index=True)
+            if len(selected_paths) == 2:
+                added, removed = subject_diff(*selected_paths)
+                diff_cols = st.columns(2)
+                diff_cols[0].markdown(f"**🆕 Added ({len(added)})**")
+                diff_cols[0].dataframe(pd.DataFrame({"subject": added}), hide_index=True)
+                diff_cols[1].markdown(f"**❌ Removed ({len(removed)})**")
+                diff_cols[1].dataframe(pd.DataFrame({"subject": removed}), hide_index=True)
+                if st.button("📝 Log to CHANGELOG.md"):
+                    if append_version_comparison_to_changelog(*selected_versions, added, removed):
+                        st.success("✅ Comparison logged.")
+                    else:
+                        st.info("Comparison already logged.")
+            else:
+                st.dataframe(presence(selected_paths))
+        except Exception as e:
+            st.warning(f"Could not compare versions: {e}")
+
+    # --- Subject lookup (cross-dataset subject index, no CSV is read) ---
+    st.subheader("🔎 Subject Lookup")
+    subject_query = st.text_input("Subject key, in every dataset and version", "").strip()
+    if subject_query:
+        spans, subject_changes = subject_history(subject_query)
+        if spans.empty and subject_changes.empty:
+            matches = search(subject_query)
+            if matches:
+                st.info(f"No exact match. Subject keys starting with `{subject_query}`: {', '.join(matches)}")
+            else:
+                st.info(f"No indexed dataset contains `{subject_query}`.")
+        else:
+            spans["versions"] = [f"v{first}–" + (f"v{last}" if pd.notna(last) else "latest")
+                                 for first, last in zip(spans["first_version"], spans["last_version"])]
+            spans["stored_in"] = [f"v{n:04d}.csv" for n in spans["stored_in"]]
+            st.markdown(f"**Present in {spans['dataset'].nunique()} dataset(s)**")
+            st.dataframe(spans[["dataset", "versions", "first_seen", "last_seen", "stored_in", "row"]],
+                         hide_index=True)
+            st.markdown(f"**Changes ({len(subject_changes)})**")
+            st.dataframe(subject_changes[["dataset", "timestamp", "column", "old_value", "new_value"]],
+                         hide_index=True)
+
+
     # --- Column-level change history ---
     st.subheader("🔄 Change History")
 
     
-    diff_path = diff_log_path
-
-    if os.path.exists(diff_path):
-        df_diff = pd.read_csv(diff_path)
-        if not df_diff.empty and "column" in df_diff.columns:
-            # Corrected filter logic with parentheses
-            added = df_diff[(df_diff["column"] == "ROW_STATUS") & (df_diff["new_value"] == "🆕 ADDED")]
-            removed = df_diff[(df_diff["column"] == "ROW_STATUS") & (df_diff["old_value"] == "❌ REMOVED")]
-            modified = df_diff[df_diff["column"] != "ROW_STATUS"]
-
-            if not added.empty:
-                st.markdown("### Newly Added Subjects")
-                st.dataframe(added[["timestamp", "subjectkey"]])
-
-            if not removed.empty:
-                st.markdown("### Removed Subjects")
-                st.dataframe(removed[["timestamp", "subjectkey"]])
-
-            if not modified.empty:
-                st.markdown("### Modified Cell Values")
-                st.dataframe(modified[["timestamp", "subjectkey", "column", "old_value", "new_value"]])
-        else:
-            st.info("No changes detected.")
+    if exists(diff_log_path) and count_changes(dataset_id) > 0:
+        # Filters run as indexed queries; only the visible page is loaded
+        filter_cols = st.columns(3)
+        subject_filter = filter_cols[0].text_input("Subject", "").strip() or None
+        column_filter = filter_cols[1].text_input("Column", "").strip() or None
+        since_filter = filter_cols[2].date_input("Since", value=None)
+        filters = {"subjectkey": subject_filter, "column": column_filter,
+                   "since": since_filter.strftime("%Y-%m-%d") if since_filter else None}
+
+        sections = [
+            ("added", "### Newly Added Subjects", ["timestamp", "subjectkey"]),
+            ("removed", "### Removed Subjects", ["timestamp", "subjectkey"]),
+            ("modified", "### Modified Cell Values", ["timestamp", "subjectkey", "column", "old_value", "new_value"]),
+        ]
+        for kind, heading, columns in sections:
+            total = count_changes(dataset_id, kind=kind, **filters)
+            if total == 0:
+                continue
+            st.markdown(heading)
+            n_pages = -(-total // AUDIT_PAGE_SIZE)
+            page = 1
+            if n_pages > 1:
+                page = st.number_input(f"Page (of {n_pages}, {total} rows)", min_value=1, max_value=n_pages,
+                                       value=1, key=f"audit_page_{kind}")
+            df_page = query_changes(dataset_id, kind=kind, limit=AUDIT_PAGE_SIZE,
+                                    offset=(page - 1) * AUDIT_PAGE_SIZE, **filters)
+            st.dataframe(df_page[columns])
+    elif exists(diff_log_path):
+        st.info("No changes detected.")
     else:
         st.info("🔍 No column-level change history available yet for this dataset.")
     
     # Show file hash log
     st.subheader("🔐 File Hash Log")
     try:
-        df_hash = pd.read_csv("docs/data_change_log.csv", names=["Timestamp", "Filename", "File Hash"], header=None)
+        df_hash = read_csv(hash_log_path, names=["Timestamp", "Filename", "File Hash"], header=None)
         df_hash = df_hash[df_hash["Filename"].str.contains(dataset_id)]
         st.dataframe(df_hash.reset_index(drop=True))
     except FileNotFoundError:
         st.warning("No data change log found.")
 
+# --- Tab: Pipeline Performance ---
+elif selected_tab == "📈 Pipeline Performance":
+    st.title("📈 Pipeline Performance")
+    st.markdown("Per-stage timings and resource use recorded in `docs/pipeline_metrics.jsonl`.")
+
+    df_metrics = stage_metrics(dataset_id)
+    if df_metrics.empty:
+        st.info("No stage runs recorded yet for this dataset.")
+    else:
+        ran = df_metrics[df_metrics["cache"] != "hit"]
+        stages = sorted(ran["stage"].unique())
+        selected_stages = st.multiselect("Stages", stages, default=stages)
+
+        # --- Latency history ---
+        st.subheader("⏱️ Stage Latency History (seconds)")
+        latency = ran[ran["stage"].isin(selected_stages)].pivot_table(
+            index="timestamp", columns="stage", values="wall_s", aggfunc="max")
+        st.line_chart(latency)
+
+        # --- Latest run vs typical run, per stage ---
+        st.subheader("🐢 Latest Run vs Median")
+        summary = ran.groupby("stage").agg(
+            runs=("wall_s", "size"),
+            median_s=("wall_s", "median"),
+            latest_s=("wall_s", "last"),
+            latest_peak_rss_mb=("peak_rss_mb", "last"),
+            latest_rows_in=("rows_in", "last"),
+            latest_bytes_read=("bytes_read", "last"),
+        )
+        summary["slowdown"] = (summary["latest_s"] / summary["median_s"]).round(2)
+        st.dataframe(summary.sort_values("slowdown", ascending=False))
+
+        # --- Raw log ---
+        st.subheader("🧾 Recent Stage Runs")
+        columns = ["timestamp", "stage", "status", "wall_s", "cpu_s", "peak_rss_mb", "rows_in", "rows_out",
+                   "bytes_read", "bytes_written", "cache", "error"]
+        st.dataframe(df_metrics.sort_values("timestamp", ascending=False)[columns].head(200).reset_index(drop=True))
+
 # Footer
 st.markdown("---")
 st.caption("Built with ❤️ by Jiaqi")
@@ -0,0 +1,152 @@
+import io
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import streamlit as st
+from scipy.stats import norm
+
+from columnar import load_cleaned
+from hash_registry import file_hash
+from logging_utils import instrument, read_metrics, METRICS_PATH
+from qc import chart_summary_path, load_chart_summary
+from schema import read_csv as read_with_schema
+from storage import exists
+
+# Streamlit re-executes app.py on every interaction. Everything below is
+# memoized by st.cache_data, which is shared by all sessions of this server
+# process, capped by max_entries and evicts the least recently used entry.
+# Loaders take the file's content digest as an argument, so a cached entry
+# is reused until the file's bytes change.
+MAX_FRAMES = 16
+MAX_FIGURES = 16
+
+
+def file_digest(path):
+    """Content hash of a file (decompressed, if stored compressed); the hash registry only rehashes it when its stat changes"""
+    if not exists(path):
+        return None
+    return file_hash(path)
+
+
+@st.cache_data(max_entries=MAX_FRAMES, show_spinner=False)
+def _read_csv(path, digest, dataset_id=None, **kwargs):
+    return read_with_schema(path, dataset_id, **kwargs)
+
+
+def read_csv(path, dataset_id=None, **kwargs):
+    """schema.read_csv, reused across reruns and sessions until the file's content changes"""
+    return _read_csv(path, file_digest(path), dataset_id, **kwargs)
+
+
+@st.cache_data(max_entries=MAX_FRAMES, show_spinner=False)
+def _read_cleaned(dataset_id, digest):
+    return load_cleaned(dataset_id)
+
+
+def read_cleaned(dataset_id):
+    return _read_cleaned(dataset_id, file_digest(f"data/cleaned/{dataset_id}_cleaned.csv"))
+
+
+@st.cache_data(max_entries=MAX_FRAMES, show_spinner=False)
+def _stage_metrics(dataset_id, digest):
+    df = pd.DataFrame(read_metrics(dataset_id))
+    if not df.empty:
+        df["timestamp"] = pd.to_datetime(df["timestamp"])
+    return df
+
+
+def stage_metrics(dataset_id):
+    """Recorded stage runs of one dataset, as a DataFrame"""
+    return _stage_metrics(dataset_id, file_digest(METRICS_PATH))
+
+
+@st.cache_data(max_entries=MAX_FRAMES, show_spinner=False)
+def _read_text(path, digest):
+    with open(path) as f:
+        return f.read()
+
+
+def read_text(path):
+    return _read_text(path, file_digest(path))
+
+
+def _png(fig):
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=200, bbox_inches="tight")
+    plt.close(fig)
+    return buf.getvalue()
+
+
+def _hist_with_normal(stats, color, title):
+    # Redraws values.hist(bins=15, density=True) from the saved bin edges and counts
+    fig, ax = plt.subplots()
+    edges = np.asarray(stats["bin_edges"], dtype=float)
+    if len(edges):
+        ax.hist(edges[:-1], bins=edges, weights=stats["bin_counts"], density=True, alpha=0.6,
+                color=color, edgecolor="black")
+        ax.grid(True)
+
+        # Overlay normal distribution curve
+        std = stats["std"] if stats["std"] is not None else np.nan
+        x_vals = np.linspace(stats["min"], stats["max"], 100)
+        ax.plot(x_vals, norm.pdf(x_vals, stats["mean"], std), color="red", lw=2, label="Normal Dist")
+        ax.legend()
+    ax.set_title(title)
+    return _png(fig)
+
+
+def _barh(counts, color, title):
+    fig, ax = plt.subplots()
+    counts.plot(kind="barh", ax=ax, color=color, edgecolor="black")
+    ax.set_title(title)
+    return _png(fig)
+
+
+def _pie(counts, colors, title):
+    fig, ax = plt.subplots()
+    ax.pie(counts, labels=counts.index, autopct="%1.1f%%", startangle=90, colors=colors)
+    ax.set_title(title)
+    return _png(fig)
+
+
+@st.cache_data(max_entries=MAX_FIGURES, show_spinner=False)
+def _overview_figures(dataset_id, digest):
+    # Only runs on a cache miss, so every logged run of this stage is one
+    with instrument("overview_figures", dataset_id) as metrics:
+        metrics.cache = "miss"
+        metrics.read(chart_summary_path(dataset_id))
+        return _render_overview(load_chart_summary(dataset_id))
+
+
+def _counts(pairs, name=None):
+    index = pd.Index([value for value, _ in pairs], name=name)
+    return pd.Series([count for _, count in pairs], index=index, dtype="int64").sort_values(ascending=False)
+
+
+def _labelled(pairs, labels, name=None):
+    # Codes without a label are left out, as Series.map() + value_counts() would
+    counts = _counts([(labels[value], count) for value, count in pairs if value in labels], name)
+    return counts.groupby(level=0, sort=False).sum().sort_values(ascending=False)
+
+
+def _render_overview(charts):
+    numeric, categories = charts["numeric"], charts["categories"]
+    figures = {
+        "age": _hist_with_normal(numeric["age"], "skyblue", "Age Histogram with Normal Curve"),
+        "IQ": _hist_with_normal(numeric["IQ"], "lightgreen", "IQ Histogram with Normal Curve"),
+        "site": _barh(_counts(categories["site"], "site"), "lightcoral", "Site Distribution"),
+        "sex": _pie(_labelled(categories["sex"], {1: "Male", 2: "Female"}, "sex"), ["#8ecae6", "#f7a1a1"], "Sex Distribution"),
+    }
+    if "scanner_type" in categories:
+        figures["scanner_type"] = _barh(_counts(categories["scanner_type"], "scanner_type"), "mediumseagreen", "Scanner Type Distribution")
+    if "diagnosis" in categories:
+        figures["diagnosis"] = _pie(_labelled(categories["diagnosis"], {1: "ASD", 0: "TD"}, "diagnosis"), ["#ffb703", "#8ecae6"], "ASD vs TD Distribution")
+    return figures
+
+
+def overview_figures(dataset_id):
+    """Rendered PNGs for the Overview charts, drawn from the QC stage's chart summary alone"""
+    load_chart_summary(dataset_id)  # rebuilds the summary if it is missing or stale
+    return _overview_figures(dataset_id, file_digest(chart_summary_path(dataset_id)))
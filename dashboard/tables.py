@@ -0,0 +1,83 @@
+import numpy as np
+import streamlit as st
+
+from columnar import open_table
+from loaders import file_digest
+from schema import decode_codes
+
+# Large tables are never sent to the browser whole. Each CSV is opened as a
+# columnar cache (see columnar.open_table) and only the visible page of rows
+# is sliced out of it. Sorting and filtering go through the per-column
+# indexes stored in that cache, and the resulting row order is memoized, so
+# turning pages only reads the rows shown.
+PAGE_SIZES = [25, 50, 100, 250]
+MAX_TABLES = 16
+MAX_VIEWS = 32
+NO_SORT = "(file order)"
+NO_FILTER = "(no filter)"
+
+
+@st.cache_resource(max_entries=MAX_TABLES, show_spinner=False)
+def _open_table(csv_path, digest, dataset_id=None):
+    return open_table(csv_path, dataset_id)
+
+
+@st.cache_resource(max_entries=MAX_VIEWS, show_spinner=False)
+def _view_rows(csv_path, digest, dataset_id, filter_spec, sort, ascending):
+    """Row positions of a filtered (and possibly sorted) view, shared by all sessions"""
+    table = _open_table(csv_path, digest, dataset_id)
+    col, values, low, high, prefix = filter_spec
+    rows = table.filter_rows(col, values=list(values) if values else None, low=low, high=high, prefix=prefix)
+    if sort is None:
+        return np.sort(rows)
+    return table.sort_rows(rows, sort, ascending)
+
+
+def _filter_controls(table, col, key):
+    """Widgets for a filter on `col`; returns the hashable filter spec, or None while it is empty"""
+    spec = table.meta["columns"][col]
+    if spec["kind"] == "category":
+        values = st.multiselect(f"{col} is any of", spec["categories"], key=f"{key}_values")
+        return (col, tuple(values), None, None, None) if values else None
+    if spec["kind"] == "numeric":
+        bounds = st.columns(2)
+        low = bounds[0].number_input(f"{col} from", value=None, key=f"{key}_low")
+        high = bounds[1].number_input(f"{col} to", value=None, key=f"{key}_high")
+        return (col, (), low, high, None) if low is not None or high is not None else None
+    prefix = st.text_input(f"{col} starts with", "", key=f"{key}_prefix").strip()
+    return (col, (), None, None, prefix) if prefix else None
+
+
+def paged_table(csv_path, dataset_id=None, key="table", height=300):
+    """A sortable, filterable table of a CSV that only sends the visible page to the browser"""
+    digest = file_digest(csv_path)
+    table = _open_table(csv_path, digest, dataset_id)
+    columns = table.columns
+
+    controls = st.columns([2, 1, 2, 1])
+    sort = controls[0].selectbox("Sort by", [NO_SORT] + columns, key=f"{key}_sort")
+    sort = None if sort == NO_SORT else sort
+    ascending = controls[1].selectbox("Order", ["Ascending", "Descending"], key=f"{key}_order") == "Ascending"
+    filter_col = controls[2].selectbox("Filter", [NO_FILTER] + columns, key=f"{key}_filter")
+    page_size = controls[3].selectbox("Rows", PAGE_SIZES, index=1, key=f"{key}_page_size")
+    filter_spec = None if filter_col == NO_FILTER else _filter_controls(table, filter_col, f"{key}_{filter_col}")
+
+    rows = None
+    total = len(table)
+    if filter_spec is not None:
+        rows = _view_rows(csv_path, digest, dataset_id, filter_spec, sort, ascending)
+        total = len(rows)
+
+    n_pages = max(1, -(-total // page_size))
+    page = 1
+    if n_pages > 1:
+        page = st.number_input(f"Page (of {n_pages:,})", min_value=1, max_value=n_pages, value=1,
+                               key=f"{key}_page_{n_pages}")
+    start, stop = (page - 1) * page_size, min(page * page_size, total)
+
+    page_rows = table.window(start, stop, sort, ascending) if rows is None else rows[start:stop]
+    df_page = decode_codes(table.to_frame(categorical=True, rows=page_rows))
+    df_page.index = page_rows
+    st.dataframe(df_page, height=height)
+    st.caption(f"Rows {start + 1 if total else 0:,}–{stop:,} of {total:,}")
+    return total
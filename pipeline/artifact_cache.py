@@ -0,0 +1,284 @@
+import contextlib
+import fcntl
+import functools
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from atomic_io import temp_path
+from columnar import columnar_path
+from qc import state_path, chart_summary_path
+from qc_rules import load_rules
+from schema import load_schema
+from logging_utils import instrument
+
+# Outputs of every preprocess + QC run are kept under data/cache/, addressed by
+# what they were computed from: the raw file's hash, the pipeline code and the
+# dataset's QC rules and schema. A raw version seen before (a site re-sending
+# an old export, a user flipping between two versions) gets its outputs back
+# without rerunning anything.
+#   <key>/            one entry: cleaned CSV, columnar cache, QC report, flags,
+#                     QC state and chart summary, named as in artifacts()
+#   index.sqlite      key, dataset, raw hash, size and last use of each entry
+#   cache.lock        held while entries are added, restored or evicted
+# Files are hard-linked in and out of an entry when the filesystem allows it
+# (every writer replaces its outputs by rename, so a link is never written
+# through) and copied otherwise. Once the entries exceed MAX_CACHE_BYTES the
+# least recently used ones are evicted.
+CACHE_DIR = "data/cache"
+INDEX_PATH = os.path.join(CACHE_DIR, "index.sqlite")
+LOCK_PATH = os.path.join(CACHE_DIR, "cache.lock")
+MAX_CACHE_BYTES = 2 << 30
+# Modules whose code decides what the cached outputs contain
+CODE_FILES = ["preprocess.py", "qc.py", "qc_rules.py", "schema.py", "columnar.py", "streaming.py", "qc_incremental.py",
+              "preprocess_qc_runner.py"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    raw_hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+def artifacts(dataset_id):
+    """Entry name -> live path of every output an entry holds"""
+    return {
+        "cleaned.csv": f"data/cleaned/{dataset_id}_cleaned.csv",
+        "cleaned.cols": columnar_path(dataset_id),
+        "qc_report.txt": f"data/cleaned/{dataset_id}_qc_report.txt",
+        "qc_flags.csv": f"data/cleaned/{dataset_id}_qc_flags.csv",
+        "qc_state.json": state_path(dataset_id),
+        "qc_summary.json": chart_summary_path(dataset_id),
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """Hash of the pipeline modules listed in CODE_FILES (once per process: the code that is loaded)"""
+    digest = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in CODE_FILES:
+        with open(os.path.join(here, name), "rb") as f:
+            digest.update(name.encode() + b"\0" + f.read())
+    return digest.hexdigest()
+
+
+def cache_key(dataset_id, raw_hash):
+    """Content address of a dataset's outputs for one raw version under the current code, rules and schema"""
+    # The dataset name is part of the key: the QC report names its cleaned file
+    config = {
+        "dataset": dataset_id,
+        "raw_hash": raw_hash,
+        "code": code_version(),
+        "rules": load_rules(dataset_id),
+        "schema": load_schema(dataset_id),
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def entry_dir(key):
+    return os.path.join(CACHE_DIR, key)
+
+
+def connect(db_path=INDEX_PATH):
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+@contextlib.contextmanager
+def _locked():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(LOCK_PATH, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _place(src, dst):
+    """Hard-link (or copy, keeping the modification time) one file to `dst`"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _place_tree(src, dst):
+    """Mirror a file or a directory of files at a new path that must not exist yet"""
+    if os.path.isdir(src):
+        shutil.copytree(src, dst, copy_function=_place)
+    else:
+        _place(src, dst)
+
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path)
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _replace(src, dst):
+    """Move a finished file or directory over `dst`; a directory is swapped like ColumnarWriter.close() does"""
+    if os.path.isdir(src) and os.path.exists(dst):
+        old_path = temp_path(dst + ".old")
+        os.rename(dst, old_path)
+        os.rename(src, dst)
+        shutil.rmtree(old_path, ignore_errors=True)
+    else:
+        os.replace(src, dst)
+
+
+# --- Storing and restoring ---
+def store(dataset_id, raw_hash, max_bytes=MAX_CACHE_BYTES):
+    """Add a dataset's current outputs as the entry for `raw_hash`.
+
+    Returns the key, or None if an output is missing or the QC state was not
+    computed from `raw_hash`.
+    """
+    paths = artifacts(dataset_id)
+    if raw_hash is None or not all(os.path.exists(path) for path in paths.values()):
+        return None
+    with open(paths["qc_state.json"]) as f:
+        if json.load(f).get("raw_hash") != raw_hash:
+            return None
+    key = cache_key(dataset_id, raw_hash)
+    with _locked():
+        conn = connect()
+        try:
+            with conn:
+                if conn.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() and os.path.isdir(entry_dir(key)):
+                    conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+                    return key
+                tmp_dir = temp_path(entry_dir(key))
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                os.makedirs(tmp_dir)
+                try:
+                    for name, path in paths.items():
+                        _place_tree(path, os.path.join(tmp_dir, name))
+                    _remove(entry_dir(key))
+                    os.rename(tmp_dir, entry_dir(key))
+                finally:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                conn.execute("INSERT OR REPLACE INTO entries (key, dataset, raw_hash, size, created_at, last_used) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", (key, dataset_id, raw_hash, _size(entry_dir(key)),
+                                                           datetime.now().strftime("%Y-%m-%d %H:%M:%S"), time.time()))
+                _evict(conn, max_bytes)
+        finally:
+            conn.close()
+    return key
+
+
+def has_entry(dataset_id, raw_hash):
+    """True if the outputs for `raw_hash` are already cached"""
+    key = cache_key(dataset_id, raw_hash)
+    conn = connect()
+    try:
+        found = conn.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+    finally:
+        conn.close()
+    return found and os.path.isdir(entry_dir(key))
+
+
+def restore(dataset_id, raw_hash):
+    """Put back the outputs cached for `raw_hash`; returns True on a hit.
+
+    Callers hold the dataset's cleaned lock, as for any other write of these outputs.
+    """
+    if raw_hash is None:
+        return False
+    key = cache_key(dataset_id, raw_hash)
+    with instrument("artifact_cache", dataset_id) as metrics:
+        metrics.cache = "miss"
+        with _locked():
+            conn = connect()
+            try:
+                with conn:
+                    if conn.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is None:
+                        return False
+                    if not os.path.isdir(entry_dir(key)):
+                        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                        return False
+                    conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+
+                # Every artifact is staged next to its target before any target is replaced
+                staged = {}
+                try:
+                    for name, path in artifacts(dataset_id).items():
+                        staged[path] = temp_path(path)
+                        _remove(staged[path])
+                        _place_tree(os.path.join(entry_dir(key), name), staged[path])
+                    for path, tmp_path in staged.items():
+                        _replace(tmp_path, path)
+                finally:
+                    for tmp_path in staged.values():
+                        _remove(tmp_path)
+            finally:
+                conn.close()
+        metrics.cache = "hit"
+        metrics.read(entry_dir(key))
+    return True
+
+
+# --- Eviction ---
+def _evict(conn, max_bytes):
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry_dir(key), ignore_errors=True)
+        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        total -= size
+    return total
+
+
+def prune(max_bytes=MAX_CACHE_BYTES):
+    """Evict least recently used entries until the cache fits in `max_bytes`; returns the size left"""
+    with _locked():
+        conn = connect()
+        try:
+            with conn:
+                return _evict(conn, max_bytes)
+        finally:
+            conn.close()
+
+
+def entries():
+    conn = connect()
+    try:
+        return conn.execute("SELECT key, dataset, raw_hash, size, created_at, last_used FROM entries "
+                            "ORDER BY last_used DESC").fetchall()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("list", "prune", "clear"):
+        print("Usage: python artifact_cache.py list | prune [max_bytes] | clear")
+        sys.exit(1)
+
+    if sys.argv[1] == "list":
+        for key, dataset, raw_hash, size, created_at, last_used in entries():
+            used = datetime.fromtimestamp(last_used).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"{key[:12]}  {dataset:<30} raw {raw_hash[:12]}  {size / 1e6:>8.1f} MB  last used {used}")
+    else:
+        left = prune(int(sys.argv[2]) if sys.argv[1] == "prune" and len(sys.argv) > 2 else
+                     0 if sys.argv[1] == "clear" else MAX_CACHE_BYTES)
+        print(f"🧹 Artifact cache now holds {left / 1e6:.1f} MB")
@@ -0,0 +1,33 @@
+import contextlib
+import os
+import threading
+
+# Outputs that other sessions or processes may read while they are being
+# rewritten (cleaned CSV, QC report, flags and state) are written to a
+# temporary file next to the target and then renamed over it. A reader sees
+# the old file or the new one, never a partial write.
+
+
+def temp_path(path):
+    """A sibling temporary name unique to this process and thread"""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """Yield a temporary path to write instead of `path`; it replaces `path` only if the block succeeds"""
+    tmp_path = temp_path(path)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode="w", **kwargs):
+    """open() for writing whose result only becomes visible at `path` once the file is complete"""
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode, **kwargs) as f:
+            yield f
@@ -0,0 +1,198 @@
+import csv
+import hashlib
+import io
+import os
+import sqlite3
+import sys
+import pandas as pd
+
+import storage
+
+# data/audit/<id>_column_diff_history.csv stays the append-only, committed
+# history. Each append is indexed as one segment (a byte range of the CSV) in
+# a local SQLite file, so new rows are indexed without re-reading old ones and
+# queries never load the whole history.
+#
+# A compressed history (see storage.py) gets every append as one more complete
+# compressed stream, so each segment's byte range still decompresses on its own.
+AUDIT_COLUMNS = ["timestamp", "subjectkey", "column", "old_value", "new_value"]
+ADDED = "🆕 ADDED"
+REMOVED = "❌ REMOVED"
+TAIL_CHECK_BYTES = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    segment INTEGER NOT NULL,
+    timestamp TEXT,
+    subjectkey TEXT,
+    "column" TEXT,
+    old_value TEXT,
+    new_value TEXT
+);
+CREATE INDEX IF NOT EXISTS changes_subject ON changes (subjectkey, timestamp);
+CREATE INDEX IF NOT EXISTS changes_column ON changes ("column", timestamp);
+CREATE INDEX IF NOT EXISTS changes_timestamp ON changes (timestamp);
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    start_offset INTEGER NOT NULL,
+    end_offset INTEGER NOT NULL,
+    n_rows INTEGER NOT NULL,
+    tail_digest TEXT NOT NULL
+);
+"""
+
+
+def audit_csv_path(dataset_id):
+    return f"data/audit/{dataset_id}_column_diff_history.csv"
+
+
+def audit_index_path(dataset_id):
+    return f"data/audit/{dataset_id}_audit_index.sqlite"
+
+
+def _tail_digest(f, end):
+    start = max(0, end - TAIL_CHECK_BYTES)
+    f.seek(start)
+    return hashlib.sha256(f.read(end - start)).hexdigest()
+
+
+def _sync(conn, csv_path):
+    """Index whatever the CSV gained since the last segment; rebuild if it was rewritten"""
+    csv_path = storage.resolve(csv_path)
+    size = os.path.getsize(csv_path) if os.path.exists(csv_path) else 0
+    last = conn.execute("SELECT end_offset, tail_digest FROM segments ORDER BY id DESC LIMIT 1").fetchone()
+    offset = 0
+
+    with open(csv_path, "rb") if size else io.BytesIO() as f:
+        if last is not None:
+            offset, digest = last
+            if size < offset or _tail_digest(f, offset) != digest:
+                conn.execute("DELETE FROM changes")
+                conn.execute("DELETE FROM segments")
+                offset = 0
+        if size == offset:
+            return
+
+        f.seek(offset)
+        text = storage.decompress(f.read(size - offset), storage.codec_of(csv_path)).decode("utf-8")
+        tail_digest = _tail_digest(f, size)
+
+    rows = list(csv.reader(io.StringIO(text)))
+    if offset == 0 and rows:
+        rows = rows[1:]  # header
+    rows = [[value if value != "" else None for value in row[:5]] for row in rows if len(row) >= 5]
+
+    cur = conn.execute("INSERT INTO segments (start_offset, end_offset, n_rows, tail_digest) VALUES (?, ?, ?, ?)",
+                       (offset, size, len(rows), tail_digest))
+    segment = cur.lastrowid
+    conn.executemany('INSERT INTO changes (segment, timestamp, subjectkey, "column", old_value, new_value) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', [[segment] + row for row in rows])
+
+
+def connect(dataset_id):
+    index_path = audit_index_path(dataset_id)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    conn = sqlite3.connect(index_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _sync(conn, audit_csv_path(dataset_id))
+    return conn
+
+
+def append_changes(dataset_id, changes):
+    """Append audit records to the history CSV (never rewriting it) and index them"""
+    if not len(changes):
+        return 0
+    df_changes = pd.DataFrame(changes, columns=AUDIT_COLUMNS)
+    csv_path = audit_csv_path(dataset_id)
+
+    conn = connect(dataset_id)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            stored = storage.target(csv_path)
+            exists = os.path.exists(stored) and os.path.getsize(stored) > 0
+            text = df_changes.to_csv(header=not exists, index=False)
+            if exists and not storage.codec_of(stored):
+                with open(stored, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        text = "\n" + text
+            storage.append_bytes(csv_path, text.encode("utf-8"))
+            _sync(conn, csv_path)
+    finally:
+        conn.close()
+    return len(df_changes)
+
+
+def _where(subjectkey=None, column=None, since=None, until=None, kind=None):
+    clauses, params = [], []
+    if subjectkey is not None:
+        clauses.append("subjectkey = ?")
+        params.append(subjectkey)
+    if column is not None:
+        clauses.append('"column" = ?')
+        params.append(column)
+    if since is not None:
+        clauses.append("timestamp >= ?")
+        params.append(str(since))
+    if until is not None:
+        clauses.append("timestamp < ?")
+        params.append(str(until))
+    if kind == "added":
+        clauses.append('"column" = \'ROW_STATUS\' AND new_value = ?')
+        params.append(ADDED)
+    elif kind == "removed":
+        clauses.append('"column" = \'ROW_STATUS\' AND old_value = ?')
+        params.append(REMOVED)
+    elif kind == "modified":
+        clauses.append('"column" != \'ROW_STATUS\'')
+    elif kind is not None:
+        raise ValueError(f"Unknown change kind: {kind}")
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def query_changes(dataset_id, subjectkey=None, column=None, since=None, until=None, kind=None,
+                  limit=None, offset=0):
+    """Audit records matching the filters, in the order they were logged.
+
+    `since`/`until` compare against the "%Y-%m-%d %H:%M:%S" timestamps;
+    `kind` is one of "added", "removed" or "modified".
+    """
+    where, params = _where(subjectkey, column, since, until, kind)
+    sql = f'SELECT timestamp, subjectkey, "column", old_value, new_value FROM changes{where} ORDER BY id'
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params += [int(limit), int(offset)]
+    conn = connect(dataset_id)
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+    return pd.DataFrame(rows, columns=AUDIT_COLUMNS)
+
+
+def count_changes(dataset_id, subjectkey=None, column=None, since=None, until=None, kind=None):
+    where, params = _where(subjectkey, column, since, until, kind)
+    conn = connect(dataset_id)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM changes{where}", params).fetchone()[0]
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python audit_store.py <dataset_name> [--subject S] [--column C] [--since T] [--until T] [--kind K]")
+        sys.exit(1)
+
+    dataset_id = sys.argv[1].replace(".csv", "")
+    filters = {}
+    for flag, key in [("--subject", "subjectkey"), ("--column", "column"), ("--since", "since"),
+                      ("--until", "until"), ("--kind", "kind")]:
+        if flag in sys.argv:
+            filters[key] = sys.argv[sys.argv.index(flag) + 1]
+    print(query_changes(dataset_id, **filters).to_string(index=False))
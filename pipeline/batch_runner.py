@@ -0,0 +1,150 @@
+import contextlib
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from preprocess import load_raw, run_preprocess, save_cleaned
+from qc import run_qc
+from snapshot_compare import compare_snapshot
+from snapshot_store import manifest_path
+from columnar import load_cleaned
+from hash_registry import file_hash, stage_input, record_stage
+from artifact_cache import restore, store
+from logging_utils import instrument
+from storage import glob_csv
+from single_flight import dataset_lock
+
+# Per-dataset stage graph: stage -> stages it waits for. Snapshot compare only
+# reads the raw file, so it runs alongside preprocess rather than after QC.
+STAGES = {
+    "preprocess": [],
+    "qc": ["preprocess"],
+    "snapshot": [],
+}
+
+
+def _paths(dataset_id):
+    return {
+        "raw": f"data/raw/{dataset_id}.csv",
+        "cleaned": f"data/cleaned/{dataset_id}_cleaned.csv",
+        "report": f"data/cleaned/{dataset_id}_qc_report.txt",
+        "flags": f"data/cleaned/{dataset_id}_qc_flags.csv",
+        "snapshot": manifest_path(dataset_id),
+    }
+
+
+def _stage_io(dataset_id, stage):
+    """Input file whose hash decides whether a stage can be skipped, and the outputs it must leave behind"""
+    paths = _paths(dataset_id)
+    if stage == "preprocess":
+        return paths["raw"], [paths["cleaned"]]
+    if stage == "qc":
+        return paths["cleaned"], [paths["report"], paths["flags"]]
+    return paths["raw"], [paths["snapshot"]]
+
+
+def run_stage(dataset_id, stage, force=False):
+    """Run one stage for one dataset in a worker; returns (status, seconds, captured output)"""
+    start = time.perf_counter()
+    output = io.StringIO()
+    input_path, outputs = _stage_io(dataset_id, stage)
+    input_hash = file_hash(input_path)
+
+    if not force and input_hash == stage_input(dataset_id, stage) and all(os.path.exists(p) for p in outputs):
+        with instrument(stage, dataset_id) as metrics:
+            metrics.cache = "hit"
+        return "skipped", time.perf_counter() - start, ""
+
+    # Snapshot compare writes different outputs, so it can run alongside preprocess and QC
+    scope = "snapshot" if stage == "snapshot" else "cleaned"
+    with dataset_lock(dataset_id, (scope,)), contextlib.redirect_stdout(output):
+        if stage == "preprocess":
+            if restore(dataset_id, input_hash):
+                # The QC outputs came back with the cleaned CSV they were computed from
+                record_stage(dataset_id, "qc", file_hash(outputs[0]))
+            else:
+                save_cleaned(run_preprocess(load_raw(dataset_id), dataset_id), dataset_id)
+        elif stage == "qc":
+            raw_hash = stage_input(dataset_id, "preprocess")
+            run_qc(load_cleaned(dataset_id), dataset_id, raw_hash=raw_hash)
+            store(dataset_id, raw_hash)
+        else:
+            compare_snapshot(load_raw(dataset_id), dataset_id)
+
+    record_stage(dataset_id, stage, input_hash)
+    return "ran", time.perf_counter() - start, output.getvalue()
+
+
+def discover_datasets(raw_dir="data/raw"):
+    return [os.path.basename(p)[:-len(".csv")] for p in glob_csv(os.path.join(raw_dir, "*.csv"))]
+
+
+def run_batch(dataset_ids=None, workers=None, force=False):
+    """Run every stage of every dataset on a process pool, respecting stage dependencies.
+
+    Returns {dataset_id: {stage: (status, seconds)}}.
+    """
+    dataset_ids = dataset_ids or discover_datasets()
+    workers = workers or os.cpu_count() or 1
+    results = {d: {} for d in dataset_ids}
+    pending = {(d, stage) for d in dataset_ids for stage in STAGES}
+    running = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for node in sorted(pending):
+                dataset_id, stage = node
+                deps = [results[dataset_id].get(dep) for dep in STAGES[stage]]
+                if any(dep is None for dep in deps):
+                    continue
+                pending.discard(node)
+                if any(dep[0] in ("failed", "blocked") for dep in deps):
+                    results[dataset_id][stage] = ("blocked", 0.0)
+                    continue
+                running[pool.submit(run_stage, dataset_id, stage, force)] = node
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                dataset_id, stage = running.pop(future)
+                try:
+                    status, seconds, _ = future.result()
+                except Exception as e:
+                    print(f"⚠️ {stage} failed for {dataset_id}: {e}")
+                    status, seconds = "failed", 0.0
+                results[dataset_id][stage] = (status, seconds)
+
+    return results
+
+
+def format_table(results):
+    stages = list(STAGES)
+    width = max([len("dataset")] + [len(d) for d in results])
+    lines = [f"{'dataset':<{width}}  " + "  ".join(f"{s:<16}" for s in stages) + "  total"]
+    for dataset_id, stage_results in results.items():
+        cells = []
+        for stage in stages:
+            status, seconds = stage_results.get(stage, ("-", 0.0))
+            cells.append(f"{status + f' {seconds:.2f}s':<16}")
+        total = sum(seconds for _, seconds in stage_results.values())
+        lines.append(f"{dataset_id:<{width}}  " + "  ".join(cells) + f"  {total:.2f}s")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    workers = None
+    if "--workers" in args:
+        i = args.index("--workers")
+        workers = int(args[i + 1])
+        del args[i:i + 2]
+    force = "--force" in args
+    dataset_ids = [a.replace(".csv", "") for a in args if a != "--force"]
+
+    start = time.perf_counter()
+    results = run_batch(dataset_ids, workers, force)
+    print(format_table(results))
+    print(f"⏱️ {len(results)} dataset(s) in {time.perf_counter() - start:.2f}s wall time")
@@ -0,0 +1,492 @@
+import bisect
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import sys
+import threading
+import numpy as np
+import pandas as pd
+
+from atomic_io import atomic_open, atomic_path, temp_path
+from logging_utils import instrument
+from schema import read_csv, decode_codes
+from single_flight import dataset_lock
+from storage import resolve
+
+# Layout of data/cleaned/<id>_cleaned.cols/:
+#   meta.json          row count, column kinds/dtypes, categories, source CSV stat
+#   <col>.bin          numeric values (raw little-endian array, np.memmap-able)
+#   <col>.codes        int32 category codes, -1 for missing
+#   <col>.offsets      int64 start offsets into <col>.data (n + 1 entries)
+#   <col>.data         UTF-8 bytes of string values
+#   <col>.valid        uint8 mask, 0 where a string value is missing
+#
+# Sort/filter indexes, built on first use and kept until the cache is rewritten:
+#   <col>.order        int64 row positions in ascending value order, missing values last
+#   <col>.rank         int64 position of each row within <col>.order
+#   indexes.json       per column: rows with a value and, for categoricals, the
+#                      category order and how many rows each category has
+#   indexes.lock       flock()ed (and a per-object thread lock held) while an index is built
+#
+# Caches of the other CSVs the dashboard shows (raw files, flags) live under
+# TABLES_DIR/<source directory>/<name>.cols, see table_path().
+CATEGORICAL_COLUMNS = ["site", "scanner_type", "sex", "diagnosis"]
+FORMAT_VERSION = 1
+TABLES_DIR = "data/cleaned/.tables"
+
+
+def columnar_path(dataset_id):
+    return f"data/cleaned/{dataset_id}_cleaned.cols"
+
+
+def _pipeline_dataset(csv_path):
+    """The dataset whose pipeline writes the columnar cache of `csv_path` (its cleaned CSV), or None"""
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    if os.path.abspath(os.path.dirname(csv_path)) == os.path.abspath("data/cleaned") and name.endswith("_cleaned"):
+        return name[:-len("_cleaned")]
+    return None
+
+
+def table_path(csv_path):
+    """Columnar cache of any CSV shown by the dashboard; for a cleaned CSV this is columnar_path().
+
+    Other CSVs get theirs under TABLES_DIR by source directory
+    (data/raw/X.csv -> data/cleaned/.tables/raw/X.cols), so equal file names
+    in different directories never share a cache.
+    """
+    dataset_id = _pipeline_dataset(csv_path)
+    if dataset_id is not None:
+        return columnar_path(dataset_id)
+    directory = os.path.abspath(os.path.dirname(csv_path))
+    source = os.path.relpath(directory, os.path.abspath("data"))
+    if source.startswith(os.pardir):
+        source = os.path.join("_", directory.strip(os.sep))
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(TABLES_DIR, source, f"{name}.cols")
+
+
+def _source_stat(csv_path):
+    st = os.stat(resolve(csv_path))
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _to_python(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class ColumnarWriter:
+    """Append DataFrame chunks to a columnar directory, then publish it with close()"""
+
+    def __init__(self, path, categorical=CATEGORICAL_COLUMNS):
+        self.path = path
+        self.tmp_path = temp_path(path)
+        self.categorical = set(categorical)
+        self.columns = None
+        self.n_rows = 0
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+
+    def _file(self, col, ext):
+        return open(os.path.join(self.tmp_path, f"{col}.{ext}"), "ab")
+
+    def _init_columns(self, df):
+        self.columns = {}
+        for col in df.columns:
+            dtype = df[col].dtype
+            numeric = isinstance(dtype, np.dtype) and dtype.kind in "biuf"
+            if col in self.categorical or isinstance(dtype, pd.CategoricalDtype):
+                value_dtype = dtype.str if numeric else "object"
+                self.columns[col] = {"kind": "category", "value_dtype": value_dtype, "categories": [], "index": {}}
+            elif numeric:
+                self.columns[col] = {"kind": "numeric", "dtype": dtype.str}
+            else:
+                self.columns[col] = {"kind": "string", "offset": 0}
+                with self._file(col, "offsets") as f:
+                    f.write(np.zeros(1, dtype="<i8").tobytes())
+
+    def append(self, df):
+        if self.columns is None:
+            self._init_columns(df)
+        if list(df.columns) != list(self.columns):
+            raise ValueError("Columns changed between appended chunks")
+
+        for col, spec in self.columns.items():
+            values = df[col]
+            if spec["kind"] == "numeric":
+                if values.dtype.str != spec["dtype"]:
+                    raise ValueError(f"Column {col} changed dtype between chunks ({values.dtype.str} != {spec['dtype']})")
+                with self._file(col, "bin") as f:
+                    f.write(values.to_numpy().tobytes())
+
+            elif spec["kind"] == "category":
+                # Grow the dictionary in first-seen order; codes stay stable across chunks
+                inverse, uniques = pd.factorize(values, use_na_sentinel=True)
+                mapping = np.empty(len(uniques), dtype="<i4")
+                for i, value in enumerate(uniques):
+                    value = _to_python(value)
+                    if value not in spec["index"]:
+                        spec["index"][value] = len(spec["categories"])
+                        spec["categories"].append(value)
+                    mapping[i] = spec["index"][value]
+                codes = np.full(len(inverse), -1, dtype="<i4")
+                present = inverse >= 0
+                codes[present] = mapping[inverse[present]]
+                with self._file(col, "codes") as f:
+                    f.write(codes.astype("<i4").tobytes())
+
+            else:
+                valid = values.notna().to_numpy()
+                encoded = [str(v).encode("utf-8") if ok else b"" for v, ok in zip(values.to_numpy(dtype=object), valid)]
+                lengths = np.fromiter((len(b) for b in encoded), dtype="<i8", count=len(encoded))
+                offsets = spec["offset"] + np.cumsum(lengths)
+                spec["offset"] = int(offsets[-1]) if len(offsets) else spec["offset"]
+                with self._file(col, "data") as f:
+                    f.write(b"".join(encoded))
+                with self._file(col, "offsets") as f:
+                    f.write(offsets.astype("<i8").tobytes())
+                with self._file(col, "valid") as f:
+                    f.write(valid.astype("u1").tobytes())
+
+        self.n_rows += len(df)
+
+    def close(self, source_csv=None):
+        columns = {}
+        for col, spec in (self.columns or {}).items():
+            spec = {k: v for k, v in spec.items() if k not in ("index", "offset")}
+            columns[col] = spec
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "n_rows": self.n_rows,
+            "columns": columns,
+            "source": _source_stat(source_csv) if source_csv else None,
+        }
+        with open(os.path.join(self.tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        # Swap the finished directory in; readers holding the old one keep their open maps
+        old_path = None
+        if os.path.exists(self.path):
+            old_path = temp_path(self.path + ".old")
+            os.rename(self.path, old_path)
+        os.rename(self.tmp_path, self.path)
+        if old_path:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+
+def write_columnar(df, dataset_id, source_csv=None):
+    """Write a cleaned frame as a columnar cache next to its CSV"""
+    writer = ColumnarWriter(columnar_path(dataset_id))
+    writer.append(df)
+    writer.close(source_csv)
+
+
+class ColumnarDataset:
+    """Lazily memory-map the columns of a columnar cache; nothing is read until a column is used"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self._arrays = {}
+        self._lock = threading.Lock()
+
+    @property
+    def columns(self):
+        return list(self.meta["columns"])
+
+    def __len__(self):
+        return self.meta["n_rows"]
+
+    def _map(self, col, ext, dtype, length):
+        key = (col, ext)
+        if key not in self._arrays:
+            if length == 0:
+                self._arrays[key] = np.empty(0, dtype=dtype)
+            else:
+                self._arrays[key] = np.memmap(os.path.join(self.path, f"{col}.{ext}"), dtype=dtype, mode="r", shape=(length,))
+        return self._arrays[key]
+
+    def codes(self, col):
+        """Return the raw category codes and categories of a categorical column"""
+        spec = self.meta["columns"][col]
+        return self._map(col, "codes", "<i4", len(self)), spec["categories"]
+
+    def column(self, col, categorical=False, rows=None):
+        """Load one column, or only the row positions in `rows`"""
+        spec = self.meta["columns"][col]
+        n = len(self) if rows is None else len(rows)
+
+        if spec["kind"] == "numeric":
+            values = self._map(col, "bin", np.dtype(spec["dtype"]), len(self))
+            if rows is not None:
+                return pd.Series(np.asarray(values[rows]), name=col)
+            return pd.Series(values, name=col, copy=False)
+
+        if spec["kind"] == "category":
+            codes, categories = self.codes(col)
+            if rows is not None:
+                codes = codes[rows]
+            value_dtype = np.dtype(spec["value_dtype"]) if spec["value_dtype"] != "object" else object
+            categories = np.array(categories, dtype=value_dtype)
+            if categorical:
+                return pd.Series(pd.Categorical.from_codes(np.asarray(codes), categories=categories), name=col)
+            missing = codes < 0
+            values = categories[np.maximum(codes, 0)] if len(categories) else np.empty(n, dtype=value_dtype)
+            if missing.any():
+                values = values.astype(float if values.dtype.kind in "biuf" else object)
+                values[missing] = np.nan
+            return pd.Series(values, name=col)
+
+        offsets = self._map(col, "offsets", "<i8", len(self) + 1)
+        valid = self._map(col, "valid", "u1", len(self))
+        values = np.empty(n, dtype=object)
+        if rows is None:
+            data = bytes(self._map(col, "data", "u1", int(offsets[-1]))) if n else b""
+            bounds = offsets.tolist()
+            values[:] = [data[bounds[i]:bounds[i + 1]].decode("utf-8") for i in range(n)]
+        else:
+            rows = np.asarray(rows, dtype=np.int64)
+            valid = valid[rows]
+            data = self._map(col, "data", "u1", int(offsets[-1])) if n else b""
+            values[:] = [bytes(data[start:end]).decode("utf-8")
+                         for start, end in zip(offsets[rows].tolist(), offsets[rows + 1].tolist())]
+        values[np.asarray(valid) == 0] = np.nan
+        return pd.Series(values, name=col)
+
+    def to_frame(self, columns=None, categorical=False, rows=None):
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame({col: self.column(col, categorical, rows) for col in columns})
+
+    # --- Sort/filter indexes ---
+    def _index_meta(self):
+        path = os.path.join(self.path, "indexes.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _sort(self, col):
+        """(ascending row order with missing last, number of rows with a value, extra index info)"""
+        spec = self.meta["columns"][col]
+        if spec["kind"] == "numeric":
+            values = np.asarray(self._map(col, "bin", np.dtype(spec["dtype"]), len(self)))
+            order = np.argsort(values, kind="stable")
+            n_valid = int(np.count_nonzero(~np.isnan(values))) if values.dtype.kind == "f" else len(self)
+            return order, n_valid, {}
+
+        if spec["kind"] == "category":
+            codes, categories = self.codes(col)
+            codes = np.asarray(codes)
+            labels = sorted(range(len(categories)), key=lambda i: (not isinstance(categories[i], (int, float)), categories[i]))
+            position = np.empty(len(categories) + 1, dtype=np.int64)
+            position[labels] = np.arange(len(labels))
+            position[-1] = len(labels)  # code -1 (missing) sorts last
+            keys = position[codes]
+            order = np.argsort(keys, kind="stable")
+            counts = np.bincount(keys, minlength=len(labels) + 1)
+            return order, int(counts[:-1].sum()), {"labels": labels, "counts": counts[:-1].tolist()}
+
+        values = self.column(col).to_numpy()
+        valid = np.flatnonzero(pd.notna(values))
+        order = np.concatenate([valid[np.argsort(values[valid].astype(str), kind="stable")],
+                                np.flatnonzero(pd.isna(values))])
+        return order, len(valid), {}
+
+    @contextlib.contextmanager
+    def _index_lock(self):
+        """Serialize index builds: dashboard sessions share one dataset object, and processes share its directory"""
+        with self._lock, open(os.path.join(self.path, "indexes.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _saved_index(self, col):
+        info = self._index_meta().get(col)
+        return info if info is not None and os.path.exists(os.path.join(self.path, f"{col}.rank")) else None
+
+    def index(self, col):
+        """(order, rank, info) of a column, building and saving the index the first time it is asked for"""
+        key = (col, "index")
+        if key in self._arrays:
+            return self._arrays[key]
+        info = self._saved_index(col)
+        if info is None:
+            with self._index_lock():
+                # Another session may have built it while we waited
+                info = self._saved_index(col)
+                if info is None:
+                    order, n_valid, extra = self._sort(col)
+                    rank = np.empty(len(order), dtype="<i8")
+                    rank[order] = np.arange(len(order))
+                    for ext, values in (("order", order), ("rank", rank)):
+                        with atomic_path(os.path.join(self.path, f"{col}.{ext}")) as tmp_path:
+                            values.astype("<i8").tofile(tmp_path)
+                    info = {"n_valid": n_valid, **extra}
+                    indexes = self._index_meta()
+                    indexes[col] = info
+                    with atomic_open(os.path.join(self.path, "indexes.json")) as f:
+                        json.dump(indexes, f)
+        self._arrays[key] = (self._map(col, "order", "<i8", len(self)), self._map(col, "rank", "<i8", len(self)), info)
+        return self._arrays[key]
+
+    def build_indexes(self):
+        for col in self.columns:
+            self.index(col)
+
+    def _value_at(self, col, row):
+        spec = self.meta["columns"][col]
+        if spec["kind"] == "numeric":
+            return self._map(col, "bin", np.dtype(spec["dtype"]), len(self))[row]
+        offsets = self._map(col, "offsets", "<i8", len(self) + 1)
+        data = self._map(col, "data", "u1", int(offsets[-1]))
+        return bytes(data[offsets[row]:offsets[row + 1]]).decode("utf-8")
+
+    def filter_rows(self, col, values=None, low=None, high=None, prefix=None):
+        """Row positions matching a filter, found through the column's index.
+
+        Categorical columns match any of `values`, numeric columns the
+        inclusive range [low, high], string columns a `prefix`. Rows come
+        back in the column's sort order.
+        """
+        order, _, info = self.index(col)
+        spec = self.meta["columns"][col]
+        if spec["kind"] == "category":
+            categories = spec["categories"]
+            starts = np.concatenate([[0], np.cumsum(info["counts"])])
+            wanted = {i for i, value in enumerate(categories) if value in (values or [])}
+            ranges = [(starts[pos], starts[pos + 1]) for pos, i in enumerate(info["labels"]) if i in wanted]
+            if not ranges:
+                return np.empty(0, dtype=np.int64)
+            return np.concatenate([np.asarray(order[start:stop]) for start, stop in ranges])
+
+        # Binary search over the rows that have a value, in sorted order
+        n_valid = info["n_valid"]
+        sorted_values = _SortedValues(self, col, order, n_valid)
+        if spec["kind"] == "numeric":
+            start = 0 if low is None else bisect.bisect_left(sorted_values, low)
+            stop = n_valid if high is None else bisect.bisect_right(sorted_values, high)
+        else:
+            prefix = prefix or ""
+            start = bisect.bisect_left(sorted_values, prefix)
+            stop = bisect.bisect_left(sorted_values, prefix + "\U0010ffff")
+        return np.asarray(order[start:max(start, stop)])
+
+    def _positions(self, col, ascending, index):
+        """Map sort positions to ascending positions, keeping missing values last when descending"""
+        n_valid = self.index(col)[2]["n_valid"]
+        index = np.asarray(index)
+        if ascending:
+            return index
+        return np.where(index < n_valid, n_valid - 1 - index, index)
+
+    def sort_rows(self, rows, col, ascending=True):
+        """`rows` reordered by a column"""
+        rank = self.index(col)[1]
+        rows = np.asarray(rows, dtype=np.int64)
+        return rows[np.argsort(self._positions(col, ascending, rank[rows]), kind="stable")]
+
+    def window(self, start, stop, sort=None, ascending=True):
+        """Row positions start..stop of the whole table, optionally sorted by a column"""
+        stop = min(stop, len(self))
+        if sort is None:
+            return np.arange(start, stop, dtype=np.int64)
+        order = self.index(sort)[0]
+        return np.asarray(order[self._positions(sort, ascending, np.arange(start, stop))])
+
+
+class _SortedValues:
+    """Read-only sequence of a column's values in index order, for bisect"""
+
+    def __init__(self, dataset, col, order, n_valid):
+        self.dataset = dataset
+        self.col = col
+        self.order = order
+        self.n_valid = n_valid
+
+    def __len__(self):
+        return self.n_valid
+
+    def __getitem__(self, i):
+        return self.dataset._value_at(self.col, int(self.order[i]))
+
+
+def open_columnar(dataset_id, csv_path=None):
+    """Open the columnar cache for a dataset, or return None if it is missing or stale"""
+    path = columnar_path(dataset_id)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    dataset = ColumnarDataset(path)
+    if dataset.meta.get("format_version") != FORMAT_VERSION:
+        return None
+    csv_path = csv_path or f"data/cleaned/{dataset_id}_cleaned.csv"
+    if os.path.exists(csv_path) and dataset.meta.get("source") != _source_stat(csv_path):
+        return None
+    return dataset
+
+
+def _current_table(path, csv_path):
+    if os.path.exists(os.path.join(path, "meta.json")):
+        dataset = ColumnarDataset(path)
+        if dataset.meta.get("format_version") == FORMAT_VERSION and dataset.meta.get("source") == _source_stat(csv_path):
+            return dataset
+    return None
+
+
+def open_table(csv_path, dataset_id=None):
+    """Columnar cache of any CSV (cleaned, raw, flags), written from the CSV when missing or stale.
+
+    A cleaned CSV's cache is the pipeline's own, so it is only rebuilt under
+    the dataset's cleaned lock (see single_flight.py).
+    """
+    path = table_path(csv_path)
+    dataset = _current_table(path, csv_path)
+    if dataset is not None:
+        return dataset
+    owner = _pipeline_dataset(csv_path)
+    with dataset_lock(owner, ("cleaned",)) if owner else contextlib.nullcontext():
+        # A pipeline run we waited for may have written it
+        dataset = _current_table(path, csv_path)
+        if dataset is None:
+            writer = ColumnarWriter(path)
+            writer.append(read_csv(csv_path, dataset_id))
+            writer.close(csv_path)
+            dataset = ColumnarDataset(path)
+    return dataset
+
+
+def load_cleaned(dataset_id, columns=None):
+    """Load a cleaned dataset (or those of `columns` it has) from its columnar cache, falling back to parsing the CSV.
+
+    Either way string categories stay dictionary-encoded and numeric codes come back as plain columns.
+    """
+    with instrument("load_cleaned", dataset_id) as metrics:
+        dataset = open_columnar(dataset_id)
+        if dataset is not None:
+            metrics.cache = "hit"
+            metrics.read(dataset.path)
+            if columns is not None:
+                columns = [col for col in dataset.columns if col in columns]
+            df = decode_codes(dataset.to_frame(columns, categorical=True))
+        else:
+            metrics.cache = "miss"
+            cleaned_path = f"data/cleaned/{dataset_id}_cleaned.csv"
+            metrics.read(cleaned_path)
+            df = read_csv(cleaned_path, dataset_id, columns=columns)
+        metrics.rows(rows_out=len(df))
+    return df
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python columnar.py <dataset_name> [--index]")
+        sys.exit(1)
+
+    # Rebuild the cache from an existing cleaned CSV
+    dataset_id = sys.argv[1].replace(".csv", "").replace("_cleaned", "")
+    cleaned_path = f"data/cleaned/{dataset_id}_cleaned.csv"
+    write_columnar(read_csv(cleaned_path, dataset_id), dataset_id, cleaned_path)
+    print(f"🗂️ Columnar cache written to {columnar_path(dataset_id)}")
+    if "--index" in sys.argv:
+        ColumnarDataset(columnar_path(dataset_id)).build_indexes()
+        print("🗂️ Sort/filter indexes built for every column")
@@ -0,0 +1,126 @@
+import os
+import pickle
+import tempfile
+import numpy as np
+import pandas as pd
+
+# External sort of keyed frames that do not fit in memory. Input chunks are
+# sorted by their index and spilled to a scratch directory as runs: files
+# holding a sequence of pickled blocks of at most BLOCK_ROWS rows. Runs are
+# merged MAX_FAN_IN at a time until few enough remain to be merged in one
+# streaming pass. Memory is bounded by the input chunk size plus
+# MAX_FAN_IN blocks, whatever the number of rows.
+#
+# Equal keys keep their input order (chunks are sorted stably and earlier runs
+# win ties), so the first occurrence of a repeated key comes out first.
+BLOCK_ROWS = 10_000
+MAX_FAN_IN = 16
+
+
+def _sorted(df):
+    return df.iloc[np.argsort(df.index.to_numpy(), kind="stable")]
+
+
+def _write_run(path, blocks):
+    """Pickle a sorted stream of blocks into one run file; returns the rows written"""
+    n = 0
+    with open(path, "wb") as f:
+        for block in blocks:
+            for start in range(0, len(block), BLOCK_ROWS):
+                pickle.dump(block.iloc[start:start + BLOCK_ROWS], f, protocol=pickle.HIGHEST_PROTOCOL)
+            n += len(block)
+    return n
+
+
+def read_run(path):
+    """The blocks of a run file, in key order"""
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def key_ranges(streams):
+    """Cut sorted block streams into aligned pieces, one frame per stream per step.
+
+    Each step takes every row keyed up to the smallest last key that an
+    unfinished stream has buffered, so rows with the same key land in the same
+    step (unless one stream repeats a key across blocks). A stream with no rows
+    left gives an empty frame, or None if it never yielded a block.
+    """
+    streams = [iter(stream) for stream in streams]
+    buffers = [None] * len(streams)
+    while True:
+        for i, stream in enumerate(streams):
+            while stream is not None and (buffers[i] is None or not len(buffers[i])):
+                block = next(stream, None)
+                if block is None:
+                    streams[i] = stream = None
+                else:
+                    buffers[i] = block
+        live = [buffer for stream, buffer in zip(streams, buffers) if stream is not None]
+        if not live:
+            return
+        cutoff = min(buffer.index[-1] for buffer in live)
+
+        parts = []
+        for i, buffer in enumerate(buffers):
+            if buffer is None:
+                parts.append(None)
+                continue
+            n = buffer.index.searchsorted(cutoff, side="right")
+            parts.append(buffer.iloc[:n])
+            buffers[i] = buffer.iloc[n:]
+        yield parts
+
+
+def merge(streams):
+    """Merge sorted block streams into one sorted stream"""
+    for parts in key_ranges(streams):
+        parts = [part for part in parts if part is not None and len(part)]
+        if parts:
+            yield _sorted(pd.concat(parts)) if len(parts) > 1 else parts[0]
+
+
+def first_occurrences(blocks):
+    """Drop repeated keys from a sorted stream, keeping the first row of each"""
+    last = None
+    for block in blocks:
+        keep = ~block.index.duplicated()
+        if last is not None:
+            keep &= block.index != last
+        block = block[keep]
+        if len(block):
+            last = block.index[-1]
+            yield block
+
+
+def external_sort(chunks, scratch_dir, fan_in=MAX_FAN_IN):
+    """Sort keyed frames by index through run files in `scratch_dir`; returns a stream of sorted blocks.
+
+    The runs are written before this returns; the stream reads them back lazily
+    and `scratch_dir` must outlive it.
+    """
+    paths = []
+    for chunk in chunks:
+        if len(chunk):
+            fd, path = tempfile.mkstemp(suffix=".run", dir=scratch_dir)
+            os.close(fd)
+            _write_run(path, [_sorted(chunk)])
+            paths.append(path)
+
+    # --- Merge passes until one pass can merge what is left ---
+    while len(paths) > fan_in:
+        merged = []
+        for start in range(0, len(paths), fan_in):
+            group = paths[start:start + fan_in]
+            fd, path = tempfile.mkstemp(suffix=".run", dir=scratch_dir)
+            os.close(fd)
+            _write_run(path, merge([read_run(p) for p in group]))
+            for p in group:
+                os.remove(p)
+            merged.append(path)
+        paths = merged
+    return merge([read_run(p) for p in paths])
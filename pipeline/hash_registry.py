@@ -0,0 +1,220 @@
+import csv
+import hashlib
+import mmap
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+import storage
+
+# docs/data_change_log.csv stays the human-readable, committed log; the SQLite
+# file is a local index over it (rebuilt from the CSV whenever the CSV was
+# changed by something other than this module, e.g. a git pull).
+REGISTRY_PATH = "docs/hash_registry.sqlite"
+HASH_LOG_PATH = "docs/data_change_log.csv"
+BLOCK_SIZE = 8 << 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hash_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    path TEXT NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hash_log_path ON hash_log (path, id);
+CREATE TABLE IF NOT EXISTS file_state (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stage_state (
+    dataset TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    input_hash TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (dataset, stage)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _csv_stat(csv_path):
+    if not os.path.exists(csv_path):
+        return ""
+    stat = os.stat(csv_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _sync_from_csv(conn, csv_path):
+    """Rebuild the indexed log if the CSV changed behind the registry's back"""
+    row = conn.execute("SELECT value FROM meta WHERE key = 'csv_stat'").fetchone()
+    current = _csv_stat(csv_path)
+    if row is not None and row[0] == current:
+        return
+
+    entries = []
+    if os.path.exists(csv_path):
+        with open(csv_path, newline="") as f:
+            for fields in csv.reader(f):
+                if len(fields) >= 3:
+                    entries.append((fields[0], fields[1], fields[-1]))
+    conn.execute("DELETE FROM hash_log")
+    conn.executemany("INSERT INTO hash_log (timestamp, path, sha256) VALUES (?, ?, ?)", entries)
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('csv_stat', ?)", (current,))
+
+
+def connect(db_path=REGISTRY_PATH, csv_path=HASH_LOG_PATH):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _sync_from_csv(conn, csv_path)
+    return conn
+
+
+def compute_hash(filepath):
+    """SHA-256 of a file's content, read through mmap in large blocks (streamed through the codec if compressed)"""
+    if storage.codec_of(filepath):
+        return storage.content_hash(filepath)
+    hasher = hashlib.sha256()
+    size = os.path.getsize(filepath)
+    if size == 0:
+        return hasher.hexdigest()
+    with open(filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm) as view:
+            for start in range(0, size, BLOCK_SIZE):
+                hasher.update(view[start:start + BLOCK_SIZE])
+    return hasher.hexdigest()
+
+
+def file_hash(filepath, db_path=REGISTRY_PATH, csv_path=HASH_LOG_PATH):
+    """SHA-256 of a file, reusing the stored hash while (size, mtime_ns, inode) are unchanged.
+
+    A compressed file (see storage.py) can be named by its plain path and hashes
+    like its decompressed content.
+    """
+    filepath = storage.resolve(filepath)
+    key = os.path.realpath(filepath)
+    stat = os.stat(filepath)
+    conn = connect(db_path, csv_path)
+    try:
+        row = conn.execute("SELECT size, mtime_ns, inode, sha256 FROM file_state WHERE path = ?", (key,)).fetchone()
+        if row is not None and row[:3] == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            return row[3]
+        digest = compute_hash(filepath)
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO file_state (path, size, mtime_ns, inode, sha256) VALUES (?, ?, ?, ?, ?)",
+                         (key, stat.st_size, stat.st_mtime_ns, stat.st_ino, digest))
+        return digest
+    finally:
+        conn.close()
+
+
+def latest_hash(path, db_path=REGISTRY_PATH, csv_path=HASH_LOG_PATH):
+    """Most recently logged hash for a path, or None"""
+    conn = connect(db_path, csv_path)
+    try:
+        row = conn.execute("SELECT sha256 FROM hash_log WHERE path = ? ORDER BY id DESC LIMIT 1", (path,)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def record_hash(path, digest=None, timestamp=None, db_path=REGISTRY_PATH, csv_path=HASH_LOG_PATH):
+    """Append a (timestamp, path, hash) entry to the registry and the CSV log; returns the hash"""
+    digest = digest or file_hash(path, db_path, csv_path)
+    timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    log_line = f"{timestamp},{path},{digest}\n"
+
+    conn = connect(db_path, csv_path)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            _sync_from_csv(conn, csv_path)
+
+            # Append safely to hash log
+            if os.path.exists(csv_path) and os.path.getsize(csv_path) > 0:
+                with open(csv_path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        log_line = "\n" + log_line
+            with open(csv_path, "a") as f:
+                f.write(log_line)
+
+            conn.execute("INSERT INTO hash_log (timestamp, path, sha256) VALUES (?, ?, ?)", (timestamp, path, digest))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('csv_stat', ?)", (_csv_stat(csv_path),))
+    finally:
+        conn.close()
+    return digest
+
+
+def history(path_filter=None, db_path=REGISTRY_PATH, csv_path=HASH_LOG_PATH):
+    """All logged entries (oldest first), optionally only paths containing `path_filter`"""
+    conn = connect(db_path, csv_path)
+    try:
+        if path_filter:
+            return conn.execute("SELECT timestamp, path, sha256 FROM hash_log WHERE instr(path, ?) > 0 ORDER BY id",
+                                (path_filter,)).fetchall()
+        return conn.execute("SELECT timestamp, path, sha256 FROM hash_log ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+def stage_input(dataset, stage, db_path=REGISTRY_PATH, csv_path=HASH_LOG_PATH):
+    """Input hash a pipeline stage last completed with for a dataset, or None"""
+    conn = connect(db_path, csv_path)
+    try:
+        row = conn.execute("SELECT input_hash FROM stage_state WHERE dataset = ? AND stage = ?", (dataset, stage)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def record_stage(dataset, stage, input_hash, db_path=REGISTRY_PATH, csv_path=HASH_LOG_PATH):
+    """Remember the input hash a pipeline stage just completed with"""
+    conn = connect(db_path, csv_path)
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO stage_state (dataset, stage, input_hash, updated_at) VALUES (?, ?, ?, ?)",
+                         (dataset, stage, input_hash, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    finally:
+        conn.close()
+
+
+def export_csv(out_path=HASH_LOG_PATH, db_path=REGISTRY_PATH, csv_path=HASH_LOG_PATH):
+    """Write the full history in the data_change_log.csv layout"""
+    rows = history(db_path=db_path, csv_path=csv_path)
+    with open(out_path, "w") as f:
+        for timestamp, path, digest in rows:
+            f.write(f"{timestamp},{path},{digest}\n")
+    if os.path.abspath(out_path) == os.path.abspath(csv_path):
+        conn = connect(db_path, csv_path)
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('csv_stat', ?)", (_csv_stat(csv_path),))
+        finally:
+            conn.close()
+    return len(rows)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("hash", "latest", "export"):
+        print("Usage: python hash_registry.py hash <file> | latest <file> | export [out.csv]")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == "hash":
+        print(file_hash(sys.argv[2]))
+    elif command == "latest":
+        print(latest_hash(sys.argv[2]) or "")
+    else:
+        out_path = sys.argv[2] if len(sys.argv) > 2 else HASH_LOG_PATH
+        n = export_csv(out_path)
+        print(f"🔐 Exported {n} hash log entries to {out_path}")
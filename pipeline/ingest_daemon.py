@@ -0,0 +1,170 @@
+import fcntl
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from atomic_io import atomic_open
+from job_queue import QUEUE_PATH, submit, get_job, ensure_workers
+from storage import glob_csv, resolve, exists
+
+# Long-running ingestion service: polls data/raw/*.csv (plain or compressed, see
+# storage.py) with os.stat() only and queues a pipeline job (see job_queue.py)
+# for every file that appears or changes, so cleaned and QC outputs are ready
+# before anyone opens the dataset. A file is only queued once it has settled:
+# its size and mtime unchanged and its mtime at least SETTLE_S old, so an export
+# still being copied in is not picked up half-written. Uploads still being
+# written under a temporary name are ignored.
+#
+# data/jobs/ingest_status.json, rewritten on every poll, is what the dashboard
+# reads:
+#   pid, started_at, heartbeat (epoch seconds), poll_s, settle_s
+#   files   {dataset: {stat: [size, mtime_ns], state, job_id, stage, progress,
+#                      error, updated_at}}
+#           state: settling -> queued -> running -> done | failed
+# A file whose stat matches a finished entry is not queued again, also across
+# restarts. Only one service runs at a time (data/jobs/ingest.lock).
+RAW_DIR = "data/raw"
+STATUS_PATH = "data/jobs/ingest_status.json"
+LOCK_PATH = "data/jobs/ingest.lock"
+POLL_S = 2.0
+SETTLE_S = 5.0
+# The dashboard treats the service as stopped once its heartbeat is this old
+STALE_S = 30.0
+FINISHED = ("done", "failed")
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _stat(path):
+    st = os.stat(resolve(path))
+    return [st.st_size, st.st_mtime_ns]
+
+
+# --- Reading the status (dashboard side) ---
+def load_status(status_path=STATUS_PATH):
+    """The service's last status, or None if it never ran"""
+    if not os.path.exists(status_path):
+        return None
+    with open(status_path) as f:
+        return json.load(f)
+
+
+def is_alive(status):
+    return status is not None and time.time() - status["heartbeat"] < STALE_S
+
+
+def dataset_status(dataset_id, status_path=STATUS_PATH):
+    """The running service's entry for a dataset, or None"""
+    status = load_status(status_path)
+    return status["files"].get(dataset_id) if is_alive(status) else None
+
+
+def is_current(dataset_id, status_path=STATUS_PATH):
+    """True if the running service has already processed the raw file as it is now"""
+    entry = dataset_status(dataset_id, status_path)
+    raw_path = os.path.join(RAW_DIR, f"{dataset_id}.csv")
+    return entry is not None and entry["state"] == "done" and exists(raw_path) and entry["stat"] == _stat(raw_path)
+
+
+# --- Service ---
+class Watcher:
+    """Poll state of the raw directory: one entry per dataset file"""
+
+    def __init__(self, raw_dir=RAW_DIR, settle_s=SETTLE_S, db_path=QUEUE_PATH, files=None):
+        self.raw_dir = raw_dir
+        self.settle_s = settle_s
+        self.db_path = db_path
+        self.files = files or {}
+        self.changed_at = {}
+
+    def scan(self):
+        """Stat every raw file, queue the settled ones that changed, and follow their jobs"""
+        now = time.time()
+        files = {}
+        for path in glob_csv(os.path.join(self.raw_dir, "*.csv")):
+            dataset_id = os.path.basename(path)[:-len(".csv")]
+            try:
+                stat = _stat(path)
+            except FileNotFoundError:
+                continue
+            entry = self.files.get(dataset_id)
+            if entry is None or entry["stat"] != stat:
+                # New or changed: the settle clock runs from its last modification
+                entry = {"stat": stat, "state": "settling", "job_id": None, "stage": None, "progress": 0.0,
+                         "error": None, "updated_at": _now()}
+                self.changed_at[dataset_id] = max(stat[1] / 1e9, now if dataset_id in self.files else 0)
+            files[dataset_id] = entry
+        self.files = files
+
+        for dataset_id, entry in files.items():
+            if entry["state"] == "settling":
+                if now - self.changed_at.get(dataset_id, 0) >= self.settle_s:
+                    entry.update(state="queued", job_id=submit("pipeline", dataset_id, rerun=True, db_path=self.db_path),
+                                 updated_at=_now())
+                    ensure_workers(db_path=self.db_path)
+                    print(f"📥 {dataset_id} changed — queued pipeline job {entry['job_id']}")
+            elif entry["state"] not in FINISHED:
+                self._follow(dataset_id, entry)
+        return files
+
+    def _follow(self, dataset_id, entry):
+        job = get_job(entry["job_id"], self.db_path) if entry["job_id"] else None
+        if job is None:
+            entry.update(state="failed", error="Job not found in the queue", updated_at=_now())
+            return
+        if (job["status"], job["stage"], job["progress"]) != (entry["state"], entry["stage"], entry["progress"]):
+            entry.update(state=job["status"], stage=job["stage"], progress=job["progress"], error=job["error"],
+                         updated_at=_now())
+            if job["status"] == "done":
+                print(f"✅ {dataset_id} processed (job {job['id']})")
+            elif job["status"] == "failed":
+                print(f"⚠️ {dataset_id} failed (job {job['id']}): {job['error']}")
+
+
+def write_status(watcher, started_at, poll_s, status_path=STATUS_PATH):
+    with atomic_open(status_path) as f:
+        json.dump({"pid": os.getpid(), "started_at": started_at, "heartbeat": time.time(), "poll_s": poll_s,
+                   "settle_s": watcher.settle_s, "files": watcher.files}, f, indent=1)
+
+
+def run(raw_dir=RAW_DIR, poll_s=POLL_S, settle_s=SETTLE_S, status_path=STATUS_PATH, db_path=QUEUE_PATH, once=False):
+    """Watch `raw_dir` until interrupted (or for a single poll with `once`); returns False if a service is already running"""
+    os.makedirs(os.path.dirname(LOCK_PATH), exist_ok=True)
+    with open(LOCK_PATH, "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(f"⚠️ An ingestion service is already running (see {status_path})")
+            return False
+
+        # Finished entries carry over, so files processed before a restart are not queued again
+        previous = load_status(status_path)
+        watcher = Watcher(raw_dir, settle_s, db_path, previous["files"] if previous else None)
+        started_at = _now()
+        print(f"👀 Watching {raw_dir} every {poll_s:g}s (files settle after {settle_s:g}s)")
+        try:
+            while True:
+                watcher.scan()
+                write_status(watcher, started_at, poll_s, status_path)
+                if once:
+                    return True
+                time.sleep(poll_s)
+        except KeyboardInterrupt:
+            print("👋 Ingestion service stopped.")
+            return True
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "-h" in args or "--help" in args:
+        print("Usage: python ingest_daemon.py [--poll SECONDS] [--settle SECONDS] [--once]")
+        sys.exit(0)
+
+    poll_s = float(args[args.index("--poll") + 1]) if "--poll" in args else POLL_S
+    settle_s = float(args[args.index("--settle") + 1]) if "--settle" in args else SETTLE_S
+    if not run(poll_s=poll_s, settle_s=settle_s, once="--once" in args):
+        sys.exit(1)
@@ -0,0 +1,276 @@
+import contextlib
+import io
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+from logging_utils import stage_listener
+from preprocess_qc_runner import run_pipeline
+
+# Local job queue for work the dashboard must not block on (pipeline runs
+# after an upload or a dataset switch). Jobs live in a SQLite file shared by
+# every dashboard session and by the worker processes that run them:
+#   jobs      one row per submitted job: kind, dataset, status
+#             (queued -> running -> done | failed), progress 0..1, the stage
+#             running now, captured output and error
+#   workers   pid and last heartbeat of each worker process
+# Workers are started on demand by ensure_workers() and exit once they have
+# been idle for IDLE_EXIT_S. A running job whose worker stopped heartbeating
+# is marked failed. Two jobs for the same dataset never run at once.
+QUEUE_PATH = "data/jobs/queue.sqlite"
+WORKER_LOG_PATH = "data/jobs/worker.log"
+MAX_WORKERS = 2
+POLL_S = 0.5
+HEARTBEAT_S = 2.0
+STALE_S = 30.0
+IDLE_EXIT_S = 120.0
+MAX_OUTPUT_CHARS = 20000
+ACTIVE = ("queued", "running")
+
+# Job kind -> function(dataset) it runs, and the stages that make up its progress
+JOB_KINDS = {
+    "pipeline": (run_pipeline, ["read_raw", "snapshot", "preprocess", "save_cleaned", "qc"]),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    stage TEXT,
+    submitted_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    worker INTEGER,
+    output TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS jobs_dataset ON jobs (dataset, id);
+CREATE TABLE IF NOT EXISTS workers (
+    pid INTEGER PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    last_seen REAL NOT NULL
+);
+"""
+JOB_FIELDS = ["id", "kind", "dataset", "status", "progress", "stage", "submitted_at", "started_at",
+              "finished_at", "worker", "output", "error"]
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def connect(db_path=QUEUE_PATH):
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _as_job(row):
+    return dict(zip(JOB_FIELDS, row)) if row else None
+
+
+def _update(job_id, db_path=QUEUE_PATH, **fields):
+    conn = connect(db_path)
+    try:
+        with conn:
+            assignments = ", ".join(f"{name} = ?" for name in fields)
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+    finally:
+        conn.close()
+
+
+# --- Submitting and polling ---
+def submit(kind, dataset, rerun=False, db_path=QUEUE_PATH):
+    """Queue a job and return its id.
+
+    A job already queued for the same kind and dataset is reused. So is one
+    already running, unless `rerun` asks for a fresh run after it (e.g. the
+    raw file was just replaced).
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind {kind!r}")
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            statuses = ("queued",) if rerun else ACTIVE
+            row = conn.execute(f"SELECT id FROM jobs WHERE kind = ? AND dataset = ? AND status IN ({','.join('?' * len(statuses))}) "
+                               "ORDER BY id DESC LIMIT 1", (kind, dataset, *statuses)).fetchone()
+            if row:
+                return row[0]
+            cursor = conn.execute("INSERT INTO jobs (kind, dataset, status, submitted_at) VALUES (?, ?, 'queued', ?)",
+                                  (kind, dataset, _now()))
+            return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def get_job(job_id, db_path=QUEUE_PATH):
+    conn = connect(db_path)
+    try:
+        return _as_job(conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone())
+    finally:
+        conn.close()
+
+
+def latest_job(dataset, kind="pipeline", db_path=QUEUE_PATH):
+    """Most recently submitted job for a dataset, or None"""
+    conn = connect(db_path)
+    try:
+        return _as_job(conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE dataset = ? AND kind = ? "
+                                    "ORDER BY id DESC LIMIT 1", (dataset, kind)).fetchone())
+    finally:
+        conn.close()
+
+
+def recent_jobs(limit=20, db_path=QUEUE_PATH):
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [_as_job(row) for row in rows]
+    finally:
+        conn.close()
+
+
+# --- Workers ---
+def _live_workers(conn):
+    return [pid for (pid,) in conn.execute("SELECT pid FROM workers WHERE last_seen >= ?", (time.time() - STALE_S,))]
+
+
+def ensure_workers(n=MAX_WORKERS, db_path=QUEUE_PATH):
+    """Start worker processes until `n` are alive; returns how many were started"""
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM workers WHERE last_seen < ?", (time.time() - STALE_S,))
+            missing = n - len(_live_workers(conn))
+            os.makedirs(os.path.dirname(WORKER_LOG_PATH), exist_ok=True)
+            with open(WORKER_LOG_PATH, "a") as log:
+                for _ in range(max(0, missing)):
+                    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker", "--db", db_path],
+                                               stdout=log, stderr=log, stdin=subprocess.DEVNULL, start_new_session=True)
+                    # Registered right away so concurrent callers count it before it has started
+                    conn.execute("INSERT OR REPLACE INTO workers (pid, started_at, last_seen) VALUES (?, ?, ?)",
+                                 (process.pid, _now(), time.time()))
+        return max(0, missing)
+    finally:
+        conn.close()
+
+
+def _beat(pid, db_path):
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO workers (pid, started_at, last_seen) VALUES "
+                         "(?, COALESCE((SELECT started_at FROM workers WHERE pid = ?), ?), ?)",
+                         (pid, pid, _now(), time.time()))
+    finally:
+        conn.close()
+
+
+def _heartbeat(pid, db_path, stop):
+    while not stop.wait(HEARTBEAT_S):
+        _beat(pid, db_path)
+
+
+def _claim(pid, db_path):
+    """Take the oldest queued job whose dataset has nothing running; None if there is none"""
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Jobs left running by a worker that stopped heartbeating
+            live = _live_workers(conn)
+            conn.execute(f"UPDATE jobs SET status = 'failed', finished_at = ?, error = 'Worker stopped responding' "
+                         f"WHERE status = 'running' AND worker NOT IN ({','.join('?' * len(live))})", (_now(), *live))
+            row = conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE status = 'queued' AND dataset NOT IN "
+                               "(SELECT dataset FROM jobs WHERE status = 'running') ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ?, worker = ? WHERE id = ?",
+                         (_now(), pid, row[0]))
+            return _as_job(row)
+    finally:
+        conn.close()
+
+
+def run_job(job, db_path=QUEUE_PATH):
+    """Run one claimed job, recording its stage, progress, output and outcome"""
+    fn, stages = JOB_KINDS[job["kind"]]
+    finished = set()
+
+    def progress(stage, dataset, event):
+        stage = "qc" if stage == "qc_incremental" else stage
+        if event == "start":
+            _update(job["id"], db_path, stage=stage)
+        elif stage in stages:
+            finished.add(stage)
+            _update(job["id"], db_path, progress=len(finished) / len(stages))
+
+    output = io.StringIO()
+    try:
+        with stage_listener(progress), contextlib.redirect_stdout(output):
+            fn(job["dataset"])
+    except Exception as e:
+        _update(job["id"], db_path, status="failed", finished_at=_now(), error=f"{type(e).__name__}: {e}",
+                output=output.getvalue()[-MAX_OUTPUT_CHARS:])
+        return False
+    _update(job["id"], db_path, status="done", progress=1.0, stage=None, finished_at=_now(),
+            output=output.getvalue()[-MAX_OUTPUT_CHARS:])
+    return True
+
+
+def worker(db_path=QUEUE_PATH, idle_exit=IDLE_EXIT_S):
+    """Run queued jobs until none has arrived for `idle_exit` seconds"""
+    pid = os.getpid()
+    _beat(pid, db_path)
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(pid, db_path, stop), daemon=True).start()
+    idle_since = time.monotonic()
+    try:
+        while time.monotonic() - idle_since < idle_exit:
+            job = _claim(pid, db_path)
+            if job is None:
+                time.sleep(POLL_S)
+                continue
+            run_job(job, db_path)
+            idle_since = time.monotonic()
+    finally:
+        stop.set()
+        conn = connect(db_path)
+        try:
+            with conn:
+                conn.execute("DELETE FROM workers WHERE pid = ?", (pid,))
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or args[0] not in ("worker", "submit", "status"):
+        print("Usage: python job_queue.py worker [--db PATH] | submit <dataset> | status [job_id]")
+        sys.exit(1)
+
+    db_path = args[args.index("--db") + 1] if "--db" in args else QUEUE_PATH
+    if args[0] == "worker":
+        worker(db_path)
+    elif args[0] == "submit":
+        job_id = submit("pipeline", args[1].replace(".csv", ""), rerun=True, db_path=db_path)
+        ensure_workers(db_path=db_path)
+        print(f"📥 Queued pipeline job {job_id} for {args[1]}")
+    else:
+        jobs = [get_job(int(args[1]), db_path)] if len(args) > 1 and args[1] != "--db" else recent_jobs(db_path=db_path)
+        for job in filter(None, jobs):
+            print(f"{job['id']:>5}  {job['dataset']:<30} {job['status']:<8} {job['progress']:>4.0%}  "
+                  f"{job['stage'] or ''}  {job['error'] or ''}")
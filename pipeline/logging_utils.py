@@ -1,57 +1,209 @@
-import hashlib
+import contextlib
 import datetime
+import json
 import os
+import resource
+import sys
+import threading
+import time
 
-def hash_file(filepath):
-    """Generate MD5 hash of a file"""
-    with open(filepath, "rb") as f:
-        return hashlib.md5(f.read()).hexdigest()
+import hash_registry
+import storage
+import version_compare
 
-def log_data_change(input_file, log_file="docs/data_change_log.csv"):
-    """Log the hash and timestamp of data input"""
-    file_hash = hash_file(input_file)
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    filename = os.path.basename(input_file)
+# --- Stage instrumentation ---
+# Every pipeline stage runs inside instrument(), which appends one JSON line per
+# run to METRICS_PATH: wall and CPU time, peak RSS, rows in/out, bytes read and
+# written, and whether a cache was hit. Once the log passes METRICS_MAX_BYTES it
+# is rotated to METRICS_PATH + ".1" (replacing the previous rotation), so at most
+# two generations are kept.
+METRICS_PATH = "docs/pipeline_metrics.jsonl"
+METRICS_MAX_BYTES = 5_000_000
+_local = threading.local()
 
-    log_entry = f"{timestamp},{filename},{file_hash}\n"
+def _reset_peak_rss():
+    """Reset the kernel's resident-set high-water mark (Linux); False where unsupported"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
 
-    # Append to the log file
-    with open(log_file, "a") as f:
-        f.write(log_entry)
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (since the last reset on Linux)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
 
-    print(f"🔐 Logged hash for {filename}")
+def rss_mb():
+    """Current resident set size in MB, or None where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return None
+
+def _size(path):
+    path = storage.resolve(path)
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(d, name)) for d, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+class StageMetrics:
+    """Counters a stage fills in while it runs"""
+
+    def __init__(self, stage, dataset):
+        self.stage = stage
+        self.dataset = dataset
+        self.rows_in = None
+        self.rows_out = None
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.cache = None
+        self.peak_seen = 0.0
+        self.wall_s = self.cpu_s = self.peak_rss_mb = None
+
+    def rows(self, rows_in=None, rows_out=None):
+        if rows_in is not None:
+            self.rows_in = int(rows_in)
+        if rows_out is not None:
+            self.rows_out = int(rows_out)
+
+    def read(self, *paths):
+        self.bytes_read += sum(_size(p) for p in paths)
+
+    def wrote(self, *paths):
+        self.bytes_written += sum(_size(p) for p in paths)
 
-def append_version_comparison_to_changelog(version1, version2, added, removed, changelog_path="CHANGELOG.md"):
-    log_id = f"`{version1}` → `{version2}`"
-
-    # Read existing log content
-    if os.path.exists(changelog_path):
-        with open(changelog_path, "r") as f:
-            changelog = f.read()
-    else:
-        changelog = ""
-
-    # Skip if already logged
-    if log_id in changelog:
-        print(f"⚠️ Comparison {log_id} already logged. Skipping.")
-        return False
 
-    # Generate new log entry
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    header = f"\n## 🔄 Comparison: {log_id} — {timestamp}\n"
+@contextlib.contextmanager
+def instrument(stage, dataset, metrics_path=METRICS_PATH):
+    """Measure one stage run and append it to the metrics log, also when it fails.
 
-    body = []
-    if added:
-        body.append(f"- 🆕 Added subjects: {', '.join(sorted(added))}")
-    if removed:
-        body.append(f"- ❌ Removed subjects: {', '.join(sorted(removed))}")
-    if not body:
-        body.append("- ✅ No changes in subject IDs")
+    The yielded StageMetrics also carries wall_s, cpu_s and peak_rss_mb once
+    the block exits; with metrics_path=None nothing is written. Stages may
+    nest; an outer stage's peak RSS covers its inner stages. The high-water
+    mark is per process, so concurrent stages in other threads (e.g.
+    dashboard sessions) can inflate each other's peak.
+    """
+    stack = _local.__dict__.setdefault("stack", [])
+    listener = getattr(_local, "listener", None)
+    if listener is not None:
+        listener(stage, dataset, "start")
+    if stack:
+        stack[-1].peak_seen = max(stack[-1].peak_seen, peak_rss_mb())
+    _reset_peak_rss()
+    metrics = StageMetrics(stage, dataset)
+    stack.append(metrics)
 
-    log_entry = header + "\n".join(body) + "\n"
+    status, error = "ok", None
+    started = datetime.datetime.now()
+    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+    try:
+        yield metrics
+    except BaseException as e:
+        status, error = "error", f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        wall, cpu = time.perf_counter() - wall_start, time.thread_time() - cpu_start
+        peak = max(metrics.peak_seen, peak_rss_mb())
+        stack.pop()
+        if stack:
+            stack[-1].peak_seen = max(stack[-1].peak_seen, peak)
+        metrics.wall_s, metrics.cpu_s, metrics.peak_rss_mb = wall, cpu, peak
 
-    with open(changelog_path, "a") as f:
-        f.write(log_entry)
+        record = {
+            "timestamp": started.strftime("%Y-%m-%d %H:%M:%S"),
+            "dataset": dataset,
+            "stage": stage,
+            "status": status,
+            "wall_s": round(wall, 4),
+            "cpu_s": round(cpu, 4),
+            "peak_rss_mb": round(peak, 1),
+            "rows_in": metrics.rows_in,
+            "rows_out": metrics.rows_out,
+            "bytes_read": metrics.bytes_read,
+            "bytes_written": metrics.bytes_written,
+            "cache": metrics.cache,
+            "pid": os.getpid(),
+            "error": error,
+        }
+        if metrics_path:
+            write_metrics(record, metrics_path)
+        if listener is not None:
+            listener(stage, dataset, status)
+
+@contextlib.contextmanager
+def stage_listener(callback):
+    """Call callback(stage, dataset, event) as stages in this thread start ("start") and end ("ok"/"error")"""
+    previous = getattr(_local, "listener", None)
+    _local.listener = callback
+    try:
+        yield
+    finally:
+        _local.listener = previous
+
+def _rotate_metrics(metrics_path):
+    """Move a log past METRICS_MAX_BYTES aside to metrics_path + ".1" """
+    try:
+        if os.path.getsize(metrics_path) > METRICS_MAX_BYTES:
+            os.replace(metrics_path, metrics_path + ".1")
+    except FileNotFoundError:
+        pass  # not written yet, or another writer rotated it first
+
+def write_metrics(record, metrics_path=METRICS_PATH):
+    """Append one JSON line; a single O_APPEND write keeps concurrent writers from interleaving"""
+    os.makedirs(os.path.dirname(metrics_path) or ".", exist_ok=True)
+    _rotate_metrics(metrics_path)
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+    if os.path.exists(metrics_path) and os.path.getsize(metrics_path) > 0:
+        with open(metrics_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                line = b"\n" + line
+    fd = os.open(metrics_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+def read_metrics(dataset=None, stage=None, metrics_path=METRICS_PATH):
+    """All recorded stage runs (oldest first, rotated log included), optionally for one dataset and/or stage"""
+    records = []
+    for path in (metrics_path + ".1", metrics_path):
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a torn last line from an interrupted run
+                if (dataset is None or record.get("dataset") == dataset) and (stage is None or record.get("stage") == stage):
+                    records.append(record)
+    return records
+
+def hash_file(filepath):
+    """Generate SHA-256 hash of a file (cached by the hash registry)"""
+    return hash_registry.file_hash(filepath)
+
+def log_data_change(input_file, log_file="docs/data_change_log.csv"):
+    """Log the hash and timestamp of data input"""
+    hash_registry.record_hash(input_file, csv_path=log_file)
+    print(f"🔐 Logged hash for {os.path.basename(input_file)}")
+
+def append_version_comparison_to_changelog(version1, version2, added, removed, changelog_path="CHANGELOG.md"):
+    """Log a comparison to the changelog once; the index of logged comparisons replaces a text search"""
+    if not version_compare.log_comparison(version1, version2, added, removed, changelog_path=changelog_path):
+        print(f"⚠️ Comparison {version_compare.comparison_id(version1, version2)} already logged. Skipping.")
+        return False
 
     print("✅ CHANGELOG.md updated from dashboard.")
     return True
@@ -0,0 +1,74 @@
+import os
+import sys
+
+import storage
+from audit_store import audit_csv_path
+from single_flight import dataset_lock
+from snapshot_store import legacy_snapshot_path, store_dir
+
+# Converts the files storage.py manages that already exist (raw files, snapshot
+# versions, legacy snapshots and audit histories) to one codec, dataset by
+# dataset under the dataset's locks, so no pipeline run reads a file while it is
+# swapped. Each file is only replaced once the converted copy decompresses to
+# the same content. Content hashes, and so every "unchanged" check, are
+# unaffected; the audit and subject indexes notice the rewritten histories and
+# re-index them on next use.
+CODEC_NAMES = {"gz": "gz", "xz": "xz", "bz2": "bz2", "none": None}
+
+
+def datasets():
+    """Every dataset with a raw file, snapshots or an audit history"""
+    names = {os.path.basename(p)[:-len(".csv")] for p in storage.glob_csv("data/raw/*.csv")}
+    names.update(os.path.basename(os.path.dirname(p)) for p in storage.glob_csv("data/snapshots/*/v*.csv"))
+    names.update(os.path.basename(p)[:-len("_snapshot.csv")] for p in storage.glob_csv("data/snapshots/*_snapshot.csv"))
+    names.update(os.path.basename(p)[:-len("_column_diff_history.csv")]
+                 for p in storage.glob_csv("data/audit/*_column_diff_history.csv"))
+    return sorted(names)
+
+
+def dataset_files(dataset_id):
+    """Logical paths of a dataset's files that exist"""
+    paths = [f"data/raw/{dataset_id}.csv", legacy_snapshot_path(dataset_id)]
+    paths += storage.glob_csv(os.path.join(store_dir(dataset_id), "v*.csv"))
+    paths.append(audit_csv_path(dataset_id))
+    return [path for path in paths if storage.exists(path)]
+
+
+def migrate(dataset_id, codec):
+    """Convert one dataset's files to `codec` (None for plain CSV); returns (bytes before, bytes after)"""
+    before = after = 0
+    with dataset_lock(dataset_id):
+        for path in dataset_files(dataset_id):
+            stored = storage.resolve(path)
+            size = os.path.getsize(stored)
+            converted = storage.convert(path, codec)
+            before += size
+            after += os.path.getsize(converted)
+            if converted != stored:
+                print(f"  {stored} → {os.path.basename(converted)}  {size / 1e6:.2f} MB → "
+                      f"{os.path.getsize(converted) / 1e6:.2f} MB")
+    return before, after
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "-h" in args or "--help" in args:
+        print("Usage: python migrate_storage.py [--codec gz|xz|bz2|none] [dataset ...]")
+        sys.exit(0)
+
+    codec = "gz"
+    if "--codec" in args:
+        i = args.index("--codec")
+        codec = args[i + 1]
+        del args[i:i + 2]
+    if codec not in CODEC_NAMES:
+        print(f"⚠️ Unknown codec {codec}; use one of {', '.join(CODEC_NAMES)}")
+        sys.exit(1)
+
+    total_before = total_after = 0
+    for dataset_id in [a.replace(".csv", "") for a in args] or datasets():
+        print(f"🗜️ {dataset_id}")
+        before, after = migrate(dataset_id, CODEC_NAMES[codec])
+        total_before += before
+        total_after += after
+    print(f"✅ {total_before / 1e6:.2f} MB → {total_after / 1e6:.2f} MB")
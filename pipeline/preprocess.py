@@ -2,37 +2,153 @@ import pandas as pd
 import numpy as np
 import sys
 import os
+from pandas.tseries.api import guess_datetime_format
 
-# --- Get dataset name from CLI ---
-if len(sys.argv) < 2:
-    print("Usage: python preprocess.py <dataset_name.csv>")
-    sys.exit(1)
+from atomic_io import atomic_path
+from columnar import write_columnar, columnar_path
+from logging_utils import instrument
+from schema import load_schema, read_csv, plain_codes
 
-dataset_name = sys.argv[1].replace(".csv", "")
-raw_path = f"data/raw/{dataset_name}.csv"
-cleaned_path = f"data/cleaned/{dataset_name}_cleaned.csv"
+NA_VALUES = load_schema()["sentinels"]
+SEX_MAP = {"M": 1, "F": 2, "m": 1, "f": 2}
+DIAGNOSIS_MAP = {"TD": 0, "ASD": 1, "td": 0, "asd": 1}
 
 
-# Load dataset and treat -9999 and blanks as NaN
-df = pd.read_csv(raw_path, na_values=["", " ", "-9999"])
+def needs_sex_mapping(df):
+    return bool(df["sex"].astype(str).str.upper().isin(["M", "F"]).any())
 
-df["subjectkey"] = df["subjectkey"].astype(str).str.strip()
-df = df[df["subjectkey"] != "nan"]
 
-# --- Fix interview date ---
-if "interview_date" in df.columns:
-    df["interview_date"] = pd.to_datetime(df["interview_date"], errors="coerce").dt.strftime("%m/%d/%Y")
+def needs_diagnosis_mapping(df):
+    return bool(df["diagnosis"].astype(str).str.upper().isin(["TD", "ASD"]).any())
 
-# Convert sex to binary (M = 1, F = 0)
-if df["sex"].astype(str).str.upper().isin(["M", "F"]).any():
-    df["sex"] = df["sex"].map({"M": 1, "F": 2, "m": 1, "f": 2})
 
-# Convert diagnosis to binary
-if df["diagnosis"].astype(str).str.upper().isin(["TD", "ASD"]).any():
-    df["diagnosis"] = df["diagnosis"].map({"TD": 0, "ASD": 1, "td": 0, "asd": 1})
+def guess_date_format(first_date):
+    """The date format pandas settles on from the first non-missing date ("mixed" if none fits)"""
+    if isinstance(first_date, str):
+        return guess_datetime_format(first_date) or "mixed"
+    return "mixed"
 
-# Save cleaned dataset
-df.to_csv(cleaned_path, index=False)
 
-print(f"✅ Cleaned dataset saved to {cleaned_path}")
-print(f"📌 Rows with missing values are retained for QC review.")
+def read_raw(raw_path, dataset_name=None):
+    """Load a raw export through its schema (sentinels are kept for the snapshot audit)"""
+    return read_csv(raw_path, dataset_name)
+
+
+def _sentinel_values(sentinels):
+    values = {}
+    for value in sentinels:
+        values[value] = np.nan
+        for cast in (int, float):
+            try:
+                values[cast(value)] = np.nan
+                break
+            except ValueError:
+                pass
+    return values
+
+
+def replace_sentinels(df, sentinels=NA_VALUES):
+    """Treat sentinels (-9999 and blanks by default) as NaN, re-inferring numeric columns they were hiding"""
+    df = df.replace(_sentinel_values(sentinels))
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = plain_codes(df[col])
+        elif df[col].dtype == object or pd.api.types.is_string_dtype(df[col].dtype):
+            try:
+                df[col] = pd.to_numeric(df[col])
+            except (ValueError, TypeError):
+                pass
+    return df
+
+
+def preprocess(df, date_format=None, map_sex=None, map_diagnosis=None, sentinels=NA_VALUES):
+    """Clean a raw dataset and return the cleaned frame.
+
+    The keyword arguments override decisions otherwise inferred from `df`
+    itself, so that chunks of one file are all cleaned the same way.
+    """
+    df = replace_sentinels(df, sentinels)
+
+    df["subjectkey"] = df["subjectkey"].astype(str).str.strip()
+    df = df[df["subjectkey"] != "nan"].copy()
+
+    # --- Fix interview date ---
+    used_format = None
+    if "interview_date" in df.columns:
+        used_format = date_format
+        if used_format is None:
+            dates = df["interview_date"].dropna()
+            used_format = guess_date_format(dates.iloc[0] if len(dates) else None)
+        df["interview_date"] = pd.to_datetime(df["interview_date"], errors="coerce", format=used_format).dt.strftime("%m/%d/%Y")
+
+    # Convert sex to binary (M = 1, F = 0)
+    if map_sex is None:
+        map_sex = needs_sex_mapping(df)
+    if map_sex:
+        df["sex"] = plain_codes(df["sex"].map(SEX_MAP))
+
+    # Convert diagnosis to binary
+    if map_diagnosis is None:
+        map_diagnosis = needs_diagnosis_mapping(df)
+    if map_diagnosis:
+        df["diagnosis"] = plain_codes(df["diagnosis"].map(DIAGNOSIS_MAP))
+
+    # Record the file-wide choices so QC can tell when an edit changed them for every row
+    df.attrs["preprocess_options"] = {
+        "date_format": used_format,
+        "map_sex": bool(map_sex),
+        "map_diagnosis": bool(map_diagnosis),
+        "sentinels": list(sentinels),
+    }
+    return df
+
+
+def save_cleaned(df, dataset_name):
+    """Write the cleaned CSV and its columnar cache; returns the CSV path"""
+    cleaned_path = f"data/cleaned/{dataset_name}_cleaned.csv"
+    with instrument("save_cleaned", dataset_name) as metrics:
+        with atomic_path(cleaned_path) as tmp_path:
+            df.to_csv(tmp_path, index=False)
+        write_columnar(df, dataset_name, cleaned_path)
+        metrics.rows(len(df), len(df))
+        metrics.wrote(cleaned_path, columnar_path(dataset_name))
+    return cleaned_path
+
+
+def run_preprocess(df_raw, dataset_name):
+    """preprocess() as an instrumented pipeline stage"""
+    with instrument("preprocess", dataset_name) as metrics:
+        df = preprocess(df_raw, sentinels=load_schema(dataset_name)["sentinels"])
+        metrics.rows(len(df_raw), len(df))
+    return df
+
+
+def load_raw(dataset_name, **kwargs):
+    """read_raw() (or schema.read_csv with `kwargs`) of data/raw/<dataset>.csv as an instrumented stage"""
+    raw_path = f"data/raw/{dataset_name}.csv"
+    with instrument("read_raw", dataset_name) as metrics:
+        df = read_csv(raw_path, dataset_name, **kwargs)
+        metrics.read(raw_path)
+        metrics.rows(rows_out=len(df))
+    return df
+
+
+def main(dataset_name):
+    # Load dataset and treat the schema's sentinels (-9999, blanks) as NaN
+    df = load_raw(dataset_name, sentinels=True)
+    df = run_preprocess(df, dataset_name)
+
+    # Save cleaned dataset
+    cleaned_path = save_cleaned(df, dataset_name)
+
+    print(f"✅ Cleaned dataset saved to {cleaned_path}")
+    print(f"📌 Rows with missing values are retained for QC review.")
+
+
+if __name__ == "__main__":
+    # --- Get dataset name from CLI ---
+    if len(sys.argv) < 2:
+        print("Usage: python preprocess.py <dataset_name.csv>")
+        sys.exit(1)
+
+    main(sys.argv[1].replace(".csv", ""))
@@ -1,46 +1,146 @@
-import subprocess
 import sys
-import hashlib
 import os
-import sys
 
-if len(sys.argv) < 2:
-    print("Usage: python preprocess_qc_runner.py <dataset_name>")
-    sys.exit(1)
-
-dataset_id = sys.argv[1].replace(".csv", "")
-raw_path = f"data/raw/{dataset_id}.csv"
-cleaned_path = f"data/cleaned/{dataset_id}_cleaned.csv"
-hash_log_path = "docs/data_change_log.csv"
-
-def get_file_hash(filepath):
-    hasher = hashlib.sha256()
-    with open(filepath, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hasher.update(chunk)
-    return hasher.hexdigest()
-
-# Get current hash
-current_hash = get_file_hash(raw_path)
-
-# Load last logged hash (if any)
-last_hash = None
-if os.path.exists(hash_log_path):
-    with open(hash_log_path, "r") as f:
-        lines = f.readlines()
-        for line in reversed(lines):
-            if raw_path in line:
-                last_hash = line.strip().split(",")[-1]
-                break
-
-# Only run preprocess + QC if the raw file has changed
-if last_hash != current_hash:
-    try:
+from preprocess import load_raw, run_preprocess, save_cleaned
+from qc import run_qc
+from snapshot_compare import compare_snapshot
+from snapshot_store import has_snapshot, versions
+from streaming import stream_preprocess_qc
+from hash_registry import file_hash, latest_hash
+from qc_incremental import changed_subjects, previous_rows, update_qc
+from logging_utils import instrument
+from artifact_cache import has_entry, restore, store
+from single_flight import dataset_lock, single_flight
+
+
+def snapshot_hash(dataset_id):
+    """Raw hash of the latest stored snapshot version (None without one, or for a legacy snapshot)"""
+    stored = versions(dataset_id)
+    return stored[-1].get("raw_hash") if stored else None
+
+
+def needs_preprocess(dataset_id):
+    """True if the raw file changed since its hash was last logged or its snapshot stored, or was never cleaned"""
+    raw_path = f"data/raw/{dataset_id}.csv"
+    cleaned_path = f"data/cleaned/{dataset_id}_cleaned.csv"
+    raw_hash = file_hash(raw_path)
+    # An out-of-core compare logs the hash before the version is stored and processed
+    return (raw_hash != latest_hash(raw_path) or snapshot_hash(dataset_id) not in (None, raw_hash)
+            or not os.path.exists(cleaned_path))
+
+
+def clean_and_qc(dataset_id, df_raw=None, chunksize=None, changes=None, base_hash=None):
+    """Preprocess and QC a dataset.
+
+    With `chunksize`, the raw file is streamed in chunks instead of loaded whole.
+    With `changes` (the snapshot diff against raw version `base_hash`), QC is
+    updated by delta from the last run's saved state when that state matches.
+    A raw version whose outputs are in the artifact cache is restored from it.
+    """
+    raw_path = f"data/raw/{dataset_id}.csv"
+    cleaned_path = f"data/cleaned/{dataset_id}_cleaned.csv"
+    raw_hash = file_hash(raw_path)
+
+    if restore(dataset_id, raw_hash):
+        print(f"♻️ Outputs for this version of {dataset_id} restored from the artifact cache.")
+        return
+
+    if chunksize:
+        stream_preprocess_qc(dataset_id, chunksize, raw_hash)
+        print(f"✅ Streamed preprocessing and QC completed ({chunksize} rows per chunk).")
+        store(dataset_id, raw_hash)
+        return
+
+    if df_raw is None:
+        df_raw = load_raw(dataset_id)
+    df_clean = run_preprocess(df_raw, dataset_id)
+
+    # Previous rows of the changed subjects must be read before the cleaned outputs are replaced
+    df_old = None
+    if changes is not None:
+        subjects = changed_subjects(changes)
+        df_old = previous_rows(dataset_id, subjects, base_hash)
+
+    save_cleaned(df_clean, dataset_id)
+    print(f"✅ Cleaned dataset saved to {cleaned_path}")
+    if df_old is not None and update_qc(dataset_id, df_clean, df_old, subjects, raw_hash) is not None:
+        print(f"⚡ QC updated incrementally for {len(subjects)} changed subject(s).")
+    else:
+        run_qc(df_clean, dataset_id, raw_hash=raw_hash)
+    store(dataset_id, raw_hash)
+    print("✅ Preprocessing and QC completed.")
+
+
+def record_skip(dataset_id):
+    with instrument("preprocess_qc", dataset_id) as metrics:
+        metrics.cache = "hit"
+    # Outputs from before the artifact cache existed are added to it here
+    raw_hash = file_hash(f"data/raw/{dataset_id}.csv")
+    if not has_entry(dataset_id, raw_hash):
+        store(dataset_id, raw_hash)
+    print(f"✅ Raw data for {dataset_id} unchanged — skipping preprocess and QC.")
+
+
+def run_preprocess_qc(dataset_id, df_raw=None, chunksize=None):
+    """Preprocess and QC a dataset if its raw file has changed since it was last logged.
+
+    With `chunksize`, the raw file is streamed in chunks instead of loaded whole.
+    """
+    with dataset_lock(dataset_id, ("cleaned",)):
+        # Only run preprocess + QC if the raw file has changed
+        if not needs_preprocess(dataset_id):
+            record_skip(dataset_id)
+            return False
+
         print(f"🧠 Raw file for {dataset_id} has changed — running preprocessing and QC...")
-        subprocess.run([sys.executable, "pipeline/preprocess.py", dataset_id], check=True)
-        subprocess.run([sys.executable, "pipeline/qc.py", cleaned_path], check=True)
-        print("✅ Preprocessing and QC completed.")
+        clean_and_qc(dataset_id, df_raw, chunksize)
+        return True
+
+
+def run_pipeline(dataset_id):
+    """Run snapshot compare → preprocess → QC in-process on one parsed raw frame.
+
+    The snapshot diff runs first so QC can be updated from its delta. Only
+    one run per dataset happens at a time; a caller that waited on a run of
+    the same raw version gets that run's changes back without rerunning.
+    """
+    with single_flight(dataset_id) as flight:
+        if flight.shared:
+            print(f"⏳ {dataset_id} was just processed by a concurrent run — reusing its result.")
+            return flight.result
+        changes = _run_pipeline(dataset_id)
+        flight.publish(changes)
+        return changes
+
+
+def _run_pipeline(dataset_id):
+    raw_path = f"data/raw/{dataset_id}.csv"
+    df_raw = load_raw(dataset_id)
+
+    # Both must be read before compare_snapshot() logs the new raw hash
+    stale = needs_preprocess(dataset_id)
+    base_hash = (snapshot_hash(dataset_id) or latest_hash(raw_path)) if has_snapshot(dataset_id) else None
+    changes = compare_snapshot(df_raw, dataset_id)
+
+    if not stale:
+        record_skip(dataset_id)
+        return changes
+    print(f"🧠 Raw file for {dataset_id} has changed — running preprocessing and QC...")
+    # Failures propagate, so a background job running this ends "failed" with the error
+    clean_and_qc(dataset_id, df_raw, changes=changes, base_hash=base_hash)
+    return changes
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python preprocess_qc_runner.py <dataset_name> [--chunksize N]")
+        sys.exit(1)
+
+    dataset_id = sys.argv[1].replace(".csv", "")
+    chunksize = None
+    if "--chunksize" in sys.argv:
+        chunksize = int(sys.argv[sys.argv.index("--chunksize") + 1])
+    try:
+        run_preprocess_qc(dataset_id, chunksize=chunksize)
     except Exception as e:
         print(f"⚠️ Error running preprocessing or QC: {e}")
-else:
-    print(f"✅ Raw data for {dataset_id} unchanged — skipping preprocess and QC.")
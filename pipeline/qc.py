@@ -1,87 +1,655 @@
 import pandas as pd
 import numpy as np
+import json
 import sys
 import os
-from pathlib import Path
-
-if len(sys.argv) < 2:
-    print("Usage: python qc.py <cleaned_dataset_path>")
-    sys.exit(1)
-
-cleaned_path = sys.argv[1]
-dataset_name = os.path.basename(cleaned_path).replace("_cleaned.csv", "")
-df = pd.read_csv(cleaned_path)
-
-# --- Flag missing and outliers ---
-df["missing_flag"] = df[["age", "IQ", "diagnosis"]].isnull().any(axis=1)
-df["age_outlier"] = (df["age"] < 5) | (df["age"] > 64)
-df["IQ_outlier"] = (df["IQ"] < 70) | (df["IQ"] > 145)
-
-
-# --- Count summaries ---
-n_total = len(df)
-n_missing = df["missing_flag"].sum()
-n_age_outliers = df["age_outlier"].sum()
-n_IQ_outliers = df["IQ_outlier"].sum()
-
-# --- Identify missing by field ---
-missing_age = df[df["age"].isnull()][["subjectkey"]]
-missing_IQ = df[df["IQ"].isnull()][["subjectkey"]]
-missing_diag = df[df["diagnosis"].isnull()][["subjectkey"]]
-
-missing_details = []
-if not missing_age.empty:
-    ids = ", ".join(missing_age["subjectkey"].astype(str).values)
-    missing_details.append(f"- Missing age: {len(missing_age)} subject(s) → {ids}")
-if not missing_IQ.empty:
-    ids = ", ".join(missing_IQ["subjectkey"].astype(str).values)
-    missing_details.append(f"- Missing IQ: {len(missing_IQ)} subject(s) → {ids}")
-if not missing_diag.empty:
-    ids = ", ".join(missing_diag["subjectkey"].astype(str).values)
-    missing_details.append(f"- Missing diagnosis: {len(missing_diag)} subject(s) → {ids}")
-missing_summary = "\n".join(missing_details) if missing_details else "None"
-
-# --- Site, sex, scanner summaries ---
-site_dist = df["site"].value_counts().to_string()
-sex_dist = df["sex"].value_counts().to_string()
-scanner_dist = df["scanner_type"].value_counts().to_string()
-asd_dist = df["diagnosis"].value_counts().to_string()
-
-# --- Assemble report text ---
-report_lines = [
-    f"🔍 QC Report for {Path(cleaned_path).name}",
-    f"Total rows: {n_total}",
-    "",
-    "🔧 Missing Values Breakdown:",
-    missing_summary,
-    "",
-    f"Age outliers (<5 or >64): {n_age_outliers}",
-    f"IQ outliers (<70 or >145): {n_IQ_outliers}",
-    "",
-    "📊 Site Distribution:",
-    site_dist,
-    "",
-    "📊 Sex Distribution (M = 1, F = 2):",
-    sex_dist,
-    "",
-    "📊 Scanner Type Distribution:",
-    scanner_dist,
-    "",
-    "📊 Diagnosis Distribution (ASD = 1, TD = 0):",
-    asd_dist
-]
-
-report_text = "\n".join(report_lines)
-
-# --- Save reports ---
-report_path = f"data/cleaned/{dataset_name}_qc_report.txt"
-with open(report_path, "w") as f:
-    f.write("\n".join(report_lines))
-
-
-flagged_path = f"data/cleaned/{dataset_name}_qc_flags.csv"
-df_flags = df[df["missing_flag"] | df["age_outlier"] | df["IQ_outlier"]]
-df_flags.to_csv(flagged_path, index=False)
-
-print("✅ QC report generated:")
-print(report_text)
\ No newline at end of file
+from scipy.stats import chi2
+
+from atomic_io import atomic_open, atomic_path
+from columnar import open_columnar
+from logging_utils import instrument
+from qc_rules import load_rules, compile_rules, evaluate, required_fields, rule_labels
+from schema import read_csv, decode_codes, value_counts
+
+DIST_COLUMNS = ["site", "sex", "scanner_type", "diagnosis"]
+# Columns QC is stratified by (see "Stratified QC" below)
+STRATA = ["site", "scanner_type"]
+
+
+def flag_rows(df, rules=None):
+    """Add one flag column per QC rule"""
+    rules = rules if rules is not None else load_rules()
+    flags = evaluate(df, compile_rules(rules))
+    return pd.concat([df.drop(columns=flags.columns, errors="ignore"), flags], axis=1)
+
+
+def summarize(df, rules=None):
+    """Collect the counts behind the QC report from a flagged frame"""
+    rules = rules if rules is not None else load_rules()
+    return {
+        "n_total": len(df),
+        "counts": {rule["name"]: int(df[rule["name"]].sum()) for rule in rules},
+        "labels": rule_labels(rules),
+        "missing": {field: df.loc[df[field].isnull(), "subjectkey"].astype(str).tolist() if field in df.columns
+                    else df["subjectkey"].astype(str).tolist()
+                    for field in required_fields(rules)},
+        "dists": {col: value_counts(df[col]) for col in DIST_COLUMNS},
+    }
+
+
+def merge_summaries(a, b):
+    """Combine two summaries as if they had been computed over the concatenated rows"""
+    return {
+        "n_total": a["n_total"] + b["n_total"],
+        "counts": {name: a["counts"][name] + b["counts"][name] for name in a["counts"]},
+        "labels": a["labels"],
+        "missing": {field: a["missing"][field] + b["missing"][field] for field in a["missing"]},
+        # Keep first-seen order so ties sort the same way value_counts() would
+        "dists": {col: pd.concat([a["dists"][col], b["dists"][col]]).groupby(level=0, sort=False).sum()
+                  for col in DIST_COLUMNS},
+    }
+
+
+def format_report(summary, report_name):
+    """Assemble the QC report text from a summary"""
+    # --- Identify missing by field ---
+    missing_details = []
+    for field, ids in summary["missing"].items():
+        if ids:
+            missing_details.append(f"- Missing {field}: {len(ids)} subject(s) → {', '.join(ids)}")
+    missing_summary = "\n".join(missing_details) if missing_details else "None"
+
+    # --- Per-rule flag counts ---
+    rule_lines = [f"{label}: {summary['counts'][name]}" for name, label in summary["labels"].items()]
+
+    # --- Site, sex, scanner summaries ---
+    dists = {col: counts.sort_values(ascending=False).to_string() for col, counts in summary["dists"].items()}
+
+    # --- Per-site and per-scanner QC ---
+    strata_lines = []
+    for by, result in summary.get("strata", {}).items():
+        strata_lines += ["", f"📍 QC by {by} (outliers: robust z > {ROBUST_Z:g} within the {by}; "
+                             "shift: median vs pooled, in pooled MADs; PSI vs pooled quintiles):"]
+        if result.get("carried_over"):
+            strata_lines.append("(group statistics from the last full QC run; changed rows are scored against them)")
+        strata_lines += [format_strata_table(result["table"]), *[f"⚠️ {alert}" for alert in result["alerts"]]]
+
+    # --- Assemble report text ---
+    report_lines = [
+        f"🔍 QC Report for {report_name}",
+        f"Total rows: {summary['n_total']}",
+        "",
+        "🔧 Missing Values Breakdown:",
+        missing_summary,
+        "",
+        *rule_lines,
+        "",
+        "📊 Site Distribution:",
+        dists["site"],
+        "",
+        "📊 Sex Distribution (M = 1, F = 2):",
+        dists["sex"],
+        "",
+        "📊 Scanner Type Distribution:",
+        dists["scanner_type"],
+        "",
+        "📊 Diagnosis Distribution (ASD = 1, TD = 0):",
+        dists["diagnosis"],
+        *strata_lines
+    ]
+    return "\n".join(report_lines)
+
+
+def build_report(df, report_name, rules=None):
+    """Assemble the QC report text for a flagged frame"""
+    return format_report(summarize(df, rules), report_name)
+
+
+def select_flagged(df, rules=None):
+    """Keep rows with any QC rule flag (or stratified outlier flag, when present) set"""
+    rules = rules if rules is not None else load_rules()
+    columns = [rule["name"] for rule in rules] + [strata_flag(by) for by in STRATA if strata_flag(by) in df.columns]
+    return df[df[columns].any(axis=1)]
+
+
+# --- Stratified QC ---
+# Each STRATA column splits the cohort into groups (sites, scanners) that are
+# checked against the pooled cohort. Every check is a vectorized grouped
+# operation over all rows (bincounts, one grouped median over all numeric
+# columns, one over their absolute deviations), so the cost grows with the row
+# count and not with the number of groups:
+#   missingness  missing values per required field; alerted when a group's rate
+#                is MISSING_Z binomial standard errors above the pooled rate
+#   outliers     robust z = (x - group median) / (MAD_SCALE * group MAD) per
+#                numeric column; rows past ROBUST_Z get the <column>_outlier flag
+#   drift        the group median's distance from the pooled median in pooled
+#                MADs, and the PSI of the group's values over pooled quintile
+#                bins; alerted for groups of MIN_GROUP_ROWS+ past DRIFT_SHIFT, or
+#                past the PSI threshold with a shift of at least PSI_MIN_SHIFT
+# A group of n rows drawn from the pooled distribution has n * PSI of about
+# chi-square with (bins - 1) degrees of freedom, so sampling noise alone gives
+# small groups a PSI of (bins - 1) / n on average. The PSI threshold is
+# DRIFT_PSI plus that noise's PSI_CONFIDENCE quantile, and bins get a half-row
+# pseudo-count so an empty bin in a small group does not dominate the index.
+# Groups are listed by label, so the result does not depend on row order.
+# Group statistics are saved with the QC state. An incremental update scores
+# only its changed rows against them (strata_flags_from()); they are recomputed
+# on the next full QC run.
+ROBUST_Z = 3.5
+MAD_SCALE = 1.4826
+DRIFT_BINS = 5
+DRIFT_SHIFT = 1.0
+DRIFT_PSI = 0.25
+PSI_CONFIDENCE = 0.99
+PSI_MIN_SHIFT = 0.25
+MISSING_Z = 3.0
+MIN_GROUP_ROWS = 30
+
+
+def strata_flag(by):
+    """Flag column for rows whose age or IQ is a robust outlier within their `by` group, e.g. age_IQ_site_outlier"""
+    return f"{'_'.join(NUMERIC_COLUMNS)}_{by}_outlier"
+
+
+def _group_codes(series):
+    """Codes 0..k-1 of a column's values in label order (-1 for missing), and the labels"""
+    codes, labels = pd.factorize(series)
+    names = np.array([str(_to_python(label)) for label in labels], dtype=object)
+    order = np.argsort(names, kind="stable")
+    remap = np.empty(len(order), dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    return np.where(codes >= 0, remap[np.maximum(codes, 0)], -1), names[order].tolist()
+
+
+def _grouped_median(values, codes, n_groups):
+    """Median of each column of a 2-D array per group code, NaN for groups without values"""
+    return pd.DataFrame(values).groupby(codes).median().reindex(range(n_groups)).to_numpy(dtype=float)
+
+
+def _robust_outliers(values, median, mad):
+    """Which values are more than ROBUST_Z robust z-scores from their group's median"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # A group whose values are mostly identical has no spread to score against
+        z = np.where(mad > 0, (values - median) / mad, np.nan)
+    return np.abs(np.nan_to_num(z)) > ROBUST_Z
+
+
+def _numeric_values(df, numeric):
+    return np.column_stack([pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+                            for col in numeric])
+
+
+def _psi(counts, pooled):
+    """Population stability index of each row of bin counts against the pooled bin counts"""
+    totals = counts.sum(axis=1, keepdims=True)
+    p = (counts + 0.5) / (totals + 0.5 * counts.shape[1])
+    q = (pooled + 0.5) / (pooled.sum() + 0.5 * len(pooled))
+    psi = ((p - q) * np.log(p / q)).sum(axis=1)
+    return np.where(totals[:, 0] > 0, psi, np.nan)
+
+
+def psi_threshold(n, n_bins):
+    """PSI past which a group of `n` rows has drifted: DRIFT_PSI above its sampling noise"""
+    return DRIFT_PSI + chi2.ppf(PSI_CONFIDENCE, max(n_bins - 1, 1)) / np.maximum(n, 1)
+
+
+def stratify(df, by, numeric, fields):
+    """QC of `df` within each group of column `by`, against the pooled cohort.
+
+    Returns ({"table", "alerts"}, row flags): a frame with one row per group
+    (size, missing counts, and per numeric column median, MAD, outlier count,
+    shift and PSI), alert lines, and a boolean array marking rows that are
+    robust outliers within their group.
+    """
+    codes, labels = _group_codes(df[by])
+    n_groups = len(labels)
+    grouped = codes >= 0
+    g = codes[grouped]
+    n = np.bincount(g, minlength=n_groups)
+    table = pd.DataFrame({by: labels, "n": n})
+    alerts = []
+
+    for field in fields:
+        missing = df[field].isnull().to_numpy() if field in df.columns else np.ones(len(df), dtype=bool)
+        counts = np.bincount(g, weights=missing[grouped], minlength=n_groups).astype(int)
+        table[f"{field}_missing"] = counts
+        pooled = missing.mean() if len(df) else 0.0
+        if 0 < pooled < 1:
+            z = (counts / np.maximum(n, 1) - pooled) / np.sqrt(pooled * (1 - pooled) / np.maximum(n, 1))
+            for i in np.flatnonzero((z > MISSING_Z) & (n > 0)):
+                alerts.append(f"{by} {labels[i]}: {field} missing in {counts[i] / n[i]:.0%} of rows "
+                              f"vs {pooled:.0%} pooled")
+
+    flags = np.zeros(len(df), dtype=bool)
+    if numeric and len(df):
+        values_all = _numeric_values(df, numeric)
+        values = values_all[grouped]
+        median = _grouped_median(values, g, n_groups)
+        mad = _grouped_median(np.abs(values - median[g]), g, n_groups) * MAD_SCALE
+        outlier = _robust_outliers(values, median[g], mad[g])
+        flags[grouped] = outlier.any(axis=1)
+
+        with np.errstate(all="ignore"):
+            pooled_median = np.nanmedian(values_all, axis=0)
+            pooled_mad = np.nanmedian(np.abs(values_all - pooled_median), axis=0) * MAD_SCALE
+        for i, col in enumerate(numeric):
+            column, present = values[:, i], ~np.isnan(values[:, i])
+            pooled_values = values_all[:, i][~np.isnan(values_all[:, i])]
+            edges = np.unique(np.quantile(pooled_values, np.linspace(0, 1, DRIFT_BINS + 1)[1:-1])) \
+                if len(pooled_values) else np.array([])
+            n_bins = len(edges) + 1
+            bins = np.searchsorted(edges, column[present], side="right")
+            counts = np.bincount(g[present] * n_bins + bins, minlength=n_groups * n_bins).reshape(n_groups, n_bins)
+            pooled_counts = np.bincount(np.searchsorted(edges, pooled_values, side="right"), minlength=n_bins)
+            shift = (median[:, i] - pooled_median[i]) / pooled_mad[i] if pooled_mad[i] > 0 \
+                else np.full(n_groups, np.nan)
+
+            table[f"{col}_median"] = median[:, i]
+            table[f"{col}_mad"] = mad[:, i]
+            table[f"{col}_outliers"] = np.bincount(g, weights=outlier[:, i], minlength=n_groups).astype(int)
+            table[f"{col}_shift"] = shift
+            table[f"{col}_psi"] = _psi(counts, pooled_counts)
+
+            present_n = counts.sum(axis=1)
+            moved = np.abs(np.nan_to_num(shift))
+            psi_drift = (np.nan_to_num(table[f"{col}_psi"].to_numpy()) > psi_threshold(present_n, n_bins)) \
+                & (moved >= PSI_MIN_SHIFT)
+            drifted = (present_n >= MIN_GROUP_ROWS) & ((moved > DRIFT_SHIFT) | psi_drift)
+            for j in np.flatnonzero(drifted):
+                alerts.append(f"{by} {labels[j]}: {col} median {median[j, i]:g} is {shift[j]:+.2f} pooled MADs "
+                              f"from the pooled {pooled_median[i]:g} (PSI {table[f'{col}_psi'].iloc[j]:.2f})")
+    return {"table": table, "alerts": alerts}, flags
+
+
+def stratified_qc(df, rules=None):
+    """stratify() by every STRATA column in `df`; returns (results by column, frame of row flags)"""
+    rules = rules if rules is not None else load_rules()
+    fields = required_fields(rules)
+    numeric = [col for col in NUMERIC_COLUMNS if col in df.columns]
+    results, flags = {}, {}
+    for by in STRATA:
+        if by in df.columns:
+            results[by], flags[strata_flag(by)] = stratify(df, by, numeric, fields)
+    return results, pd.DataFrame(flags, index=df.index)
+
+
+def strata_flags_from(df, strata):
+    """Stratified outlier flags of `df`'s rows, scored against the group medians and MADs of saved stratify() results.
+
+    Rows of a group the saved tables do not list are not flagged.
+    """
+    flags = {}
+    for by, result in strata.items():
+        table = result["table"]
+        numeric = [col[:-len("_median")] for col in table.columns if col.endswith("_median")]
+        labels = df[by].astype(object)
+        present = np.flatnonzero(labels.notna().to_numpy())
+        group = pd.Index(table[by]).get_indexer([str(_to_python(label)) for label in labels.iloc[present]])
+        rows, group = present[group >= 0], group[group >= 0]
+        flag = np.zeros(len(df), dtype=bool)
+        if numeric and len(rows):
+            median = table[[f"{col}_median" for col in numeric]].to_numpy(dtype=float)[group]
+            mad = table[[f"{col}_mad" for col in numeric]].to_numpy(dtype=float)[group]
+            flag[rows] = _robust_outliers(_numeric_values(df.iloc[rows], numeric), median, mad).any(axis=1)
+        flags[strata_flag(by)] = flag
+    return pd.DataFrame(flags, index=df.index)
+
+
+def strata_columns(columns, rules=None):
+    """Those of `columns` that stratified QC reads"""
+    rules = rules if rules is not None else load_rules()
+    wanted = set(STRATA + NUMERIC_COLUMNS + required_fields(rules))
+    return [col for col in columns if col in wanted]
+
+
+def add_strata_flags(df, flags):
+    """Append the stratified outlier flags (aligned by position) after the rule flags"""
+    flags = flags.set_axis(df.index)
+    return pd.concat([df.drop(columns=flags.columns, errors="ignore"), flags], axis=1)
+
+
+def format_strata_table(table):
+    """A stratified QC table as report text (MADs are left out)"""
+    shown = table[[col for col in table.columns if not col.endswith("_mad")]]
+    return shown.to_string(index=False, float_format=lambda value: f"{value:.2f}")
+
+
+def state_path(dataset_name):
+    return f"data/cleaned/{dataset_name}_qc_state.json"
+
+
+def _to_python(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def dtype_names(dtypes):
+    return {col: np.dtype(dtype).str if isinstance(dtype, np.dtype) else str(dtype) for col, dtype in dtypes.items()}
+
+
+def save_state(summary, dataset_name, rules, dtypes, raw_hash=None, options=None):
+    """Persist the QC aggregates so later runs can update them by delta.
+
+    `dtypes` are the cleaned column dtypes the summary was computed from;
+    `raw_hash` and `options` (the preprocess() choices) describe the raw
+    version they came from, when known.
+    """
+    columnar = open_columnar(dataset_name)
+    state = {
+        "raw_hash": raw_hash,
+        "options": options,
+        "source": columnar.meta["source"] if columnar is not None else None,
+        "rules": rules,
+        "dtypes": dtype_names(dtypes),
+        "n_total": int(summary["n_total"]),
+        "counts": {name: int(count) for name, count in summary["counts"].items()},
+        "missing": summary["missing"],
+        # Pairs rather than a mapping, to keep value types and first-seen order
+        "dists": {col: [[_to_python(value), int(count)] for value, count in counts.items()]
+                  for col, counts in summary["dists"].items()},
+        "strata": {by: {"columns": list(result["table"].columns),
+                        "rows": [[_to_python(value) for value in row] for row in result["table"].itertuples(index=False)],
+                        "alerts": result["alerts"]}
+                   for by, result in summary.get("strata", {}).items()},
+    }
+    with atomic_open(state_path(dataset_name)) as f:
+        json.dump(state, f)
+
+
+def load_state(dataset_name):
+    """Return (state, summary) saved by the last QC run, or None"""
+    path = state_path(dataset_name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    summary = {
+        "n_total": state["n_total"],
+        "counts": state["counts"],
+        "labels": rule_labels(state["rules"]),
+        "missing": state["missing"],
+        "dists": {col: pd.Series([count for _, count in pairs], index=pd.Index([value for value, _ in pairs], name=col),
+                                 name="count", dtype="int64")
+                  for col, pairs in state["dists"].items()},
+    }
+    if "strata" in state:
+        summary["strata"] = {by: {"table": pd.DataFrame(saved["rows"], columns=saved["columns"]),
+                                  "alerts": saved["alerts"], "carried_over": True}
+                             for by, saved in state["strata"].items()}
+    return state, summary
+
+
+# --- Chart summary ---
+# data/cleaned/<id>_qc_summary.json holds everything the Overview charts are
+# drawn from, so the dashboard never loads row-level data for them:
+#   n_total, flags, missing   QC counts (rows per rule, subjects per missing field)
+#   numeric     {col: count, mean, std, min, max, bin_edges, bin_counts}
+#   categories  {col: [[value, count], ...]} in first-seen order
+#   by_site     {site: {n, numeric (without bins), categories}}
+#   source      size/mtime of the cleaned CSV it describes
+NUMERIC_COLUMNS = ["age", "IQ"]
+HIST_BINS = 15
+
+
+def chart_summary_path(dataset_name):
+    return f"data/cleaned/{dataset_name}_qc_summary.json"
+
+
+def _cleaned_stat(dataset_name):
+    path = f"data/cleaned/{dataset_name}_cleaned.csv"
+    if not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _finite(value):
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def _numeric_stats(series, bins=None):
+    values = series.dropna().to_numpy(dtype=float)
+    stats = {"count": len(values), "mean": None, "std": None, "min": None, "max": None}
+    if len(values):
+        # std as pandas computes it (ddof=1), the parameter of the overlaid normal curve
+        stats.update(mean=_finite(values.mean()), std=_finite(values.std(ddof=1)) if len(values) > 1 else None,
+                     min=_finite(values.min()), max=_finite(values.max()))
+    if bins:
+        counts, edges = np.histogram(values, bins=bins) if len(values) else (np.array([]), np.array([]))
+        stats.update(bin_edges=edges.tolist(), bin_counts=counts.astype(int).tolist())
+    return stats
+
+
+def _count_pairs(series):
+    return [[_to_python(value), int(count)] for value, count in value_counts(series).items()]
+
+
+def chart_summary(df, summary=None):
+    """Chart-ready aggregates of a cleaned frame; `summary` (see summarize()) adds the QC counts"""
+    numeric = [col for col in NUMERIC_COLUMNS if col in df.columns]
+    categorical = [col for col in DIST_COLUMNS if col in df.columns]
+    charts = {"n_total": len(df)}
+    if summary is not None:
+        charts["flags"] = {name: int(count) for name, count in summary["counts"].items()}
+        charts["missing"] = {field: len(ids) for field, ids in summary["missing"].items()}
+    charts["numeric"] = {col: _numeric_stats(df[col], HIST_BINS) for col in numeric}
+    charts["categories"] = {col: _count_pairs(df[col]) for col in categorical}
+
+    by_site = {}
+    if "site" in df.columns:
+        for site, group in df.groupby("site", sort=False, observed=True):
+            by_site[str(_to_python(site))] = {
+                "n": len(group),
+                "numeric": {col: _numeric_stats(group[col]) for col in numeric},
+                "categories": {col: _count_pairs(group[col]) for col in categorical if col != "site"},
+            }
+    charts["by_site"] = by_site
+    return charts
+
+
+def _moments(values):
+    """(count, mean, sum of squared deviations) of a 1-D array"""
+    if not len(values):
+        return 0, 0.0, 0.0
+    mean = values.mean()
+    return len(values), mean, ((values - mean) ** 2).sum()
+
+
+def _update_stats(stats, old, new):
+    """Numeric stats with the values `old` replaced by `new`, or None if the min or max may have moved.
+
+    Mean and std are updated from the moments of the two sets of rows; a
+    histogram (when `stats` has one) keeps its edges and has its bin counts
+    corrected.
+    """
+    old = old.dropna().to_numpy(dtype=float)
+    new = new.dropna().to_numpy(dtype=float)
+    n = stats["count"]
+    if n == 0:
+        return None if "bin_edges" in stats or len(old) else _numeric_stats(pd.Series(new))
+    low, high = stats["min"], stats["max"]
+    if low is None or high is None or low == high or (len(new) and (new.min() < low or new.max() > high)):
+        return None
+    # A removed extreme may have been the only one
+    if ((old == low).any() and not (new == low).any()) or ((old == high).any() and not (new == high).any()):
+        return None
+
+    mean = stats["mean"]
+    m2 = stats["std"] ** 2 * (n - 1) if stats["std"] is not None else 0.0
+    n_old, mean_old, m2_old = _moments(old)
+    kept = n - n_old
+    if kept > 0:
+        mean_kept = (n * mean - n_old * mean_old) / kept
+        m2_kept = m2 - m2_old - (mean_old - mean_kept) ** 2 * kept * n_old / n
+    else:
+        mean_kept, m2_kept = 0.0, 0.0
+    n_new, mean_new, m2_new = _moments(new)
+    count = kept + n_new
+    if count == 0:
+        return None
+    mean = (kept * mean_kept + n_new * mean_new) / count
+    m2 = max(m2_kept + m2_new + (mean_new - mean_kept) ** 2 * kept * n_new / count, 0.0)
+
+    updated = {**stats, "count": int(count), "mean": _finite(mean),
+               "std": _finite(np.sqrt(m2 / (count - 1))) if count > 1 else None}
+    if "bin_edges" in stats:
+        edges = np.array(stats["bin_edges"])
+        counts = np.array(stats["bin_counts"]) - np.histogram(old, bins=edges)[0] + np.histogram(new, bins=edges)[0]
+        updated["bin_counts"] = counts.astype(int).tolist()
+    return updated
+
+
+def _update_pairs(pairs, old, new):
+    """[[value, count], ...] with the values of `old` replaced by those of `new`, in first-seen order"""
+    counts = pd.Series([count for _, count in pairs], index=pd.Index([value for value, _ in pairs], dtype=object))
+    merged = pd.concat([counts, -value_counts(old), value_counts(new)]).groupby(level=0, sort=False).sum()
+    return [[_to_python(value), int(count)] for value, count in merged[merged != 0].items()]
+
+
+def _site_groups(df):
+    sites = df["site"].astype(object)
+    df = df[sites.notna().to_numpy()]
+    keys = [str(_to_python(site)) for site in sites.dropna()]
+    return {site: group for site, group in df.groupby(np.array(keys, dtype=object), sort=False)} if len(df) else {}
+
+
+def update_chart_summary(charts, df_old, df_new, summary):
+    """A saved chart summary with the rows `df_old` replaced by `df_new`, without reading the other rows.
+
+    Returns None when that is not possible, because a min or max moved (the
+    histogram edges would change); chart_summary() is needed then.
+    """
+    numeric = list(charts["numeric"])
+    updated = {"n_total": charts["n_total"] - len(df_old) + len(df_new)}
+    updated["flags"] = {name: int(count) for name, count in summary["counts"].items()}
+    updated["missing"] = {field: len(ids) for field, ids in summary["missing"].items()}
+    updated["numeric"] = {}
+    for col in numeric:
+        stats = _update_stats(charts["numeric"][col], df_old[col], df_new[col])
+        if stats is None:
+            return None
+        updated["numeric"][col] = stats
+    updated["categories"] = {col: _update_pairs(pairs, df_old[col], df_new[col])
+                             for col, pairs in charts["categories"].items()}
+
+    by_site = {}
+    if "site" in df_new.columns:
+        old_sites, new_sites = _site_groups(df_old), _site_groups(df_new)
+        empty = df_new.iloc[:0]
+        for site in list(charts["by_site"]) + [site for site in new_sites if site not in charts["by_site"]]:
+            saved = charts["by_site"].get(site, {"n": 0, "numeric": {col: _numeric_stats(empty[col]) for col in numeric},
+                                                 "categories": {}})
+            old, new = old_sites.get(site, empty), new_sites.get(site, empty)
+            n = saved["n"] - len(old) + len(new)
+            if n == 0:
+                continue
+            site_stats = {}
+            for col in numeric:
+                stats = _update_stats(saved["numeric"][col], old[col], new[col])
+                if stats is None:
+                    return None
+                site_stats[col] = stats
+            by_site[site] = {"n": n, "numeric": site_stats,
+                             "categories": {col: _update_pairs(saved["categories"].get(col, []), old[col], new[col])
+                                            for col in charts["categories"] if col != "site"}}
+    updated["by_site"] = by_site
+    return updated
+
+
+def save_chart_summary(charts, dataset_name):
+    """Write the chart summary next to the report (atomically; the dashboard may be reading it)"""
+    charts = {**charts, "source": _cleaned_stat(dataset_name)}
+    path = chart_summary_path(dataset_name)
+    with atomic_open(path) as f:
+        json.dump(charts, f)
+    return path
+
+
+def summary_frame(dataset_name):
+    """The chart columns of the cleaned data, read from the columnar cache when it is current"""
+    columnar = open_columnar(dataset_name)
+    if columnar is not None:
+        columns = [col for col in columnar.columns if col in NUMERIC_COLUMNS + DIST_COLUMNS]
+        return decode_codes(columnar.to_frame(columns, categorical=True))
+    return read_csv(f"data/cleaned/{dataset_name}_cleaned.csv", dataset_name, columns=NUMERIC_COLUMNS + DIST_COLUMNS)
+
+
+def read_chart_summary(dataset_name):
+    """The saved chart summary as written, or None"""
+    path = chart_summary_path(dataset_name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_chart_summary(dataset_name):
+    """The saved chart summary, rebuilt first if it is missing or older than the cleaned CSV"""
+    charts = read_chart_summary(dataset_name)
+    if charts is not None and charts.get("source") == _cleaned_stat(dataset_name):
+        return charts
+
+    loaded = load_state(dataset_name)
+    summary = None
+    if loaded is not None and loaded[0]["source"] == _cleaned_stat(dataset_name):
+        summary = loaded[1]
+    charts = chart_summary(summary_frame(dataset_name), summary)
+    save_chart_summary(charts, dataset_name)
+    return {**charts, "source": _cleaned_stat(dataset_name)}
+
+
+def run_qc(df, dataset_name, rules=None, raw_hash=None):
+    """Flag a cleaned frame, write the QC report and flags file, and return the report text"""
+    with instrument("qc", dataset_name) as metrics:
+        rules = rules if rules is not None else load_rules(dataset_name)
+        dtypes = df.dtypes.to_dict()
+        options = df.attrs.get("preprocess_options")
+        df = flag_rows(df, rules)
+        strata, strata_flags = stratified_qc(df, rules)
+        df = add_strata_flags(df, strata_flags)
+        summary = summarize(df, rules)
+        summary["strata"] = strata
+        report_text = format_report(summary, f"{dataset_name}_cleaned.csv")
+
+        # --- Save reports ---
+        report_path = f"data/cleaned/{dataset_name}_qc_report.txt"
+        with atomic_open(report_path) as f:
+            f.write(report_text)
+
+        flagged_path = f"data/cleaned/{dataset_name}_qc_flags.csv"
+        df_flags = select_flagged(df, rules)
+        with atomic_path(flagged_path) as tmp_path:
+            df_flags.to_csv(tmp_path, index=False)
+
+        save_state(summary, dataset_name, rules, dtypes, raw_hash, options)
+        summary_path = save_chart_summary(chart_summary(df, summary), dataset_name)
+        metrics.rows(len(df), len(df_flags))
+        metrics.wrote(report_path, flagged_path, summary_path)
+    return report_text
+
+
+def main(cleaned_path):
+    dataset_name = os.path.basename(cleaned_path).replace("_cleaned.csv", "")
+
+    # Re-runs read the columnar cache when it still matches the CSV
+    with instrument("load_cleaned", dataset_name) as metrics:
+        columnar = open_columnar(dataset_name, cleaned_path)
+        metrics.cache = "hit" if columnar is not None else "miss"
+        metrics.read(columnar.path if columnar is not None else cleaned_path)
+        if columnar is not None:
+            df = decode_codes(columnar.to_frame(categorical=True))
+        else:
+            df = read_csv(cleaned_path, dataset_name)
+        metrics.rows(rows_out=len(df))
+    report_text = run_qc(df, dataset_name)
+
+    print("✅ QC report generated:")
+    print(report_text)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python qc.py <cleaned_dataset_path>")
+        sys.exit(1)
+
+    main(sys.argv[1])
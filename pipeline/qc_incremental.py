@@ -0,0 +1,133 @@
+import io
+import numpy as np
+import pandas as pd
+
+from atomic_io import atomic_open, atomic_path
+from columnar import open_columnar
+from qc import (flag_rows, summarize, format_report, select_flagged, load_state, save_state, dtype_names, STRATA,
+                chart_summary, read_chart_summary, update_chart_summary, save_chart_summary, strata_flags_from,
+                add_strata_flags)
+from qc_rules import load_rules
+from logging_utils import instrument
+
+# After a snapshot diff only the subjects it reports can have changed. Their
+# previous cleaned rows are read back from the columnar cache, their new rows
+# are re-flagged, and the aggregates saved by the last QC run are corrected by
+# the difference instead of being recomputed over the whole cohort. The same
+# goes for the chart summary: its means, stds and histogram bin counts are
+# corrected by the changed rows, and it is only rebuilt when a min or max (and
+# so the bin edges) moves. Stratified QC keeps the group medians, MADs and
+# alerts of the last full run; the changed rows are scored against them, and
+# they are refreshed by the next full QC run.
+
+
+def changed_subjects(changes):
+    """Subject keys touched by a list of snapshot audit records"""
+    return {str(change["subjectkey"]) for change in changes}
+
+
+def previous_rows(dataset_name, subjects, base_hash):
+    """Cleaned rows of `subjects` as the last QC run saw them.
+
+    Must be called before the cleaned outputs are rewritten. `base_hash` is
+    the raw version the snapshot diff was taken against. Returns None when the
+    saved QC state does not match it (or the rules or columnar cache changed).
+    """
+    loaded = load_state(dataset_name)
+    if loaded is None or base_hash is None:
+        return None
+    state, _ = loaded
+    columnar = open_columnar(dataset_name)
+    if state["raw_hash"] != base_hash or state["rules"] != load_rules(dataset_name):
+        return None
+    if columnar is None or columnar.meta["source"] != state["source"] or len(columnar) != state["n_total"]:
+        return None
+
+    keys = columnar.column("subjectkey")
+    rows = np.flatnonzero(keys.isin(subjects).to_numpy())
+    return columnar.to_frame(rows=rows)
+
+
+def _apply_delta(counts, old, new):
+    merged = pd.concat([counts, -old, new]).groupby(level=0, sort=False).sum()
+    return merged[merged != 0]
+
+
+def _in_row_order(values, position):
+    return [values[i] for i in np.argsort(position.reindex(values).to_numpy(), kind="stable")]
+
+
+def _as_text(df):
+    """A frame as the strings to_csv would write, so rewritten rows stay byte-identical"""
+    return pd.read_csv(io.StringIO(df.to_csv(index=False)), dtype=str, keep_default_na=False)
+
+
+def update_qc(dataset_name, df_clean, df_old, subjects, raw_hash=None):
+    """Apply a snapshot delta to the saved QC state and rewrite the report and flags file.
+
+    `df_clean` is the new cleaned frame and `df_old` the previous rows of the
+    changed `subjects` (see previous_rows()). Returns the report text, or None
+    if the delta cannot be applied and a full QC run is needed.
+    """
+    # An unusable delta is logged as a cache miss; the full QC run that follows has its own entry
+    with instrument("qc_incremental", dataset_name) as metrics:
+        metrics.cache = "miss"
+        state, summary = load_state(dataset_name)
+        rules = state["rules"]
+        # A different date format or sex/diagnosis mapping rewrites rows the diff never saw
+        options = df_clean.attrs.get("preprocess_options")
+        if options is None or options != state["options"] or dtype_names(df_clean.dtypes.to_dict()) != state["dtypes"]:
+            return None
+
+        keys = df_clean["subjectkey"].astype(str)
+        if keys.duplicated().any() or df_old["subjectkey"].astype(str).duplicated().any():
+            return None
+        position = pd.Series(np.arange(len(keys)), index=keys.to_numpy())
+        df_new = df_clean[keys.isin(subjects).to_numpy()]
+        if summary["n_total"] - len(df_old) + len(df_new) != len(df_clean):
+            return None
+
+        flagged_path = f"data/cleaned/{dataset_name}_qc_flags.csv"
+        metrics.read(flagged_path)
+        kept = pd.read_csv(flagged_path, dtype=str, keep_default_na=False)
+        # A state saved before stratified QC existed has no group statistics to score against
+        if "strata" not in summary and any(by in df_clean.columns for by in STRATA):
+            return None
+        df_new = add_strata_flags(flag_rows(df_new, rules), strata_flags_from(df_new, summary.get("strata", {})))
+        fresh = _as_text(select_flagged(df_new, rules))
+        if list(kept.columns) != list(fresh.columns):
+            return None
+
+        # --- Correct the aggregates by the changed rows ---
+        old = summarize(flag_rows(df_old, rules), rules)
+        new = summarize(df_new, rules)
+        summary["n_total"] += new["n_total"] - old["n_total"]
+        summary["counts"] = {name: count - old["counts"][name] + new["counts"][name]
+                             for name, count in summary["counts"].items()}
+        summary["missing"] = {field: _in_row_order([i for i in ids if i not in subjects] + new["missing"][field], position)
+                              for field, ids in summary["missing"].items()}
+        summary["dists"] = {col: _apply_delta(counts, old["dists"][col], new["dists"][col])
+                            for col, counts in summary["dists"].items()}
+
+        # --- Rewrite report and flags ---
+        report_text = format_report(summary, f"{dataset_name}_cleaned.csv")
+        with atomic_open(f"data/cleaned/{dataset_name}_qc_report.txt") as f:
+            f.write(report_text)
+
+        flags = pd.concat([kept[~kept["subjectkey"].isin(subjects)], fresh], ignore_index=True)
+        flags = flags.iloc[np.argsort(position.reindex(flags["subjectkey"]).to_numpy(), kind="stable")]
+        with atomic_path(flagged_path) as tmp_path:
+            flags.to_csv(tmp_path, index=False)
+
+        save_state(summary, dataset_name, rules, df_clean.dtypes.to_dict(), raw_hash, options)
+        charts = read_chart_summary(dataset_name)
+        charts = update_chart_summary(charts, df_old, df_new, summary) \
+            if charts is not None and charts.get("source") == state["source"] else None
+        if charts is None:
+            # No summary of the previous version, or a min or max moved the histogram edges
+            charts = chart_summary(df_clean, summary)
+        summary_path = save_chart_summary(charts, dataset_name)
+        metrics.cache = "hit"
+        metrics.rows(len(df_new), len(flags))
+        metrics.wrote(f"data/cleaned/{dataset_name}_qc_report.txt", flagged_path, summary_path)
+        return report_text
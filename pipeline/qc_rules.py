@@ -0,0 +1,145 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# QC checks are declared in a JSON spec rather than in code. The default spec
+# lives next to this file; a dataset can override it with
+# data/metadata/<dataset>_qc_rules.json. Each rule becomes one boolean flag
+# column named after the rule (True = row violates the rule).
+#
+# Rule types:
+#   required        {"columns": [...]}                   any listed value missing
+#   range           {"column", "min", "max"}             value below min or above max
+#   allowed         {"column", "values": [...]}          non-missing value not in the list
+#   regex           {"column", "pattern"}                non-missing value not fully matching
+#   cross_field     {"expr"}                             pandas expression true, e.g. "age < 18 and IQ > 140"
+#   per_site_range  {"column", "ranges": {site: [min, max]}, "default": [min, max], "site_column"}
+#
+# A missing column behaves like an all-missing one.
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "qc_rules.json")
+
+
+def rules_path(dataset_name=None):
+    if dataset_name:
+        override = f"data/metadata/{dataset_name}_qc_rules.json"
+        if os.path.exists(override):
+            return override
+    return DEFAULT_RULES_PATH
+
+
+def load_rules(dataset_name=None):
+    """Load and validate the QC rule spec that applies to a dataset"""
+    path = rules_path(dataset_name)
+    with open(path) as f:
+        rules = json.load(f)["rules"]
+
+    names = [rule["name"] for rule in rules]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate QC rule names in {path}")
+    for rule in rules:
+        if rule.get("type") not in COMPILERS:
+            raise ValueError(f"Unknown QC rule type {rule.get('type')!r} for rule {rule['name']!r} in {path}")
+    return rules
+
+
+def _column(df, col):
+    if col in df.columns:
+        return df[col]
+    return pd.Series(np.nan, index=df.index, dtype=float)
+
+
+def _numeric(df, col):
+    return pd.to_numeric(_column(df, col), errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+
+def _outside(values, lo, hi):
+    # NaN compares False, so missing values are never out of range
+    mask = np.zeros(len(values), dtype=bool)
+    if lo is not None:
+        mask |= values < lo
+    if hi is not None:
+        mask |= values > hi
+    return mask
+
+
+def _required(rule):
+    columns = rule["columns"]
+    return lambda df: np.logical_or.reduce([_column(df, col).isnull().to_numpy() for col in columns] +
+                                           [np.zeros(len(df), dtype=bool)])
+
+
+def _range(rule):
+    return lambda df: _outside(_numeric(df, rule["column"]), rule.get("min"), rule.get("max"))
+
+
+def _allowed(rule):
+    def mask(df):
+        values = _column(df, rule["column"])
+        return (values.notna() & ~values.isin(rule["values"])).to_numpy()
+    return mask
+
+
+def _regex(rule):
+    def mask(df):
+        values = _column(df, rule["column"])
+        matched = values.astype(str).str.fullmatch(rule["pattern"]).fillna(False).astype(bool)
+        return (values.notna() & ~matched).to_numpy()
+    return mask
+
+
+def _cross_field(rule):
+    def mask(df):
+        try:
+            result = df.eval(rule["expr"])
+        except Exception as e:
+            raise ValueError(f"QC rule {rule['name']!r} could not evaluate {rule['expr']!r}: {e}") from e
+        return pd.Series(result, index=df.index).fillna(False).astype(bool).to_numpy()
+    return mask
+
+
+def _per_site_range(rule):
+    default_lo, default_hi = rule.get("default", [None, None])
+
+    def mask(df):
+        sites = _column(df, rule.get("site_column", "site"))
+        lo = sites.map({site: bounds[0] for site, bounds in rule["ranges"].items()})
+        hi = sites.map({site: bounds[1] for site, bounds in rule["ranges"].items()})
+        lo = pd.to_numeric(lo, errors="coerce").fillna(-np.inf if default_lo is None else default_lo).to_numpy(dtype=float)
+        hi = pd.to_numeric(hi, errors="coerce").fillna(np.inf if default_hi is None else default_hi).to_numpy(dtype=float)
+        return _outside(_numeric(df, rule["column"]), lo, hi)
+    return mask
+
+
+COMPILERS = {
+    "required": _required,
+    "range": _range,
+    "allowed": _allowed,
+    "regex": _regex,
+    "cross_field": _cross_field,
+    "per_site_range": _per_site_range,
+}
+
+
+def compile_rules(rules):
+    """Turn a rule spec into (name, mask function) pairs"""
+    return [(rule["name"], COMPILERS[rule["type"]](rule)) for rule in rules]
+
+
+def evaluate(df, compiled):
+    """Evaluate every compiled rule against a frame and return one boolean column per rule"""
+    return pd.DataFrame({name: mask(df) for name, mask in compiled}, index=df.index)
+
+
+def required_fields(rules):
+    """Columns checked by `required` rules, in spec order, for the missing-values breakdown"""
+    fields = []
+    for rule in rules:
+        if rule["type"] == "required":
+            fields += [col for col in rule["columns"] if col not in fields]
+    return fields
+
+
+def rule_labels(rules):
+    """Report labels for the rules listed with a count (required rules get the missing breakdown)"""
+    return {rule["name"]: rule.get("label", f"{rule['name']} flags") for rule in rules if rule["type"] != "required"}
@@ -0,0 +1,159 @@
+import csv
+import io
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from storage import resolve
+
+# Column types are declared per dataset instead of being re-inferred by every
+# reader. The default schema lives next to this file; a dataset can override it
+# with data/metadata/<dataset>_schema.json.
+#
+#   sentinels   values that mean "missing" (read as NaN when a reader asks for it)
+#   usecols     the only columns ever loaded for the dataset (null = all of them)
+#   columns     {name: {"type": ..., "values": [...], "dtype": ...}}
+#
+# Column types:
+#   string      kept as text, never type-inferred
+#   category    dictionary-encoded while parsing. "values" is the expected
+#               vocabulary and comes first in the dictionary, in that order;
+#               other values are kept (an `allowed` QC rule can flag them).
+#               Numeric codes (e.g. sex as 1/2) are returned as the plain
+#               int/float column a default parse would give.
+#   number      inferred by pandas unless a numpy "dtype" is given
+#
+# Columns the schema does not list are inferred by pandas as before.
+DEFAULT_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.json")
+TYPES = ("string", "category", "number")
+
+
+def schema_path(dataset_name=None):
+    if dataset_name:
+        override = f"data/metadata/{dataset_name}_schema.json"
+        if os.path.exists(override):
+            return override
+    return DEFAULT_SCHEMA_PATH
+
+
+def load_schema(dataset_name=None):
+    """Load and validate the schema that applies to a dataset"""
+    path = schema_path(dataset_name)
+    with open(path) as f:
+        schema = json.load(f)
+
+    schema.setdefault("sentinels", [])
+    schema.setdefault("usecols", None)
+    schema.setdefault("columns", {})
+    for col, spec in schema["columns"].items():
+        if spec.get("type") not in TYPES:
+            raise ValueError(f"Unknown type {spec.get('type')!r} for column {col!r} in {path}")
+    return schema
+
+
+def parse_dtypes(schema):
+    """The read_csv dtype mapping for a schema's declared columns"""
+    dtypes = {}
+    for col, spec in schema["columns"].items():
+        if spec["type"] == "string":
+            dtypes[col] = str
+        elif spec["type"] == "category":
+            dtypes[col] = "category"
+        elif spec.get("dtype"):
+            dtypes[col] = spec["dtype"]
+    return dtypes
+
+
+def plain_codes(series):
+    """A categorical of numbers as the plain int64/float64 column a default parse gives; other series unchanged"""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    series = series.cat.remove_unused_categories()
+    categories = series.cat.categories
+    if len(categories) == 0:
+        return series.astype(float)
+    if categories.dtype.kind not in "iuf":
+        try:
+            numeric = pd.to_numeric(categories)
+        except (ValueError, TypeError):
+            return series
+        if not numeric.is_unique:
+            return series
+        series = series.cat.rename_categories(numeric)
+        categories = series.cat.categories
+    return series.astype(categories.dtype if series.notna().all() else float)
+
+
+def decode_codes(df):
+    """plain_codes() applied to every column of a frame"""
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = plain_codes(df[col])
+    return df
+
+
+def _with_vocabulary(series, values):
+    known = [value for value in values if value in series.cat.categories]
+    seen = set(known)
+    ordered = known + [value for value in series.cat.categories if value not in seen]
+    if ordered != list(series.cat.categories):
+        series = series.cat.reorder_categories(ordered)
+    return series
+
+
+def apply_schema(df, schema):
+    """Finish a parsed frame: vocabulary order for categoricals, numeric codes as plain columns"""
+    for col, spec in schema["columns"].items():
+        if col in df.columns and spec["type"] == "category":
+            values = plain_codes(df[col])
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = _with_vocabulary(values, spec.get("values", []))
+            df[col] = values
+    return df
+
+
+def read_csv(path, dataset_name=None, columns=None, sentinels=False, **kwargs):
+    """pd.read_csv with a dataset's schema applied.
+
+    `columns` limits the load to those columns (when present) and
+    `sentinels=True` reads the schema's sentinel values as NaN. With
+    `chunksize` an iterator of finished chunks is returned. A compressed file
+    is found and decompressed by storage.resolve().
+    """
+    path = resolve(path)
+    schema = load_schema(dataset_name)
+    wanted = columns if columns is not None else schema["usecols"]
+    if wanted is not None:
+        wanted = set(wanted)
+        kwargs.setdefault("usecols", lambda col: col in wanted)
+    if sentinels:
+        kwargs.setdefault("na_values", schema["sentinels"])
+    kwargs.setdefault("dtype", parse_dtypes(schema))
+
+    if kwargs.get("chunksize"):
+        return (apply_schema(chunk, schema) for chunk in pd.read_csv(path, **kwargs))
+    return apply_schema(pd.read_csv(path, **kwargs), schema)
+
+
+def read_header(f):
+    """Column names from the first line of an open CSV (text or binary), without reading further"""
+    line = f.readline()
+    if isinstance(line, bytes):
+        line = line.decode("utf-8-sig")
+    return next(csv.reader(io.StringIO(line.lstrip("\ufeff"))), [])
+
+
+def value_counts(series):
+    """series.value_counts(sort=False), in first-seen order also for categoricals.
+
+    A categorical's own value_counts() follows the dictionary order and lists
+    unused categories with a zero count; here only values present are counted.
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.value_counts(sort=False)
+    codes = series.cat.codes.to_numpy()
+    codes = codes[codes >= 0]
+    seen = pd.unique(codes)
+    counts = np.bincount(codes, minlength=len(series.cat.categories))[seen]
+    return pd.Series(counts.astype("int64"), index=pd.Index(series.cat.categories[seen], name=series.name), name="count")
@@ -0,0 +1,78 @@
+import contextlib
+import fcntl
+import json
+import os
+
+from atomic_io import atomic_open
+from hash_registry import file_hash
+
+# One pipeline run per dataset at a time, across dashboard sessions (threads),
+# job workers, batch runs and the CLI. Runs hold per-dataset lock files in
+# LOCK_DIR with flock() while they write that dataset's outputs:
+#   <id>.cleaned.lock     cleaned CSV, columnar cache, QC report/flags/state
+#   <id>.snapshot.lock    snapshot store, audit history
+#   <id>.last_run.json    raw hash and result of the last completed run_pipeline()
+# A caller that had to wait for a run of the same raw version returns that
+# run's result instead of repeating it.
+LOCK_DIR = "data/locks"
+SCOPES = ("cleaned", "snapshot")
+
+
+def lock_path(dataset_id, scope):
+    return os.path.join(LOCK_DIR, f"{dataset_id}.{scope}.lock")
+
+
+def last_run_path(dataset_id):
+    return os.path.join(LOCK_DIR, f"{dataset_id}.last_run.json")
+
+
+@contextlib.contextmanager
+def dataset_lock(dataset_id, scopes=SCOPES):
+    """Hold a dataset's locks for `scopes`; yields True if another holder had to be waited for"""
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    files = []
+    waited = False
+    try:
+        # Always taken in the same order, so holders of overlapping scopes cannot deadlock
+        for scope in sorted(scopes):
+            f = open(lock_path(dataset_id, scope), "a")
+            files.append(f)
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                waited = True
+                fcntl.flock(f, fcntl.LOCK_EX)
+        yield waited
+    finally:
+        # Closing the file releases its lock
+        for f in reversed(files):
+            f.close()
+
+
+class Flight:
+    """One caller's turn at a dataset run; `shared` is True when a concurrent run's result was reused"""
+
+    def __init__(self, dataset_id, raw_hash):
+        self.dataset_id = dataset_id
+        self.raw_hash = raw_hash
+        self.shared = False
+        self.result = None
+
+    def publish(self, result):
+        self.result = result
+        with atomic_open(last_run_path(self.dataset_id)) as f:
+            json.dump({"raw_hash": self.raw_hash, "result": result}, f, default=str)
+
+
+@contextlib.contextmanager
+def single_flight(dataset_id):
+    """Run at most one pipeline for a dataset at a time; waiters share the result of the run they waited on"""
+    raw_path = f"data/raw/{dataset_id}.csv"
+    with dataset_lock(dataset_id) as waited:
+        flight = Flight(dataset_id, file_hash(raw_path))
+        if waited and os.path.exists(last_run_path(dataset_id)):
+            with open(last_run_path(dataset_id)) as f:
+                last = json.load(f)
+            if last["raw_hash"] == flight.raw_hash:
+                flight.shared, flight.result = True, last["result"]
+        yield flight
@@ -1,138 +1,305 @@
+import contextlib
 import pandas as pd
+import numpy as np
 import os
 import sys
-from pathlib import Path
+import tempfile
 from datetime import datetime
-import hashlib
-
-
-if len(sys.argv) < 2:
-    print("Usage: python snapshot_compare.py <dataset_name>")
-    sys.exit(1)
-
-dataset_id = sys.argv[1].replace(".csv", "")
-raw_path = f"data/raw/{dataset_id}.csv"
-snapshot_path = f"data/snapshots/{dataset_id}_snapshot.csv"
-audit_path = f"data/audit/{dataset_id}_column_diff_history.csv"
-hash_log_path = "docs/data_change_log.csv"
-
-def hash_file(filepath):
-    hasher = hashlib.sha256()
-    with open(filepath, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hasher.update(chunk)
-    return hasher.hexdigest()
-
-# Load current version
-df_current = pd.read_csv(raw_path)
-df_current["subjectkey"] = df_current["subjectkey"].astype(str).str.strip()
-df_current = df_current[df_current["subjectkey"] != "nan"]
-df_current.set_index("subjectkey", inplace=True)
-
-# Check for existing snapshot and log initial hash
-if not os.path.exists(snapshot_path):
-    df_current.to_csv(snapshot_path)
-    print("📥 Initial snapshot created.")
-
-    # ➕ Log hash even if no changes
-    file_hash = hash_file(raw_path)
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_line = f"{timestamp},{raw_path},{file_hash}\n"
-
-    # Append safely to hash log
-    if os.path.exists(hash_log_path):
-        with open(hash_log_path, "rb+") as f:
-            f.seek(-1, os.SEEK_END)
-            last_char = f.read(1)
-            if last_char != b"\n":
-                log_line = "\n" + log_line
-    with open(hash_log_path, "a") as f:
-        f.write(log_line)
-    print("🔐 Initial file hash logged.")
-    sys.exit(0)  # Done for new upload
-    
-
-# Load previous snapshot
-df_prev = pd.read_csv(snapshot_path)
-df_prev["subjectkey"] = df_prev["subjectkey"].astype(str).str.strip()
-df_prev = df_prev[df_prev["subjectkey"] != "nan"]
-df_prev.set_index("subjectkey", inplace=True)
-
-# Detect changes
-changes = []
-timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-old_keys = set(df_prev.index)
-new_keys = set(df_current.index)
-
-added_keys = new_keys - old_keys
-removed_keys = old_keys - new_keys
-common_keys = old_keys & new_keys
-
-for subject in added_keys:
-    changes.append({
-        "timestamp": timestamp,
-        "subjectkey": subject,
-        "column": "ROW_STATUS",
-        "old_value": "N/A",
-        "new_value": "🆕 ADDED"
-    })
-
-for subject in removed_keys:
-    changes.append({
-        "timestamp": timestamp,
-        "subjectkey": subject,
-        "column": "ROW_STATUS",
-        "old_value": "❌ REMOVED",
-        "new_value": "N/A"
-    })
-
-df_old_common = df_prev.loc[list(common_keys)]
-df_new_common = df_current.loc[list(common_keys)]
-
-for subject in common_keys:
-    row_old = df_old_common.loc[subject]
-    row_new = df_new_common.loc[subject]
-    for col in df_current.columns:
-        old_val = row_old.get(col)
-        new_val = row_new.get(col)
-        if pd.isnull(old_val) and pd.isnull(new_val):
+
+from atomic_io import atomic_open
+from hash_registry import record_hash, file_hash, latest_hash
+from audit_store import AUDIT_COLUMNS, append_changes, audit_csv_path
+from external_sort import external_sort, first_occurrences, key_ranges
+from logging_utils import instrument
+from schema import read_csv
+import storage
+from snapshot_store import (versions, save_version, compare_with_latest, stored_files, legacy_snapshot_path,
+                            index_path, stream_version)
+from streaming import widen_dtype, align_dtypes
+from subject_index import index_dataset
+
+RUN_ROWS = 200_000
+
+
+def key_frame(df):
+    """Index a frame by its stripped subjectkey, dropping rows without one"""
+    df = df.copy()
+    df["subjectkey"] = df["subjectkey"].astype(str).str.strip()
+    df = df[df["subjectkey"] != "nan"]
+    df.set_index("subjectkey", inplace=True)
+    return df
+
+
+def load_keyed(path, dataset_id=None):
+    """Load a CSV through the dataset's schema, indexed by a stripped subjectkey"""
+    return key_frame(read_csv(path, dataset_id))
+
+
+def _column_values(df, col, rows):
+    """Return a column as an array aligned to `rows` (all-NaN if the column is absent)"""
+    if col not in df.columns:
+        return np.full(len(rows), np.nan, dtype=object)
+    series = df[col].iloc[rows]
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind in "iuf":
+        return series.to_numpy()
+    return series.to_numpy(dtype=object, na_value=np.nan)
+
+
+def diff_frames(df_prev, df_current, timestamp):
+    """Compare two subjectkey-indexed frames and return audit records.
+
+    Both frames are aligned on subjectkey once; each column is then compared
+    as a whole array, with cells that are null on both sides treated as equal.
+    """
+    # Duplicate keys cannot be aligned one-to-one; keep the first occurrence
+    df_prev = df_prev[~df_prev.index.duplicated()]
+    df_current = df_current[~df_current.index.duplicated()]
+
+    # One hash lookup each way: position of every current subject in the
+    # previous frame (-1 if added), and of every previous subject in the current one
+    all_old_rows = df_prev.index.get_indexer(df_current.index)
+    removed = df_current.index.get_indexer(df_prev.index) == -1
+
+    changes = []
+    for subject in df_current.index[all_old_rows == -1]:
+        changes.append({
+            "timestamp": timestamp,
+            "subjectkey": subject,
+            "column": "ROW_STATUS",
+            "old_value": "N/A",
+            "new_value": "🆕 ADDED"
+        })
+
+    for subject in df_prev.index[removed]:
+        changes.append({
+            "timestamp": timestamp,
+            "subjectkey": subject,
+            "column": "ROW_STATUS",
+            "old_value": "❌ REMOVED",
+            "new_value": "N/A"
+        })
+
+    # --- Align common subjects positionally ---
+    new_rows = np.flatnonzero(all_old_rows >= 0)
+    common = df_current.index[new_rows]
+    old_rows = all_old_rows[new_rows]
+
+    hit_rows, hit_cols, hit_old, hit_new = [], [], [], []
+    for col_idx, col in enumerate(df_current.columns):
+        old_vals = _column_values(df_prev, col, old_rows)
+        new_vals = _column_values(df_current, col, new_rows)
+        if old_vals.dtype == object or new_vals.dtype == object:
+            old_vals = old_vals.astype(object)
+            new_vals = new_vals.astype(object)
+
+        both_null = pd.isna(old_vals) & pd.isna(new_vals)
+        changed = np.asarray(old_vals != new_vals, dtype=bool) & ~both_null
+        idx = np.flatnonzero(changed)
+        if len(idx) == 0:
             continue
-        if old_val != new_val:
+        hit_rows.append(idx)
+        hit_cols.append(np.full(len(idx), col_idx))
+        hit_old.append(old_vals[idx].astype(object))
+        hit_new.append(new_vals[idx].astype(object))
+
+    if hit_rows:
+        rows = np.concatenate(hit_rows)
+        cols = np.concatenate(hit_cols)
+        olds = np.concatenate(hit_old)
+        news = np.concatenate(hit_new)
+        # Emit subject-major, column-minor like the row-by-row comparison did
+        order = np.lexsort((cols, rows))
+        columns = df_current.columns
+        for i in order:
             changes.append({
                 "timestamp": timestamp,
-                "subjectkey": subject,
-                "column": col,
-                "old_value": old_val,
-                "new_value": new_val
+                "subjectkey": common[rows[i]],
+                "column": columns[cols[i]],
+                "old_value": olds[i],
+                "new_value": news[i]
             })
 
-# Save results
-if changes:
-    df_changes = pd.DataFrame(changes)
-    if os.path.exists(audit_path):
-        df_existing = pd.read_csv(audit_path)
-        df_combined = pd.concat([df_existing, df_changes], ignore_index=True)
-        df_combined.to_csv(audit_path, index=False)
+    return changes
+
+
+# --- Out-of-core comparison ---
+# For cohorts too large to hold twice in memory. Both sides are read RUN_ROWS
+# rows at a time, externally sorted by subjectkey (see external_sort.py) and
+# merge-joined: each key range both sides have fully read is diffed with
+# diff_frames() and appended to the audit history before the next one is read,
+# and the raw file's hash is logged. Records come one key range at a time, in
+# subjectkey order, rather than grouped by kind over the whole cohort;
+# otherwise they are the ones the in-memory diff gives. Rows without a
+# subjectkey are skipped. The version itself is stored by the next pipeline
+# run, which finds its records already logged and does not log them again
+# (see already_logged()). With an `out_path`, records go to that file instead
+# and nothing else is touched.
+
+def _keyed(chunks):
+    for chunk in chunks:
+        chunk = key_frame(chunk)
+        yield chunk[chunk.index.notna()]
+
+
+def raw_chunks(raw_path, dataset_id=None, chunksize=RUN_ROWS):
+    """A raw export as subjectkey-indexed chunks, with the dtypes one whole-file parse would give"""
+    dtypes = {}
+    for chunk in read_csv(raw_path, dataset_id, chunksize=chunksize):
+        for col in chunk.columns:
+            dtypes[col] = widen_dtype(dtypes.get(col), chunk[col].dtype)
+    for chunk in _keyed(read_csv(raw_path, dataset_id, chunksize=chunksize)):
+        yield align_dtypes(chunk, dtypes)
+
+
+def diff_streams(prev_chunks, current_chunks, timestamp, scratch_dir=None):
+    """Diff two sequences of subjectkey-indexed chunks with bounded memory, yielding batches of audit records"""
+    with tempfile.TemporaryDirectory(prefix="snapshot_diff_", dir=scratch_dir) as tmp:
+        prev = first_occurrences(external_sort(prev_chunks, tmp))
+        current = first_occurrences(external_sort(current_chunks, tmp))
+        for df_prev, df_current in key_ranges([prev, current]):
+            df_prev = df_current.iloc[:0] if df_prev is None else df_prev
+            df_current = df_prev.iloc[:0] if df_current is None else df_current
+            changes = diff_frames(df_prev, df_current, timestamp)
+            if changes:
+                yield changes
+
+
+def already_logged(dataset_id, raw_hash):
+    """True if compare_out_of_core() logged this raw version's records before it was stored as a version"""
+    raw_path = f"data/raw/{dataset_id}.csv"
+    entries = versions(dataset_id)
+    return raw_hash is not None and bool(entries) and entries[-1].get("raw_hash") != raw_hash \
+        and latest_hash(raw_path) == raw_hash
+
+
+def compare_out_of_core(dataset_id, raw_path=None, run_rows=RUN_ROWS, out_path=None, scratch_dir=None):
+    """Diff a raw export against the latest stored version without loading either whole.
+
+    Each batch of records is appended to the audit history and the raw hash
+    logged; with `out_path`, records are written there (in the history's
+    format) instead and the history and hash log are left untouched.
+    Returns the number of records by kind (added, removed, modified).
+    """
+    raw_path = raw_path or f"data/raw/{dataset_id}.csv"
+    counts = {"added": 0, "removed": 0, "modified": 0}
+
+    with instrument("snapshot_out_of_core", dataset_id) as metrics:
+        import_legacy_snapshot(dataset_id)
+        if not versions(dataset_id):
+            raise ValueError(f"No stored snapshot of {dataset_id} to compare against")
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        metrics.read(raw_path)
+
+        with contextlib.ExitStack() as stack:
+            if out_path:
+                os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+                f = stack.enter_context(atomic_open(out_path, newline=""))
+                pd.DataFrame(columns=AUDIT_COLUMNS).to_csv(f, index=False)
+            for changes in diff_streams(stream_version(dataset_id, run_rows), raw_chunks(raw_path, dataset_id, run_rows),
+                                        timestamp, scratch_dir):
+                for change in changes:
+                    kind = "modified" if change["column"] != "ROW_STATUS" else \
+                        "added" if change["old_value"] == "N/A" else "removed"
+                    counts[kind] += 1
+                if out_path:
+                    pd.DataFrame(changes, columns=AUDIT_COLUMNS).to_csv(f, header=False, index=False)
+                else:
+                    append_changes(dataset_id, changes)
+
+        if not out_path and sum(counts.values()):
+            record_hash(raw_path, timestamp=timestamp)
+        metrics.rows(rows_out=sum(counts.values()))
+        metrics.wrote(out_path or audit_csv_path(dataset_id))
+    return counts
+
+
+def import_legacy_snapshot(dataset_id):
+    """Move a data/snapshots/<id>_snapshot.csv from before versioning into the snapshot store"""
+    legacy_path = legacy_snapshot_path(dataset_id)
+    if versions(dataset_id) or not storage.exists(legacy_path):
+        return
+    timestamp = datetime.fromtimestamp(os.path.getmtime(storage.resolve(legacy_path))).strftime("%Y-%m-%d %H:%M:%S")
+    save_version(dataset_id, load_keyed(legacy_path, dataset_id), timestamp=timestamp)
+    storage.remove(legacy_path)
+    print(f"📦 Moved {legacy_path} into the snapshot store as version 1.")
+
+
+def compare_snapshot(df_raw, dataset_id):
+    """Diff a raw frame against the latest stored version, log changes and store the new version.
+
+    The cross-dataset subject index is then caught up with the new version and records.
+
+    Returns the list of audit records written (empty for an initial snapshot).
+    """
+    raw_path = f"data/raw/{dataset_id}.csv"
+    audit_path = audit_csv_path(dataset_id)
+
+    with instrument("snapshot", dataset_id) as metrics:
+        df_current = key_frame(df_raw)
+        import_legacy_snapshot(dataset_id)
+        raw_hash = file_hash(raw_path) if storage.exists(raw_path) else None
+
+        # Check for existing snapshot and log initial hash
+        if not versions(dataset_id):
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            entry = save_version(dataset_id, df_current, raw_hash, timestamp)
+            print("📥 Initial snapshot created.")
+
+            # ➕ Log hash even if no changes
+            record_hash(raw_path, timestamp=timestamp)
+            print("🔐 Initial file hash logged.")
+            index_dataset(dataset_id)
+            metrics.rows(len(df_raw), 0)
+            metrics.wrote(*stored_files(dataset_id, entry))
+            return []
+
+        # Only rows whose content hash differs from the latest version are read back and compared
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        df_prev, df_new = compare_with_latest(dataset_id, df_current)
+        metrics.read(index_path(dataset_id))
+        changes = diff_frames(df_prev, df_new, timestamp)
+
+        # Save results
+        if changes and already_logged(dataset_id, raw_hash):
+            print(f"🔍 Changes in dataset `{dataset_id}` were already logged by an out-of-core comparison.")
+        elif changes:
+            append_changes(dataset_id, changes)
+            print(f"🔍 Changes detected in dataset `{dataset_id}` and logged to: {audit_path}")
+
+            # Generate and log hash with timestamp
+            record_hash(raw_path, timestamp=timestamp)
+            print("🔐 File hash logged.")
+        else:
+            print("✅ No column-level changes detected.")
+
+        # Store the new version as a delta of the latest one
+        entry = save_version(dataset_id, df_current, raw_hash, timestamp)
+        if entry is None:
+            print("📸 Snapshot unchanged.")
+        else:
+            print(f"📸 Snapshot updated (version {entry['version']}, {entry['kind']}).")
+            metrics.wrote(*stored_files(dataset_id, entry))
+        index_dataset(dataset_id)
+        metrics.rows(len(df_raw), len(changes))
+        return changes
+
+
+def main(dataset_id):
+    # Load current version
+    compare_snapshot(read_csv(f"data/raw/{dataset_id}.csv", dataset_id), dataset_id)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python snapshot_compare.py <dataset_name> [--out-of-core [--run-rows N] [--out PATH]]")
+        sys.exit(1)
+
+    dataset_id = sys.argv[1].replace(".csv", "")
+    if "--out-of-core" in sys.argv:
+        run_rows = int(sys.argv[sys.argv.index("--run-rows") + 1]) if "--run-rows" in sys.argv else RUN_ROWS
+        out_path = sys.argv[sys.argv.index("--out") + 1] if "--out" in sys.argv else None
+        counts = compare_out_of_core(dataset_id, run_rows=run_rows, out_path=out_path)
+        print(f"🔍 {counts['added']} added, {counts['removed']} removed and {counts['modified']} modified cell(s) "
+              f"written to {out_path or audit_csv_path(dataset_id)}")
     else:
-        df_changes.to_csv(audit_path, index=False)
-    print(f"🔍 Changes detected in dataset `{dataset_id}` and logged to: {audit_path}")
-
-    # Generate and log hash with timestamp
-    file_hash = hash_file(raw_path)
-    log_line = f"{timestamp},{raw_path},{file_hash}\n"
-    if os.path.exists(hash_log_path):
-        with open(hash_log_path, "rb+") as f:
-            f.seek(-1, os.SEEK_END)
-            last_char = f.read(1)
-            if last_char != b"\n":
-                log_line = "\n" + log_line
-    with open(hash_log_path, "a") as f:
-        f.write(log_line)
-    print("🔐 File hash logged.")
-else:
-    print("✅ No column-level changes detected.")
-
-# Update snapshot
-df_current.to_csv(snapshot_path)
-print("📸 Snapshot updated.")
+        main(dataset_id)
@@ -0,0 +1,402 @@
+import json
+import os
+import sqlite3
+import sys
+import numpy as np
+import pandas as pd
+
+import storage
+from atomic_io import atomic_open
+
+# data/snapshots/<id>/ keeps every raw version the snapshot compare has seen,
+# without a full copy of the cohort per version:
+#   manifest.json       one entry per version: raw hash, timestamp, columns, dtypes, row count, kind
+#   v0001.csv           rows stored by a version: the whole cohort for a "full" version,
+#                       only added and modified rows for a "delta" version
+#   v0002_removed.csv   subjectkeys a delta version removed
+#   v0002_order.csv     the version's key order, only written when rows were reordered
+# Version files are written and read through storage.py, so they are stored
+# compressed (v0001.csv.gz) unless a file of that name already exists plain.
+# A version is stored in full when it is the first one, its columns changed, more
+# than FULL_FRACTION of its rows changed, or MAX_DELTAS deltas have piled up since
+# the last full version.
+#
+# index.sqlite is a local index over the latest version (rebuilt from the files
+# when missing or behind): every subjectkey with its row hash, the version file
+# and row holding its content, and its rank in the key order. Rows are keyed by
+# subjectkey; a repeated key keeps its first row, as in the diff.
+FULL_FRACTION = 0.5
+MAX_DELTAS = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    subjectkey TEXT PRIMARY KEY,
+    hash INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    row INTEGER NOT NULL,
+    rank INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rows_location ON rows (version, row);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def store_dir(dataset_id):
+    return f"data/snapshots/{dataset_id}"
+
+
+def manifest_path(dataset_id):
+    return os.path.join(store_dir(dataset_id), "manifest.json")
+
+
+def index_path(dataset_id):
+    return os.path.join(store_dir(dataset_id), "index.sqlite")
+
+
+def legacy_snapshot_path(dataset_id):
+    return f"data/snapshots/{dataset_id}_snapshot.csv"
+
+
+def _file(dataset_id, version, suffix=""):
+    return os.path.join(store_dir(dataset_id), f"v{version:04d}{suffix}.csv")
+
+
+def load_manifest(dataset_id):
+    path = manifest_path(dataset_id)
+    if not os.path.exists(path):
+        return {"versions": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(dataset_id, manifest):
+    with atomic_open(manifest_path(dataset_id)) as f:
+        json.dump(manifest, f, indent=1)
+
+
+def versions(dataset_id):
+    """Stored versions of a dataset, oldest first"""
+    return load_manifest(dataset_id)["versions"]
+
+
+def has_snapshot(dataset_id):
+    return bool(versions(dataset_id)) or storage.exists(legacy_snapshot_path(dataset_id))
+
+
+def row_hashes(df):
+    """64-bit content hash per row of a subjectkey-indexed frame (the key is part of the hash)"""
+    return pd.util.hash_pandas_object(df, index=True).to_numpy().view(np.int64)
+
+
+def _dtype_name(dtype):
+    return dtype.str if isinstance(dtype, np.dtype) else str(dtype)
+
+
+def _read_dtype(name):
+    if name == "category":
+        return "category"
+    try:
+        dtype = np.dtype(name)
+    except TypeError:
+        return str
+    return dtype if dtype.kind in "biuf" else str
+
+
+def _entry_dtypes(entry):
+    dtype = {col: _read_dtype(name) for col, name in entry["dtypes"].items()}
+    dtype["subjectkey"] = str
+    return dtype
+
+
+def _read_rows(path, entry, rows=None):
+    """Rows of a version file parsed with the dtypes of version `entry`; `rows` limits it to those positions"""
+    path = storage.resolve(path)
+    dtype = _entry_dtypes(entry)
+    skiprows = None
+    if rows is not None:
+        wanted = set((np.asarray(rows) + 1).tolist())
+        skiprows = lambda i: i > 0 and i not in wanted
+    try:
+        df = pd.read_csv(path, index_col=0, dtype=dtype, skiprows=skiprows)
+    except (ValueError, TypeError):
+        df = pd.read_csv(path, index_col=0, dtype={"subjectkey": str}, skiprows=skiprows)
+    return df
+
+
+def _read_keys(path):
+    return pd.read_csv(storage.resolve(path), dtype=str, keep_default_na=False,
+                       usecols=["subjectkey"])["subjectkey"].tolist()
+
+
+# --- Local index ---
+
+def _replay(dataset_id, upto=None):
+    """Walk the versions up to `upto`, tracking where each key's content is stored.
+
+    Returns (entry of the last version, DataFrame indexed by subjectkey in key
+    order with the version and row holding each key's content).
+    """
+    entries = versions(dataset_id)
+    upto = upto or len(entries)
+    start = max(i for i in range(upto) if entries[i]["kind"] == "full")
+    locations = None
+    for entry in entries[start:upto]:
+        n = entry["version"]
+        keys = _read_keys(_file(dataset_id, n))
+        stored = pd.DataFrame({"version": n, "row": np.arange(len(keys))}, index=pd.Index(keys, name="subjectkey"))
+        if entry["kind"] == "full":
+            locations = stored
+            continue
+        removed = set(_read_keys(_file(dataset_id, n, "_removed")))
+        kept = locations[~locations.index.isin(removed)]
+        order = list(kept.index) + [k for k in stored.index if k not in kept.index]
+        if entry.get("reordered"):
+            order = _read_keys(_file(dataset_id, n, "_order"))
+        locations = pd.concat([kept[~kept.index.isin(stored.index)], stored]).reindex(order)
+    return entries[upto - 1], locations
+
+
+def load_version(dataset_id, version=None):
+    """Reconstruct a stored version (default: the latest) as a subjectkey-indexed frame"""
+    entry, locations = _replay(dataset_id, version)
+    parts = [_read_rows(_file(dataset_id, n), entry, group["row"].to_numpy())
+             for n, group in locations.groupby("version", sort=True)]
+    df = pd.concat(parts) if parts else pd.DataFrame(columns=entry["columns"])
+    df = df.reindex(locations.index)[entry["columns"]]
+    df.index.name = "subjectkey"
+    return df
+
+
+def _read_chunks(path, entry, chunksize):
+    """(first row, chunk) pairs of a version file, parsed like _read_rows()"""
+    path = storage.resolve(path)
+    start = 0
+    dtype = _entry_dtypes(entry)
+    while True:
+        try:
+            for chunk in pd.read_csv(path, index_col=0, dtype=dtype, chunksize=chunksize, skiprows=range(1, start + 1)):
+                yield start, chunk
+                start += len(chunk)
+            return
+        except (ValueError, TypeError):
+            if dtype == {"subjectkey": str}:
+                raise
+            dtype = {"subjectkey": str}
+
+
+def stream_version(dataset_id, chunksize):
+    """The latest stored version as subjectkey-indexed chunks of at most `chunksize` rows.
+
+    Each version file still holding live rows is read chunk by chunk and
+    filtered through the local index, so the version is never reconstructed
+    in memory. Chunks come file by file, not in the version's key order.
+    """
+    entry = versions(dataset_id)[-1]
+    conn = connect(dataset_id)
+    try:
+        stored = [n for (n,) in conn.execute("SELECT DISTINCT version FROM rows ORDER BY version")]
+        for n in stored:
+            for start, chunk in _read_chunks(_file(dataset_id, n), entry, chunksize):
+                rows = [row for (row,) in conn.execute("SELECT row FROM rows WHERE version = ? AND row >= ? AND row < ? "
+                                                       "ORDER BY row", (n, start, start + len(chunk)))]
+                if rows:
+                    df = chunk.iloc[np.asarray(rows) - start][entry["columns"]]
+                    df.index.name = "subjectkey"
+                    yield df
+    finally:
+        conn.close()
+
+
+def _rebuild_index(conn, dataset_id):
+    entry, locations = _replay(dataset_id)
+    hashes = row_hashes(load_version(dataset_id))
+    conn.execute("DELETE FROM rows")
+    conn.executemany("INSERT INTO rows (subjectkey, hash, version, row, rank) VALUES (?, ?, ?, ?, ?)",
+                     zip(locations.index, hashes.tolist(), locations["version"].tolist(),
+                         locations["row"].tolist(), range(len(locations))))
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (str(entry["version"]),))
+
+
+def connect(dataset_id):
+    """Open the local index, rebuilding it if it does not reflect the latest stored version"""
+    conn = sqlite3.connect(index_path(dataset_id), timeout=30)
+    conn.executescript(SCHEMA)
+    entries = versions(dataset_id)
+    row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    if entries and (row is None or row[0] != str(entries[-1]["version"])):
+        with conn:
+            _rebuild_index(conn, dataset_id)
+    return conn
+
+
+def _load_index(conn):
+    return pd.read_sql_query("SELECT subjectkey, hash, version, row, rank FROM rows ORDER BY rank", conn,
+                             index_col="subjectkey")
+
+
+# --- Writing versions ---
+
+def _entry(df, version, kind, raw_hash, timestamp):
+    return {
+        "version": version,
+        "kind": kind,
+        "timestamp": timestamp,
+        "raw_hash": raw_hash,
+        "n_rows": len(df),
+        "columns": list(df.columns),
+        "dtypes": {col: _dtype_name(dtype) for col, dtype in df.dtypes.items()},
+    }
+
+
+def _save_full(conn, dataset_id, df, entry, hashes):
+    storage.write_csv(df, _file(dataset_id, entry["version"]))
+    conn.execute("DELETE FROM rows")
+    conn.executemany("INSERT INTO rows (subjectkey, hash, version, row, rank) VALUES (?, ?, ?, ?, ?)",
+                     zip(df.index, hashes.tolist(), [entry["version"]] * len(df), range(len(df)), range(len(df))))
+
+
+def compare_with_latest(dataset_id, df_current):
+    """Split a new version against the latest stored one using row hashes.
+
+    Returns (df_prev, df_new): the previous rows of every key that was removed
+    or whose content hash changed, and the current rows of every key that was
+    added or changed, both in their own version's order. Only version files
+    holding a changed row are read, and their unchanged rows are skipped
+    without being parsed (files may be compressed, so they are still scanned
+    rather than sought into). Passing both to diff_frames() gives the same
+    records as diffing the full versions.
+    """
+    df_current = df_current[~df_current.index.duplicated()]
+    entry = versions(dataset_id)[-1]
+    conn = connect(dataset_id)
+    try:
+        index = _load_index(conn)
+    finally:
+        conn.close()
+
+    changed = np.ones(len(df_current), dtype=bool)
+    unchanged_prev = np.zeros(len(index), dtype=bool)
+    if list(df_current.columns) == entry["columns"]:
+        pos = index.index.get_indexer(df_current.index)
+        found = pos >= 0
+        same = np.zeros(len(df_current), dtype=bool)
+        same[found] = index["hash"].to_numpy()[pos[found]] == row_hashes(df_current)[found]
+        changed = ~same
+        unchanged_prev[pos[same]] = True
+
+    prev_locations = index[~unchanged_prev]
+    parts = [_read_rows(_file(dataset_id, n), entry, group["row"].to_numpy())
+             for n, group in prev_locations.groupby("version", sort=True)]
+    df_prev = pd.concat(parts).reindex(prev_locations.index) if parts else pd.DataFrame(columns=entry["columns"])
+    df_prev = df_prev[[col for col in entry["columns"]]]
+    return df_prev, df_current[changed]
+
+
+def save_version(dataset_id, df_current, raw_hash=None, timestamp=None):
+    """Store a subjectkey-indexed raw frame as the next version; returns its manifest entry, or None if unchanged"""
+    os.makedirs(store_dir(dataset_id), exist_ok=True)
+    df_current = df_current[~df_current.index.duplicated()]
+    manifest = load_manifest(dataset_id)
+    entries = manifest["versions"]
+    version = len(entries) + 1
+    hashes = row_hashes(df_current)
+
+    conn = connect(dataset_id)
+    try:
+        with conn:
+            if not entries:
+                entry = _entry(df_current, version, "full", raw_hash, timestamp)
+                _save_full(conn, dataset_id, df_current, entry, hashes)
+            else:
+                index = _load_index(conn)
+                pos = index.index.get_indexer(df_current.index)
+                found = pos >= 0
+                same = np.zeros(len(df_current), dtype=bool)
+                same[found] = index["hash"].to_numpy()[pos[found]] == hashes[found]
+                removed = index.index[~index.index.isin(df_current.index)]
+
+                # Unchanged key order: kept keys keep their relative ranks and new keys come last
+                ranks = index["rank"].to_numpy()[pos[found]]
+                in_order = bool(np.all(np.diff(ranks) > 0)) and (found.all() or found.argmin() >= found.sum())
+
+                last_full = max(e["version"] for e in entries if e["kind"] == "full")
+                columns_same = list(df_current.columns) == entries[-1]["columns"]
+                if same.all() and not len(removed) and in_order and columns_same:
+                    return None
+                if not columns_same or (~same).sum() > FULL_FRACTION * max(len(df_current), 1) \
+                        or version - last_full > MAX_DELTAS:
+                    entry = _entry(df_current, version, "full", raw_hash, timestamp)
+                    _save_full(conn, dataset_id, df_current, entry, hashes)
+                else:
+                    entry = _entry(df_current, version, "delta", raw_hash, timestamp)
+                    entry["reordered"] = not in_order
+                    stored = df_current[~same]
+                    storage.write_csv(stored, _file(dataset_id, version))
+                    storage.write_csv(pd.DataFrame({"subjectkey": removed}), _file(dataset_id, version, "_removed"),
+                                      index=False)
+                    conn.executemany("DELETE FROM rows WHERE subjectkey = ?", ((k,) for k in removed))
+
+                    rank = np.empty(len(df_current), dtype=np.int64)
+                    rank[found] = ranks
+                    rank[~found] = (int(index["rank"].max()) + 1 if len(index) else 0) + np.arange((~found).sum())
+                    if not in_order:
+                        storage.write_csv(pd.DataFrame({"subjectkey": df_current.index}),
+                                          _file(dataset_id, version, "_order"), index=False)
+                        rank = np.arange(len(df_current))
+                        conn.executemany("UPDATE rows SET rank = ? WHERE subjectkey = ?",
+                                         zip(rank[same].tolist(), df_current.index[same]))
+                    conn.executemany("INSERT OR REPLACE INTO rows (subjectkey, hash, version, row, rank) "
+                                     "VALUES (?, ?, ?, ?, ?)",
+                                     zip(stored.index, hashes[~same].tolist(), [version] * len(stored),
+                                         range(len(stored)), rank[~same].tolist()))
+                entry["changed_rows"] = int((~same).sum())
+                entry["removed_rows"] = int(len(removed))
+
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (str(version),))
+            entries.append(entry)
+            _write_manifest(dataset_id, manifest)
+    finally:
+        conn.close()
+    return entry
+
+
+def version_keys(dataset_id, entry):
+    """(keys stored by a version, in row order; keys it removed), read from the key column only"""
+    n = entry["version"]
+    removed = _read_keys(_file(dataset_id, n, "_removed")) if entry["kind"] == "delta" else []
+    return _read_keys(_file(dataset_id, n)), removed
+
+
+def stored_files(dataset_id, entry):
+    """Files a version wrote (as stored, compressed or not), for size accounting"""
+    n = entry["version"]
+    paths = [_file(dataset_id, n)]
+    if entry["kind"] == "delta":
+        paths.append(_file(dataset_id, n, "_removed"))
+    if entry.get("reordered"):
+        paths.append(_file(dataset_id, n, "_order"))
+    return [storage.resolve(path) for path in paths]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python snapshot_store.py <dataset_name> [version] [--out PATH]")
+        sys.exit(1)
+
+    dataset_id = sys.argv[1].replace(".csv", "")
+    args = [a for a in sys.argv[2:] if not a.startswith("--")]
+    if "--out" in sys.argv:
+        out_path = sys.argv[sys.argv.index("--out") + 1]
+        args = [a for a in args if a != out_path]
+        version = int(args[0]) if args else None
+        load_version(dataset_id, version).to_csv(out_path)
+        print(f"📦 Version {version or 'latest'} of {dataset_id} written to {out_path}")
+    else:
+        for entry in versions(dataset_id):
+            detail = f"{entry['n_rows']} rows"
+            if entry["kind"] == "delta":
+                detail += f", {entry['changed_rows']} added/modified, {entry['removed_rows']} removed"
+            print(f"v{entry['version']:04d}  {entry['timestamp']}  {entry['kind']:<5}  {detail}")
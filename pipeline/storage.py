@@ -0,0 +1,182 @@
+import bz2
+import contextlib
+import glob
+import gzip
+import hashlib
+import lzma
+import os
+
+from atomic_io import atomic_path
+
+# Raw uploads, snapshot versions and audit histories pile up with every dataset
+# and version, so they can be kept compressed. Modules name these files by
+# their logical path (data/raw/<id>.csv) and open them through this layer; on
+# disk the file is that path, or the path plus a codec suffix:
+#   <name>.csv.gz    gzip
+#   <name>.csv.xz    xz (lzma)
+#   <name>.csv.bz2   bzip2
+# Reads find whichever variant exists and decompress it as a stream. A rewrite
+# keeps the codec the file already has; a new file gets its directory's codec
+# from DEFAULT_CODECS and is plain CSV elsewhere (cleaned CSVs and flags are
+# rewritten every run and read through the columnar cache, so they stay plain).
+# A file's content hash is that of its decompressed bytes: recompressing it
+# never makes it look changed. Existing files are converted with
+# migrate_storage.py.
+CODECS = {"gz": gzip, "xz": lzma, "bz2": bz2}
+LEVELS = {"gz": {"compresslevel": 6}, "xz": {"preset": 6}, "bz2": {"compresslevel": 9}}
+DEFAULT_CODECS = {"data/raw": "gz", "data/snapshots": "gz", "data/audit": "gz"}
+BLOCK_SIZE = 8 << 20
+
+
+def codec_of(path):
+    """Codec of a file on disk from its suffix, or None for a plain file"""
+    suffix = path.rsplit(".", 1)[-1]
+    return suffix if suffix in CODECS else None
+
+
+def logical_path(path):
+    """The name a (possibly compressed) file on disk is known by"""
+    codec = codec_of(path)
+    return path[:-len(codec) - 1] if codec else path
+
+
+def with_codec(path, codec):
+    return f"{path}.{codec}" if codec else path
+
+
+def variants(path):
+    """Every name the file `path` may be stored under, plain first"""
+    return [path] + [with_codec(path, codec) for codec in CODECS]
+
+
+def resolve(path):
+    """The stored variant of `path` that exists, or `path` itself if none does"""
+    if not isinstance(path, str):
+        return path
+    for candidate in variants(path):
+        if os.path.exists(candidate):
+            return candidate
+    return path
+
+
+def exists(path):
+    return any(os.path.exists(candidate) for candidate in variants(path))
+
+
+def default_codec(path):
+    directory = os.path.normpath(os.path.dirname(path))
+    for prefix, codec in DEFAULT_CODECS.items():
+        if directory == prefix or directory.startswith(prefix + os.sep):
+            return codec
+    return None
+
+
+def target(path):
+    """Where a write of `path` goes: the existing variant, else the directory's default codec"""
+    stored = resolve(path)
+    return stored if os.path.exists(stored) else with_codec(path, default_codec(path))
+
+
+def glob_csv(pattern):
+    """Logical paths of the files matching `pattern` in any codec, sorted"""
+    paths = set(glob.glob(pattern))
+    for codec in CODECS:
+        paths.update(logical_path(path) for path in glob.glob(with_codec(pattern, codec)))
+    return sorted(paths)
+
+
+def remove(path):
+    """Delete every stored variant of `path`"""
+    for candidate in variants(path):
+        if os.path.exists(candidate):
+            os.remove(candidate)
+
+
+# --- Streams ---
+def _open(path, mode, codec, **kwargs):
+    if codec is None:
+        return open(path, mode, **kwargs)
+    if "r" not in mode:
+        kwargs.update(LEVELS[codec])
+    if "b" not in mode and "t" not in mode:
+        mode += "t"
+    return CODECS[codec].open(path, mode, **kwargs)
+
+
+def open_file(path, mode="r", **kwargs):
+    """Open the stored variant of `path` for reading, decompressing as it is read"""
+    stored = resolve(path)
+    return _open(stored, mode, codec_of(stored), **kwargs)
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode="w", **kwargs):
+    """Write `path` with the codec target() picks; the file replaces every stored variant once complete"""
+    stored = target(path)
+    with atomic_path(stored) as tmp_path:
+        with _open(tmp_path, mode, codec_of(stored), **kwargs) as f:
+            yield f
+    _drop_variants(path, stored)
+
+
+def _drop_variants(path, keep):
+    for candidate in variants(path):
+        if candidate != keep and os.path.exists(candidate):
+            os.remove(candidate)
+
+
+def write_csv(df, path, **kwargs):
+    """DataFrame.to_csv through atomic_write()"""
+    with atomic_write(path, newline="") as f:
+        df.to_csv(f, **kwargs)
+
+
+def compress(data, codec):
+    return CODECS[codec].compress(data, **LEVELS[codec]) if codec else data
+
+
+def decompress(data, codec):
+    """Bytes of one or more complete streams of `codec` (plain bytes pass through)"""
+    return CODECS[codec].decompress(data) if codec else data
+
+
+def append_bytes(path, data):
+    """Append to `path`; a compressed file gets `data` as one more complete stream"""
+    stored = target(path)
+    with open(stored, "ab") as f:
+        f.write(compress(data, codec_of(stored)))
+
+
+def _digest(f):
+    hasher = hashlib.sha256()
+    while block := f.read(BLOCK_SIZE):
+        hasher.update(block)
+    return hasher.hexdigest()
+
+
+def content_hash(path):
+    """SHA-256 of a file's decompressed content, read as a stream"""
+    with open_file(path, "rb") as f:
+        return _digest(f)
+
+
+def convert(path, codec):
+    """Rewrite the stored file `path` with `codec` (None for plain); returns the new file's name.
+
+    The converted file must decompress to the original content before it
+    replaces the original.
+    """
+    stored = resolve(path)
+    if codec_of(stored) == codec:
+        return stored
+    digest = content_hash(path)
+    converted = with_codec(path, codec)
+    with atomic_path(converted) as tmp_path:
+        with open_file(path, "rb") as src, _open(tmp_path, "wb", codec) as dst:
+            while block := src.read(BLOCK_SIZE):
+                dst.write(block)
+        with _open(tmp_path, "rb", codec) as f:
+            if _digest(f) != digest:
+                raise IOError(f"{converted} does not decompress to the content of {stored}")
+    _drop_variants(path, converted)
+    return converted
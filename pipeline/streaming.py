@@ -0,0 +1,160 @@
+import numpy as np
+import sys
+
+from preprocess import (SEX_MAP, DIAGNOSIS_MAP, replace_sentinels, preprocess,
+                        needs_sex_mapping, needs_diagnosis_mapping, guess_date_format)
+from qc import (flag_rows, summarize, merge_summaries, format_report, select_flagged, save_state,
+                chart_summary, save_chart_summary, summary_frame, stratified_qc, strata_columns, add_strata_flags)
+from atomic_io import atomic_open, atomic_path
+from columnar import ColumnarWriter, ColumnarDataset, columnar_path
+from qc_rules import load_rules
+from schema import load_schema, read_csv, decode_codes
+from logging_utils import instrument
+
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def widen_dtype(current, dtype):
+    """Combine two chunk dtypes the way a single whole-file parse would"""
+    if current is None or current == dtype:
+        return dtype
+    if isinstance(current, np.dtype) and isinstance(dtype, np.dtype) \
+            and current.kind in "iuf" and dtype.kind in "iuf":
+        return np.result_type(current, dtype)
+    return np.dtype(object)
+
+
+def _strip_keys(chunk):
+    chunk["subjectkey"] = chunk["subjectkey"].astype(str).str.strip()
+    return chunk[chunk["subjectkey"] != "nan"]
+
+
+def probe_raw(raw_path, chunksize=DEFAULT_CHUNKSIZE, dataset_id=None):
+    """Scan a raw export once to settle the choices a single chunk cannot make alone.
+
+    Returns the preprocess() overrides (date format, sex/diagnosis mapping,
+    sentinels) and the dtype each cleaned column would get from a whole-file parse.
+    """
+    map_sex = map_diagnosis = False
+    sex_unmapped = diagnosis_unmapped = False
+    first_date = None
+    dtypes = {}
+    sentinels = load_schema(dataset_id)["sentinels"]
+
+    for chunk in read_csv(raw_path, dataset_id, sentinels=True, chunksize=chunksize):
+        chunk = _strip_keys(replace_sentinels(chunk, sentinels))
+        map_sex |= needs_sex_mapping(chunk)
+        map_diagnosis |= needs_diagnosis_mapping(chunk)
+        sex_unmapped |= not chunk["sex"].isin(SEX_MAP.keys()).all()
+        diagnosis_unmapped |= not chunk["diagnosis"].isin(DIAGNOSIS_MAP.keys()).all()
+        if first_date is None and "interview_date" in chunk.columns:
+            dates = chunk["interview_date"].dropna()
+            if len(dates):
+                first_date = dates.iloc[0]
+        for col in chunk.columns:
+            dtypes[col] = widen_dtype(dtypes.get(col), chunk[col].dtype)
+
+    # pandas guesses a date format from the first value; without one it parses per element
+    date_format = guess_date_format(first_date)
+
+    if map_sex:
+        dtypes["sex"] = np.dtype(float if sex_unmapped else np.int64)
+    if map_diagnosis:
+        dtypes["diagnosis"] = np.dtype(float if diagnosis_unmapped else np.int64)
+    dtypes.pop("subjectkey", None)
+    dtypes.pop("interview_date", None)
+
+    options = {"date_format": date_format, "map_sex": map_sex, "map_diagnosis": map_diagnosis, "sentinels": sentinels}
+    return options, dtypes
+
+
+def align_dtypes(df, dtypes):
+    """Cast numeric chunk columns to the file-wide dtype so every chunk is written alike"""
+    for col, target in dtypes.items():
+        if col not in df.columns:
+            continue
+        current = df[col].dtype
+        if current == target or not (isinstance(current, np.dtype) and current.kind in "iufb"):
+            continue
+        df[col] = df[col].astype(target if target.kind in "iuf" else object)
+    return df
+
+
+def stream_preprocess_qc(dataset_id, chunksize=DEFAULT_CHUNKSIZE, raw_hash=None):
+    """Clean and QC a raw export chunk by chunk with bounded memory.
+
+    Produces the same _cleaned.csv, _qc_report.txt and _qc_flags.csv as
+    preprocess() followed by run_qc(), and returns the report text. Only the
+    columns stratified QC reads are held for the whole cohort at once.
+    """
+    raw_path = f"data/raw/{dataset_id}.csv"
+    cleaned_path = f"data/cleaned/{dataset_id}_cleaned.csv"
+    report_path = f"data/cleaned/{dataset_id}_qc_report.txt"
+    flagged_path = f"data/cleaned/{dataset_id}_qc_flags.csv"
+
+    with instrument("stream_preprocess_qc", dataset_id) as metrics:
+        options, dtypes = probe_raw(raw_path, chunksize, dataset_id)
+        rules = load_rules(dataset_id)
+
+        columnar = ColumnarWriter(columnar_path(dataset_id))
+        summary = None
+        rows_in = 0
+        # Chunks go to a temporary file that replaces the cleaned CSV once all are written
+        with atomic_path(cleaned_path) as tmp_cleaned:
+            for chunk in read_csv(raw_path, dataset_id, sentinels=True, chunksize=chunksize):
+                rows_in += len(chunk)
+                df = align_dtypes(preprocess(chunk, **options), dtypes)
+                first = summary is None
+                df.to_csv(tmp_cleaned, mode="w" if first else "a", header=first, index=False)
+                columnar.append(df)
+                clean_dtypes = df.dtypes.to_dict()
+
+                chunk_summary = summarize(flag_rows(df, rules), rules)
+                summary = chunk_summary if first else merge_summaries(summary, chunk_summary)
+
+            if summary is None:
+                # Header-only export: write empty outputs with the right columns
+                df_clean = preprocess(read_csv(raw_path, dataset_id, sentinels=True, nrows=0), **options)
+                df_clean.to_csv(tmp_cleaned, index=False)
+                columnar.append(df_clean)
+                clean_dtypes = df_clean.dtypes.to_dict()
+                summary = summarize(flag_rows(df_clean, rules), rules)
+        columnar.close(cleaned_path)
+
+        # --- Stratified QC and flags, read back from the columnar cache ---
+        # Group medians need every row, so the flags file is written in a second pass
+        dataset = ColumnarDataset(columnar_path(dataset_id))
+
+        def read_chunk(columns=None, rows=None):
+            return align_dtypes(decode_codes(dataset.to_frame(columns, categorical=True, rows=rows)), clean_dtypes)
+
+        summary["strata"], strata_flags = stratified_qc(read_chunk(strata_columns(dataset.columns, rules)), rules)
+        with atomic_path(flagged_path) as tmp_flagged:
+            for start in range(0, max(len(dataset), 1), chunksize):
+                rows = np.arange(start, min(start + chunksize, len(dataset)))
+                df = add_strata_flags(flag_rows(read_chunk(rows=rows), rules), strata_flags.iloc[rows])
+                select_flagged(df, rules).to_csv(tmp_flagged, mode="w" if start == 0 else "a", header=start == 0,
+                                                 index=False)
+
+        report_text = format_report(summary, f"{dataset_id}_cleaned.csv")
+        with atomic_open(report_path) as f:
+            f.write(report_text)
+        save_state(summary, dataset_id, rules, clean_dtypes, raw_hash, options)
+        # Histogram edges need the final min/max, so the chart columns are read back from the columnar cache
+        summary_path = save_chart_summary(chart_summary(summary_frame(dataset_id), summary), dataset_id)
+        metrics.read(raw_path, raw_path)  # probe pass + cleaning pass
+        metrics.rows(rows_in, summary["n_total"])
+        metrics.wrote(cleaned_path, columnar_path(dataset_id), report_path, flagged_path, summary_path)
+    return report_text
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python streaming.py <dataset_name> [chunksize]")
+        sys.exit(1)
+
+    dataset_id = sys.argv[1].replace(".csv", "")
+    chunksize = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_CHUNKSIZE
+    report_text = stream_preprocess_qc(dataset_id, chunksize)
+    print(f"✅ Streamed preprocessing and QC for {dataset_id} in chunks of {chunksize} rows:")
+    print(report_text)
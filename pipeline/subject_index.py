@@ -0,0 +1,213 @@
+import glob
+import os
+import sqlite3
+import sys
+import pandas as pd
+
+from audit_store import AUDIT_COLUMNS, audit_csv_path, connect as connect_audit
+from snapshot_store import versions, version_keys
+import storage
+
+# data/subject_index.sqlite answers "where is this subject, and what changed
+# for it?" across every dataset without opening a CSV. It is derived from the
+# snapshot stores (data/snapshots/<id>/) and the audit indexes (data/audit/),
+# and caught up by index_dataset() after each snapshot compare:
+#   spans     one row per run of versions a subject's stored row stays put in:
+#             present in first_version..last_version (NULL while it is in the
+#             latest version), its data at row `row` of version stored_in's
+#             file (v0003.csv for 3)
+#   versions  timestamp, kind and row count of every indexed version
+#   changes   copies of the audit records, by subjectkey
+#   datasets  how far each dataset is indexed: last version (and its raw hash)
+#             and last audit index segment
+# Catching up reads only the key column of each new version file and the new
+# audit index rows. A dataset whose snapshot store or audit history was
+# rewritten is re-indexed from scratch.
+INDEX_PATH = "data/subject_index.sqlite"
+SPAN_COLUMNS = ["dataset", "first_version", "first_seen", "last_version", "last_seen", "stored_in", "row"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spans (
+    subjectkey TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    first_version INTEGER NOT NULL,
+    last_version INTEGER,
+    stored_in INTEGER NOT NULL,
+    row INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS spans_subject ON spans (subjectkey, dataset, first_version);
+CREATE INDEX IF NOT EXISTS spans_dataset ON spans (dataset, last_version);
+CREATE TABLE IF NOT EXISTS versions (
+    dataset TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    timestamp TEXT,
+    kind TEXT NOT NULL,
+    n_rows INTEGER NOT NULL,
+    PRIMARY KEY (dataset, version)
+);
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    subjectkey TEXT,
+    dataset TEXT NOT NULL,
+    timestamp TEXT,
+    "column" TEXT,
+    old_value TEXT,
+    new_value TEXT
+);
+CREATE INDEX IF NOT EXISTS changes_subject ON changes (subjectkey, dataset, id);
+CREATE TABLE IF NOT EXISTS datasets (
+    dataset TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    raw_hash TEXT,
+    audit_segment INTEGER NOT NULL DEFAULT 0,
+    audit_end INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def connect(db_path=INDEX_PATH):
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _forget(conn, dataset_id, what):
+    tables = {"versions": ["spans", "versions"], "changes": ["changes"]}[what]
+    for table in tables:
+        conn.execute(f"DELETE FROM {table} WHERE dataset = ?", (dataset_id,))
+
+
+# --- Catching up ---
+def _index_versions(conn, dataset_id, indexed, raw_hash):
+    """Add the spans of every stored version past `indexed`; returns (versions added, last version, its raw hash)"""
+    entries = versions(dataset_id)
+    if indexed > len(entries) or (indexed and entries[indexed - 1].get("raw_hash") != raw_hash):
+        _forget(conn, dataset_id, "versions")
+        indexed = 0
+
+    for entry in entries[indexed:]:
+        n = entry["version"]
+        stored, removed = version_keys(dataset_id, entry)
+        if entry["kind"] == "full":
+            # Every row moved to the new file
+            conn.execute("UPDATE spans SET last_version = ? WHERE dataset = ? AND last_version IS NULL",
+                         (n - 1, dataset_id))
+        else:
+            # Without INDEXED BY the planner can pick spans_dataset and scan every open span per key
+            conn.executemany("UPDATE spans INDEXED BY spans_subject SET last_version = ? "
+                             "WHERE subjectkey = ? AND dataset = ? AND last_version IS NULL", ((n - 1, key, dataset_id) for key in stored + removed))
+        conn.executemany("INSERT INTO spans (subjectkey, dataset, first_version, last_version, stored_in, row) "
+                         "VALUES (?, ?, ?, NULL, ?, ?)", ((key, dataset_id, n, n, row) for row, key in enumerate(stored)))
+        conn.execute("INSERT OR REPLACE INTO versions (dataset, version, timestamp, kind, n_rows) VALUES (?, ?, ?, ?, ?)",
+                     (dataset_id, n, entry.get("timestamp"), entry["kind"], entry["n_rows"]))
+    last = entries[-1] if entries else {"version": 0}
+    return len(entries) - indexed, last["version"], last.get("raw_hash")
+
+
+def _index_changes(conn, dataset_id, segment, end):
+    """Copy the audit records past audit index segment `segment`; returns (records added, last segment, its end)"""
+    if not storage.exists(audit_csv_path(dataset_id)):
+        if segment:
+            _forget(conn, dataset_id, "changes")
+        return 0, 0, 0
+
+    audit = connect_audit(dataset_id)
+    try:
+        if segment and audit.execute("SELECT 1 FROM segments WHERE id = ? AND end_offset = ?",
+                                     (segment, end)).fetchone() is None:
+            _forget(conn, dataset_id, "changes")
+            segment = 0
+        rows = audit.execute('SELECT subjectkey, timestamp, "column", old_value, new_value FROM changes '
+                             'WHERE segment > ? ORDER BY id', (segment,)).fetchall()
+        last = audit.execute("SELECT id, end_offset FROM segments ORDER BY id DESC LIMIT 1").fetchone() or (0, 0)
+    finally:
+        audit.close()
+    conn.executemany('INSERT INTO changes (subjectkey, dataset, timestamp, "column", old_value, new_value) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', ((row[0], dataset_id) + tuple(row[1:]) for row in rows))
+    return len(rows), last[0], last[1]
+
+
+def index_dataset(dataset_id, db_path=INDEX_PATH):
+    """Bring one dataset's entries up to date; returns (versions, audit records) added"""
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            state = conn.execute("SELECT version, raw_hash, audit_segment, audit_end FROM datasets WHERE dataset = ?",
+                                 (dataset_id,)).fetchone() or (0, None, 0, 0)
+            n_versions, version, raw_hash = _index_versions(conn, dataset_id, state[0], state[1])
+            n_changes, segment, end = _index_changes(conn, dataset_id, state[2], state[3])
+            conn.execute("INSERT OR REPLACE INTO datasets (dataset, version, raw_hash, audit_segment, audit_end) "
+                         "VALUES (?, ?, ?, ?, ?)", (dataset_id, version, raw_hash, segment, end))
+    finally:
+        conn.close()
+    return n_versions, n_changes
+
+
+def indexable_datasets():
+    """Datasets with a snapshot store or an audit history"""
+    stores = {os.path.basename(os.path.dirname(path)) for path in glob.glob("data/snapshots/*/manifest.json")}
+    audits = {os.path.basename(path)[:-len("_column_diff_history.csv")]
+              for path in storage.glob_csv("data/audit/*_column_diff_history.csv")}
+    return sorted(stores | audits)
+
+
+# --- Lookup ---
+def subject_history(subjectkey, db_path=INDEX_PATH):
+    """Everything indexed for one subject: (presence spans, audit records), both oldest first.
+
+    Spans carry the dataset, version range with timestamps, and the version
+    file (stored_in) and row holding the subject's data; "last_version" is
+    <NA> while the subject is in the dataset's latest version.
+    """
+    if not os.path.exists(db_path):
+        return pd.DataFrame(columns=SPAN_COLUMNS), pd.DataFrame(columns=["dataset"] + AUDIT_COLUMNS)
+    conn = connect(db_path)
+    try:
+        spans = pd.read_sql_query(
+            "SELECT s.dataset, s.first_version, f.timestamp AS first_seen, s.last_version, "
+            "l.timestamp AS last_seen, s.stored_in, s.row FROM spans s "
+            "JOIN versions f ON f.dataset = s.dataset AND f.version = s.first_version "
+            "LEFT JOIN versions l ON l.dataset = s.dataset AND l.version = s.last_version "
+            "WHERE s.subjectkey = ? ORDER BY s.dataset, s.first_version", conn, params=(subjectkey,))
+        changes = pd.read_sql_query(
+            'SELECT dataset, timestamp, subjectkey, "column", old_value, new_value FROM changes '
+            "WHERE subjectkey = ? ORDER BY dataset, id", conn, params=(subjectkey,))
+    finally:
+        conn.close()
+    spans["last_version"] = spans["last_version"].astype("Int64")
+    return spans, changes
+
+
+def search(prefix, limit=20, db_path=INDEX_PATH):
+    """Indexed subjectkeys starting with `prefix`"""
+    if not os.path.exists(db_path):
+        return []
+    conn = connect(db_path)
+    try:
+        return [key for (key,) in conn.execute(
+            "SELECT DISTINCT subjectkey FROM spans WHERE subjectkey >= ? AND subjectkey < ? ORDER BY subjectkey LIMIT ?",
+            (prefix, prefix + "\U0010ffff", limit))]
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python subject_index.py --sync [dataset ...] | <subjectkey>")
+        sys.exit(1)
+
+    if sys.argv[1] == "--sync":
+        for dataset_id in sys.argv[2:] or indexable_datasets():
+            n_versions, n_changes = index_dataset(dataset_id.replace(".csv", ""))
+            print(f"🗂️ {dataset_id}: {n_versions} version(s) and {n_changes} audit record(s) indexed")
+    else:
+        spans, changes = subject_history(sys.argv[1])
+        if spans.empty and changes.empty:
+            print(f"No indexed dataset contains {sys.argv[1]}.")
+        else:
+            print(spans.to_string(index=False))
+            print()
+            print(changes.to_string(index=False))
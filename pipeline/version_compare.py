@@ -0,0 +1,229 @@
+import os
+import sqlite3
+import sys
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from hash_registry import file_hash
+from schema import read_csv, read_header
+import storage
+
+# Subject-level comparison of dataset versions. Each version is reduced once
+# to its signature: the sorted, de-duplicated array of its subject IDs, saved
+# as data/signatures/<sha256>_<key column>.npy and found again by the file's
+# content hash. Pairwise and N-way added/removed queries only touch those
+# arrays, never the CSVs.
+#
+# Comparisons logged to CHANGELOG.md are indexed in a local SQLite file, which
+# is rebuilt from the changelog's headers whenever the changelog was edited by
+# something else.
+SIGNATURE_DIR = "data/signatures"
+CHANGELOG_PATH = "CHANGELOG.md"
+CHANGELOG_INDEX_PATH = "docs/changelog_index.sqlite"
+KEY_COLUMNS = ("subject_id", "subjectkey")
+HEADER_PREFIX = "## 🔄 Comparison: "
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS comparisons (
+    log_id TEXT PRIMARY KEY,
+    timestamp TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+# --- Signatures ---
+def key_column(path):
+    """The subject ID column of a CSV (the first of KEY_COLUMNS in its header)"""
+    with storage.open_file(path, "rb") as f:
+        header = [col.strip() for col in read_header(f)]
+    for col in KEY_COLUMNS:
+        if col in header:
+            return col
+    raise ValueError(f"No subject ID column ({', '.join(KEY_COLUMNS)}) in {path}")
+
+
+def signature_path(digest, key):
+    return os.path.join(SIGNATURE_DIR, f"{digest}_{key}.npy")
+
+
+def compute_signature(path, key):
+    """Sorted unique subject IDs of a CSV, stripped of surrounding whitespace"""
+    ids = read_csv(path, columns=[key], dtype={key: str})[key]
+    ids = ids.dropna().str.strip()
+    return np.unique(ids.to_numpy(dtype=str))
+
+
+def signature(path, key=None):
+    """Cached subject-ID signature of a version; recomputed only when the file's content changes"""
+    key = key or key_column(path)
+    cache_path = signature_path(file_hash(path), key)
+    if os.path.exists(cache_path):
+        return np.load(cache_path, allow_pickle=False)
+
+    ids = compute_signature(path, key)
+    os.makedirs(SIGNATURE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, ids, allow_pickle=False)
+    os.replace(tmp_path, cache_path)
+    return ids
+
+
+# --- Queries ---
+def subject_diff(file1, file2, key=None):
+    """(added, removed) subject IDs going from file1 to file2, as sorted arrays"""
+    ids1, ids2 = signature(file1, key), signature(file2, key)
+    added = np.setdiff1d(ids2, ids1, assume_unique=True)
+    removed = np.setdiff1d(ids1, ids2, assume_unique=True)
+    return added, removed
+
+
+def presence(paths, key=None):
+    """Subjects x versions membership table over all subjects seen in any version"""
+    signatures = [signature(path, key) for path in paths]
+    subjects = np.unique(np.concatenate(signatures)) if signatures else np.array([], dtype=str)
+    table = {}
+    for path, ids in zip(paths, signatures):
+        pos = np.searchsorted(ids, subjects)
+        found = np.zeros(len(subjects), dtype=bool)
+        inside = pos < len(ids)
+        found[inside] = ids[pos[inside]] == subjects[inside]
+        table[os.path.basename(path)] = found
+    return pd.DataFrame(table, index=pd.Index(subjects, name="subject"))
+
+
+def comparison_matrix(paths, key=None):
+    """Added/removed subject counts for every ordered pair of versions.
+
+    One row per (from, to) pair with from != to, in the order the paths
+    were given.
+    """
+    signatures = {path: signature(path, key) for path in paths}
+    rows = []
+    for old in paths:
+        for new in paths:
+            if old == new:
+                continue
+            rows.append({
+                "from": os.path.basename(old),
+                "to": os.path.basename(new),
+                "added": len(np.setdiff1d(signatures[new], signatures[old], assume_unique=True)),
+                "removed": len(np.setdiff1d(signatures[old], signatures[new], assume_unique=True)),
+            })
+    return pd.DataFrame(rows, columns=["from", "to", "added", "removed"])
+
+
+# --- Changelog index ---
+def _file_stat(path):
+    if not os.path.exists(path):
+        return ""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _parse_header(line):
+    """(log_id, timestamp) of a comparison header line, or None"""
+    if not line.startswith(HEADER_PREFIX):
+        return None
+    log_id, _, timestamp = line[len(HEADER_PREFIX):].rstrip("\n").partition(" — ")
+    return log_id, timestamp
+
+
+def _sync_from_changelog(conn, changelog_path):
+    """Rebuild the index if the changelog changed behind its back"""
+    row = conn.execute("SELECT value FROM meta WHERE key = 'changelog_stat'").fetchone()
+    current = _file_stat(changelog_path)
+    if row is not None and row[0] == current:
+        return
+
+    entries = []
+    if os.path.exists(changelog_path):
+        with open(changelog_path) as f:
+            for line in f:
+                parsed = _parse_header(line)
+                if parsed:
+                    entries.append(parsed)
+    conn.execute("DELETE FROM comparisons")
+    conn.executemany("INSERT OR IGNORE INTO comparisons (log_id, timestamp) VALUES (?, ?)", entries)
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('changelog_stat', ?)", (current,))
+
+
+def connect(changelog_path=CHANGELOG_PATH, db_path=CHANGELOG_INDEX_PATH):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _sync_from_changelog(conn, changelog_path)
+    return conn
+
+
+def comparison_id(version1, version2):
+    return f"`{version1}` → `{version2}`"
+
+
+def is_logged(version1, version2, changelog_path=CHANGELOG_PATH, db_path=CHANGELOG_INDEX_PATH):
+    conn = connect(changelog_path, db_path)
+    try:
+        row = conn.execute("SELECT 1 FROM comparisons WHERE log_id = ?", (comparison_id(version1, version2),)).fetchone()
+        return row is not None
+    finally:
+        conn.close()
+
+
+def log_comparison(version1, version2, added, removed, changelog_path=CHANGELOG_PATH, db_path=CHANGELOG_INDEX_PATH):
+    """Append a comparison entry to the changelog unless it is already there; True if written"""
+    log_id = comparison_id(version1, version2)
+    conn = connect(changelog_path, db_path)
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            _sync_from_changelog(conn, changelog_path)
+            if conn.execute("SELECT 1 FROM comparisons WHERE log_id = ?", (log_id,)).fetchone():
+                return False
+
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            header = f"\n{HEADER_PREFIX}{log_id} — {timestamp}\n"
+
+            body = []
+            if len(added):
+                body.append(f"- 🆕 Added subjects: {', '.join(sorted(added))}")
+            if len(removed):
+                body.append(f"- ❌ Removed subjects: {', '.join(sorted(removed))}")
+            if not body:
+                body.append("- ✅ No changes in subject IDs")
+
+            with open(changelog_path, "a") as f:
+                f.write(header + "\n".join(body) + "\n")
+
+            conn.execute("INSERT OR REPLACE INTO comparisons (log_id, timestamp) VALUES (?, ?)", (log_id, timestamp))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('changelog_stat', ?)",
+                         (_file_stat(changelog_path),))
+        return True
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    log = "--log" in args
+    paths = [arg for arg in args if arg != "--log"]
+    if len(paths) < 2:
+        print("Usage: python version_compare.py <version.csv> <version.csv> [...] [--log]")
+        sys.exit(1)
+
+    print(comparison_matrix(paths).to_string(index=False))
+    if log:
+        # Consecutive versions, in the order given
+        for old, new in zip(paths, paths[1:]):
+            added, removed = subject_diff(old, new)
+            name1, name2 = os.path.basename(old), os.path.basename(new)
+            if log_comparison(name1, name2, added, removed):
+                print(f"✅ Logged {comparison_id(name1, name2)} to {CHANGELOG_PATH}")
+            else:
+                print(f"⚠️ Comparison {comparison_id(name1, name2)} already logged. Skipping.")
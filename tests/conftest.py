@@ -0,0 +1,29 @@
+import os
+import shutil
+import sys
+
+import pandas as pd
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO, "pipeline"))
+
+DATASET = "pseudo_abide_dataset"
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """A scratch project tree holding one sample raw dataset; the pipeline's relative paths resolve inside it"""
+    for directory in ("data/raw", "data/cleaned", "data/snapshots", "data/audit", "docs"):
+        os.makedirs(tmp_path / directory)
+    shutil.copy(os.path.join(REPO, "data/raw", f"{DATASET}.csv"), tmp_path / "data/raw")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def read_raw(dataset_id=DATASET):
+    return pd.read_csv(f"data/raw/{dataset_id}.csv", dtype=str, keep_default_na=False)
+
+
+def write_raw(df, dataset_id=DATASET):
+    df.to_csv(f"data/raw/{dataset_id}.csv", index=False)
@@ -0,0 +1,59 @@
+import artifact_cache
+from artifact_cache import artifacts, entries, prune, restore, store
+from hash_registry import file_hash
+from preprocess_qc_runner import run_pipeline
+from conftest import DATASET, read_raw, write_raw
+
+
+def _outputs():
+    contents = {}
+    for name, path in artifacts(DATASET).items():
+        if name not in ("cleaned.cols", "qc_state.json"):
+            with open(path, "rb") as f:
+                contents[name] = f.read()
+    return contents
+
+
+def test_a_raw_version_seen_before_is_restored(workspace, capsys):
+    original = read_raw()
+    write_raw(original)  # rewritten once, so writing it back later yields the same bytes
+    run_pipeline(DATASET)
+    first = _outputs()
+
+    edited = original.copy()
+    edited.loc[4, "IQ"] = "77"
+    write_raw(edited)
+    run_pipeline(DATASET)
+    assert _outputs() != first
+
+    write_raw(original)
+    capsys.readouterr()
+    run_pipeline(DATASET)
+    assert "restored from the artifact cache" in capsys.readouterr().out
+    assert _outputs() == first
+    assert len(entries()) == 2
+
+
+def test_outputs_of_another_raw_version_are_not_stored(workspace):
+    run_pipeline(DATASET)
+    assert store(DATASET, "0" * 64) is None
+    assert store(DATASET, file_hash(f"data/raw/{DATASET}.csv")) is not None
+    assert len(entries()) == 1
+
+
+def test_least_recently_used_entries_are_evicted(workspace, monkeypatch):
+    raw = read_raw()
+    keys = []
+    for iq in ("77", "78", "79"):
+        raw.loc[4, "IQ"] = iq
+        write_raw(raw)
+        run_pipeline(DATASET)
+        keys.append(store(DATASET, file_hash(f"data/raw/{DATASET}.csv")))
+    sizes = {key: size for key, _, _, size, _, _ in entries()}
+    assert set(sizes) == set(keys)
+
+    # Reusing the oldest entry makes the middle one the least recently used
+    restore(DATASET, entries()[-1][2])
+    prune(sizes[keys[0]] + sizes[keys[2]])
+    assert {key for key, *_ in entries()} == {keys[0], keys[2]}
+    assert not (workspace / artifact_cache.entry_dir(keys[1])).exists()
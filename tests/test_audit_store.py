@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+
+import storage
+from audit_store import ADDED, REMOVED, append_changes, audit_csv_path, count_changes, query_changes
+
+DS = "example"
+
+
+def _record(timestamp, subject, column, old, new):
+    return {"timestamp": timestamp, "subjectkey": subject, "column": column, "old_value": old, "new_value": new}
+
+
+@pytest.fixture
+def history(workspace):
+    append_changes(DS, [_record("2024-01-01 09:00:00", "sub-1", "ROW_STATUS", "N/A", ADDED),
+                        _record("2024-01-01 09:00:00", "sub-2", "ROW_STATUS", "N/A", ADDED)])
+    append_changes(DS, [_record("2024-02-01 09:00:00", "sub-1", "IQ", "100", "101"),
+                        _record("2024-02-01 09:00:00", "sub-2", "age", "10", "11"),
+                        _record("2024-02-01 09:00:00", "sub-3", "ROW_STATUS", REMOVED, "N/A")])
+    append_changes(DS, [_record("2024-03-01 09:00:00", "sub-1", "IQ", "101", "")])
+    return workspace
+
+
+def test_query_filters(history):
+    assert query_changes(DS, subjectkey="sub-1")["column"].tolist() == ["ROW_STATUS", "IQ", "IQ"]
+    values = query_changes(DS, column="IQ")["new_value"]
+    assert values.iloc[0] == "101" and pd.isna(values.iloc[1])
+    assert query_changes(DS, since="2024-02-01", until="2024-03-01")["subjectkey"].tolist() == ["sub-1", "sub-2", "sub-3"]
+    assert query_changes(DS, kind="added")["subjectkey"].tolist() == ["sub-1", "sub-2"]
+    assert query_changes(DS, kind="removed")["subjectkey"].tolist() == ["sub-3"]
+    assert len(query_changes(DS, kind="modified")) == 3
+    assert query_changes(DS, subjectkey="sub-1", kind="modified", since="2024-03-01")["old_value"].tolist() == ["101"]
+    assert count_changes(DS, column="IQ") == 2
+    with pytest.raises(ValueError):
+        query_changes(DS, kind="renamed")
+
+
+def test_query_pages_in_logged_order(history):
+    pages = [query_changes(DS, limit=2, offset=offset)["subjectkey"].tolist() for offset in (0, 2, 4)]
+    assert pages == [["sub-1", "sub-2"], ["sub-1", "sub-2"], ["sub-3", "sub-1"]]
+
+
+def test_history_is_appended_and_reindexed_after_a_rewrite(history):
+    with storage.open_file(audit_csv_path(DS)) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "timestamp,subjectkey,column,old_value,new_value" and len(lines) == 7
+
+    # A history replaced behind the index's back (e.g. a git checkout) is indexed afresh
+    with storage.atomic_write(audit_csv_path(DS)) as f:
+        f.write("\n".join(lines[:3]) + "\n")
+    assert count_changes(DS) == 2
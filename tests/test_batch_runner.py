@@ -0,0 +1,24 @@
+from batch_runner import run_batch
+from conftest import DATASET, read_raw, write_raw
+
+
+def _statuses(results):
+    return {dataset: {stage: status for stage, (status, _) in stages.items()} for dataset, stages in results.items()}
+
+
+def test_unchanged_stages_are_skipped(workspace):
+    assert _statuses(run_batch(workers=1)) == {DATASET: {"preprocess": "ran", "qc": "ran", "snapshot": "ran"}}
+    assert _statuses(run_batch(workers=1)) == {DATASET: {"preprocess": "skipped", "qc": "skipped", "snapshot": "skipped"}}
+
+    raw = read_raw()
+    raw.loc[4, "IQ"] = "77"
+    write_raw(raw)
+    assert _statuses(run_batch(workers=1)) == {DATASET: {"preprocess": "ran", "qc": "ran", "snapshot": "ran"}}
+    assert _statuses(run_batch(workers=1, force=True))[DATASET]["qc"] == "ran"
+
+
+def test_a_failed_stage_blocks_its_dependents_only(workspace):
+    write_raw(read_raw().drop(columns="sex"), "broken")
+    results = _statuses(run_batch(workers=2))
+    assert results["broken"] == {"preprocess": "failed", "qc": "blocked", "snapshot": "ran"}
+    assert results[DATASET] == {"preprocess": "ran", "qc": "ran", "snapshot": "ran"}
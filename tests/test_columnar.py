@@ -0,0 +1,55 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from columnar import ColumnarDataset, open_table, table_path
+from conftest import DATASET
+
+
+def _build_concurrently(datasets, columns):
+    """Index every column from every dataset object at once, as concurrent dashboard sessions would"""
+    errors = []
+
+    def build(dataset, col):
+        try:
+            dataset.index(col)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=build, args=(dataset, col)) for dataset in datasets for col in columns]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def test_concurrent_index_builds_keep_every_index(workspace):
+    raw_path = f"data/raw/{DATASET}.csv"
+    shared = open_table(raw_path, DATASET)
+    columns = ["age", "IQ", "site", "subjectkey"]
+    others = [ColumnarDataset(shared.path) for _ in range(3)]
+
+    assert _build_concurrently([shared, shared] + others, columns) == []
+    with open(os.path.join(shared.path, "indexes.json")) as f:
+        assert sorted(json.load(f)) == sorted(columns)
+    assert not [name for name in os.listdir(shared.path) if name.endswith(".tmp")]
+
+    # A fresh reader sees complete order files
+    age = ColumnarDataset(shared.path).column("age").to_numpy()
+    order = ColumnarDataset(shared.path).window(0, len(shared), sort="age")
+    sorted_age = age[order]
+    present = sorted_age[~np.isnan(sorted_age)]
+    assert (np.diff(present) >= 0).all() and np.isnan(sorted_age[len(present):]).all()
+
+
+def test_tables_of_same_named_csvs_do_not_collide(workspace):
+    os.makedirs("elsewhere")
+    df = pd.read_csv(f"data/raw/{DATASET}.csv")
+    df.iloc[:10].to_csv(f"elsewhere/{DATASET}.csv", index=False)
+    assert table_path(f"elsewhere/{DATASET}.csv") != table_path(f"data/raw/{DATASET}.csv")
+    assert len(open_table(f"elsewhere/{DATASET}.csv", DATASET)) == 10
+    assert len(open_table(f"data/raw/{DATASET}.csv", DATASET)) == len(df)
@@ -0,0 +1,48 @@
+import os
+
+import hash_registry
+from hash_registry import file_hash, latest_hash, record_hash
+
+
+def _counting(monkeypatch):
+    calls = []
+    compute = hash_registry.compute_hash
+
+    def counted(path):
+        calls.append(path)
+        return compute(path)
+
+    monkeypatch.setattr(hash_registry, "compute_hash", counted)
+    return calls
+
+
+def test_unchanged_stat_skips_rehashing(workspace, monkeypatch):
+    calls = _counting(monkeypatch)
+    path = workspace / "data/raw/example.csv"
+    path.write_text("subjectkey,age\nsub-1,10\n")
+
+    first = file_hash(str(path))
+    assert file_hash(str(path)) == first
+    assert len(calls) == 1
+
+    # A content change is seen through size and mtime
+    path.write_text("subjectkey,age\nsub-1,11\n")
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    second = file_hash(str(path))
+    assert second != first
+    assert len(calls) == 2
+    assert second == hash_registry.compute_hash(str(path))
+
+
+def test_log_follows_records_and_external_csv_edits(workspace):
+    path = "data/raw/example.csv"
+    assert latest_hash(path) is None
+    record_hash(path, digest="a" * 64, timestamp="2024-01-01 00:00:00")
+    record_hash(path, digest="b" * 64, timestamp="2024-01-02 00:00:00")
+    assert latest_hash(path) == "b" * 64
+
+    # The CSV stays the source of truth: an edit made outside the registry (e.g. a git pull) is picked up
+    with open(hash_registry.HASH_LOG_PATH, "a") as f:
+        f.write(f"2024-01-03 00:00:00,{path},{'c' * 64}\n")
+    assert latest_hash(path) == "c" * 64
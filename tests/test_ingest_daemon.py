@@ -0,0 +1,77 @@
+import os
+
+import ingest_daemon
+from ingest_daemon import Watcher
+from job_queue import _update, get_job
+
+DB = "data/jobs/queue.sqlite"
+T0 = 1_700_000_000.0
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def _write(workspace, name, text, mtime):
+    path = workspace / "data/raw" / name
+    path.write_text(text)
+    os.utime(path, (mtime, mtime))
+
+
+def _watcher(monkeypatch, clock):
+    monkeypatch.setattr(ingest_daemon, "time", clock)
+    monkeypatch.setattr(ingest_daemon, "ensure_workers", lambda db_path: 0)
+    return Watcher(settle_s=5, db_path=DB)
+
+
+def test_files_are_queued_once_settled(workspace, monkeypatch):
+    clock = Clock(T0)
+    watcher = _watcher(monkeypatch, clock)
+    _write(workspace, "old.csv", "subjectkey\nsub-1\n", T0 - 100)
+    _write(workspace, "new.csv", "subjectkey\nsub-1\n", T0 - 1)
+    # Uploads still being written under a temporary name are not watched
+    _write(workspace, "new.csv.123.tmp", "subjectkey\n", T0 - 100)
+
+    files = watcher.scan()
+    assert {name: entry["state"] for name, entry in files.items() if name != "pseudo_abide_dataset"} == \
+        {"old": "queued", "new": "settling"}
+
+    # Still being written: each change restarts the settle clock
+    clock.now = T0 + 3
+    _write(workspace, "new.csv", "subjectkey\nsub-1\nsub-2\n", T0 + 3)
+    assert watcher.scan()["new"]["state"] == "settling"
+    clock.now = T0 + 7
+    assert watcher.scan()["new"]["state"] == "settling"
+    clock.now = T0 + 8
+    entry = watcher.scan()["new"]
+    assert entry["state"] == "queued" and get_job(entry["job_id"], DB)["dataset"] == "new"
+
+
+def test_job_outcomes_are_followed_and_finished_files_not_requeued(workspace, monkeypatch):
+    clock = Clock(T0)
+    watcher = _watcher(monkeypatch, clock)
+    _write(workspace, "a.csv", "subjectkey\nsub-1\n", T0 - 100)
+    _write(workspace, "b.csv", "subjectkey\nsub-1\n", T0 - 100)
+    files = watcher.scan()
+    job_a, job_b = files["a"]["job_id"], files["b"]["job_id"]
+
+    _update(job_a, DB, status="running", stage="qc", progress=0.5)
+    _update(job_b, DB, status="failed", error="KeyError: 'sex'")
+    files = watcher.scan()
+    assert (files["a"]["state"], files["a"]["stage"], files["a"]["progress"]) == ("running", "qc", 0.5)
+    assert (files["b"]["state"], files["b"]["error"]) == ("failed", "KeyError: 'sex'")
+
+    _update(job_a, DB, status="done", stage=None, progress=1.0)
+    clock.now = T0 + 60
+    files = watcher.scan()
+    assert files["a"]["state"] == "done"
+    assert (files["a"]["job_id"], files["b"]["job_id"]) == (job_a, job_b)
+
+    # A restarted service given the previous status does not queue unchanged files again
+    restarted = Watcher(settle_s=5, db_path=DB, files=files)
+    assert {name: entry["job_id"] for name, entry in restarted.scan().items()} == \
+        {name: entry["job_id"] for name, entry in files.items()}
@@ -0,0 +1,66 @@
+import os
+
+import job_queue
+from job_queue import _beat, _claim, get_job, run_job, submit
+from logging_utils import instrument
+from conftest import DATASET, read_raw, write_raw
+
+DB = "data/jobs/queue.sqlite"
+
+
+def _claim_next():
+    _beat(os.getpid(), DB)
+    return _claim(os.getpid(), DB)
+
+
+def test_jobs_are_reused_and_claimed_one_per_dataset(workspace):
+    first = submit("pipeline", "a", db_path=DB)
+    assert submit("pipeline", "a", db_path=DB) == first
+    other = submit("pipeline", "b", db_path=DB)
+
+    assert _claim_next()["id"] == first
+    # A running job is reused unless a rerun is asked for, which waits behind it
+    assert submit("pipeline", "a", db_path=DB) == first
+    rerun = submit("pipeline", "a", rerun=True, db_path=DB)
+    assert rerun not in (first, other)
+    assert _claim_next()["id"] == other
+    assert _claim_next() is None
+    assert get_job(first, DB)["status"] == "running"
+
+
+def test_progress_follows_the_job_stages(workspace, monkeypatch):
+    seen = []
+
+    def work(dataset):
+        for stage in ("load", "clean"):
+            with instrument(stage, dataset, metrics_path=None):
+                job = get_job(job_id, DB)
+                seen.append((job["stage"], job["progress"]))
+        print("all done")
+
+    monkeypatch.setitem(job_queue.JOB_KINDS, "work", (work, ["load", "clean"]))
+    job_id = submit("work", "a", db_path=DB)
+    assert run_job(_claim_next(), DB)
+    assert seen == [("load", 0.0), ("clean", 0.5)]
+    job = get_job(job_id, DB)
+    assert (job["status"], job["progress"], job["stage"], job["error"]) == ("done", 1.0, None, None)
+    assert "all done" in job["output"]
+
+
+def test_failing_pipeline_job_ends_failed(workspace):
+    write_raw(read_raw().drop(columns="sex"))
+    job_id = submit("pipeline", DATASET, db_path=DB)
+    assert not run_job(_claim_next(), DB)
+
+    job = get_job(job_id, DB)
+    assert job["status"] == "failed"
+    assert "sex" in job["error"]
+    assert not os.path.exists(f"data/cleaned/{DATASET}_cleaned.csv")
+
+
+def test_pipeline_job_completes(workspace):
+    job_id = submit("pipeline", DATASET, db_path=DB)
+    assert run_job(_claim_next(), DB)
+    job = get_job(job_id, DB)
+    assert (job["status"], job["progress"]) == ("done", 1.0)
+    assert os.path.exists(f"data/cleaned/{DATASET}_cleaned.csv")
@@ -0,0 +1,16 @@
+import logging_utils
+from logging_utils import instrument, read_metrics
+
+
+def test_metrics_log_rotates_and_keeps_both_generations(workspace, monkeypatch):
+    monkeypatch.setattr(logging_utils, "METRICS_MAX_BYTES", 2000)
+    path = "docs/metrics.jsonl"
+    for i in range(30):
+        with instrument(f"stage{i}", "ds", metrics_path=path) as metrics:
+            metrics.rows(i, i)
+
+    # Rotation drops whole generations only: the newest records are always kept, oldest first
+    stages = [record["stage"] for record in read_metrics("ds", metrics_path=path)]
+    assert stages == [f"stage{i}" for i in range(30)][-len(stages):]
+    assert 0 < len(stages) < 30
+    assert (workspace / "docs/metrics.jsonl.1").stat().st_size > 2000
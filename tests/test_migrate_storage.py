@@ -0,0 +1,64 @@
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+import storage
+from audit_store import audit_csv_path, query_changes
+from hash_registry import file_hash
+from migrate_storage import dataset_files, migrate
+from preprocess_qc_runner import needs_preprocess, run_pipeline
+from snapshot_store import load_version, versions
+from version_compare import key_column, subject_diff
+from conftest import DATASET, read_raw, write_raw
+
+
+def _edit(column, row, value):
+    raw = pd.read_csv(storage.open_file(f"data/raw/{DATASET}.csv"), dtype=str, keep_default_na=False)
+    raw.loc[row, column] = value
+    storage.write_csv(raw, f"data/raw/{DATASET}.csv", index=False)
+
+
+def _state():
+    raw_path = f"data/raw/{DATASET}.csv"
+    return {
+        "raw_hash": file_hash(raw_path),
+        "content": storage.content_hash(raw_path),
+        "audit": query_changes(DATASET).drop(columns="timestamp").to_csv(index=False),
+        "versions": [load_version(DATASET, entry["version"]).to_csv() for entry in versions(DATASET)],
+    }
+
+
+@pytest.mark.parametrize("codecs", [["xz", "bz2", None, "gz"], ["gz", None]])
+def test_pipeline_runs_after_migration(workspace, codecs):
+    run_pipeline(DATASET)
+    raw = read_raw()
+    raw.loc[4, "IQ"] = "77"
+    write_raw(raw)
+    run_pipeline(DATASET)
+    before = _state()
+    n_changes = len(query_changes(DATASET))
+
+    for codec in codecs:
+        migrate(DATASET, codec)
+        for path in dataset_files(DATASET):
+            assert storage.codec_of(storage.resolve(path)) == codec
+        assert _state() == before
+        # Recompressing the raw file must not make it look changed
+        assert not needs_preprocess(DATASET)
+
+    # Comparing raw files reads their (compressed) headers through storage.py
+    assert key_column(f"data/raw/{DATASET}.csv") == "subjectkey"
+    added, removed = subject_diff(f"data/raw/{DATASET}.csv", f"data/raw/{DATASET}.csv")
+    assert len(added) == len(removed) == 0
+
+    # A new version after migration is appended to the migrated audit history
+    _edit("age", 8, "30.5")
+    changes = run_pipeline(DATASET)
+    assert len(changes) == 1
+    assert len(query_changes(DATASET)) == n_changes + 1
+    assert storage.codec_of(storage.resolve(audit_csv_path(DATASET))) == codecs[-1]
+    assert len(versions(DATASET)) == len(before["versions"]) + 1
+    assert os.path.exists(f"data/cleaned/{DATASET}_cleaned.csv")
+    assert not glob.glob("data/**/*.tmp", recursive=True)
@@ -0,0 +1,63 @@
+import io
+
+import pandas as pd
+import pytest
+
+from audit_store import AUDIT_COLUMNS, query_changes
+from preprocess_qc_runner import run_pipeline
+from snapshot_compare import compare_out_of_core, diff_frames, load_keyed
+from snapshot_store import load_version, save_version, versions
+from conftest import DATASET, read_raw, write_raw
+
+OUT_PATH = "data/audit/out_of_core_diff.csv"
+
+
+def _records(df):
+    """Audit records without their timestamps, as the text the history CSV holds, in a fixed order"""
+    text = pd.read_csv(io.StringIO(df[AUDIT_COLUMNS].to_csv(index=False)), dtype=str, keep_default_na=False)
+    return sorted(map(tuple, text.drop(columns="timestamp").to_numpy().tolist()))
+
+
+def _edit_raw():
+    raw = read_raw()
+    raw.loc[3, "age"] = "-9999"
+    raw.loc[5, "IQ"] = ""
+    raw.loc[7, "site"] = "NEWSITE"
+    raw.loc[20, "sex"] = ""
+    raw = raw.drop(index=[11, 12])
+    added = raw.iloc[:2].copy()
+    added["subjectkey"] = ["sub-9000", "sub-9001"]
+    write_raw(pd.concat([raw, added]))
+
+
+@pytest.mark.parametrize("run_rows", [7, 50, 1000])
+def test_out_of_core_matches_in_memory(workspace, run_rows):
+    save_version(DATASET, load_keyed(f"data/raw/{DATASET}.csv", DATASET))
+    _edit_raw()
+
+    counts = compare_out_of_core(DATASET, run_rows=run_rows, out_path=OUT_PATH)
+    out_of_core = pd.read_csv(OUT_PATH, dtype=str, keep_default_na=False)
+
+    in_memory = pd.DataFrame(diff_frames(load_version(DATASET), load_keyed(f"data/raw/{DATASET}.csv", DATASET),
+                                         "now"), columns=AUDIT_COLUMNS)
+    assert _records(out_of_core) == _records(in_memory)
+    assert counts["added"] == 2 and counts["removed"] == 2
+    assert sum(counts.values()) == len(in_memory)
+
+
+def test_out_of_core_records_are_logged_once(workspace, capsys):
+    run_pipeline(DATASET)
+    _edit_raw()
+    expected = diff_frames(load_version(DATASET), load_keyed(f"data/raw/{DATASET}.csv", DATASET), "now")
+
+    counts = compare_out_of_core(DATASET, run_rows=50)
+    assert sum(counts.values()) == len(expected)
+    assert _records(query_changes(DATASET)) == _records(pd.DataFrame(expected, columns=AUDIT_COLUMNS))
+
+    # The next pipeline run stores the version and reprocesses without logging the records again
+    run_pipeline(DATASET)
+    assert "already logged" in capsys.readouterr().out
+    assert len(query_changes(DATASET)) == len(expected)
+    assert versions(DATASET)[-1]["n_rows"] == len(load_keyed(f"data/raw/{DATASET}.csv", DATASET))
+    cleaned = pd.read_csv(f"data/cleaned/{DATASET}_cleaned.csv", dtype=str)
+    assert {"sub-9000", "sub-9001"} <= set(cleaned["subjectkey"])
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+import qc
+
+
+def _cohort(rng, n_sites=8, per_site=40, shifted=None):
+    site = np.repeat([f"S{i}" for i in range(n_sites)], per_site)
+    iq = rng.normal(100, 15, size=len(site))
+    if shifted is not None:
+        iq[site == shifted] += 30
+    return pd.DataFrame({"site": site, "IQ": iq})
+
+
+def _drift_alerts(df):
+    result, _ = qc.stratify(df, "site", ["IQ"], [])
+    return [alert for alert in result["alerts"] if "median" in alert]
+
+
+def test_null_cohorts_rarely_alert():
+    # 50 cohorts x 8 sites drawn from one distribution: at most sampling-noise alerts, not one per cohort
+    rng = np.random.default_rng(0)
+    assert sum(len(_drift_alerts(_cohort(rng))) for _ in range(50)) <= 4
+
+
+def test_shifted_site_is_reported():
+    alerts = _drift_alerts(_cohort(np.random.default_rng(1), shifted="S3"))
+    assert [alert.split(":")[0] for alert in alerts] == ["site S3"]
+
+
+def test_small_groups_get_no_drift_alerts():
+    alerts = _drift_alerts(_cohort(np.random.default_rng(2), per_site=qc.MIN_GROUP_ROWS - 1, shifted="S3"))
+    assert alerts == []
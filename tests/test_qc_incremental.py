@@ -0,0 +1,115 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import qc
+from preprocess_qc_runner import run_pipeline
+from conftest import DATASET, read_raw, write_raw
+
+RULE_COLUMNS = ["missing_flag", "age_outlier", "IQ_outlier"]
+
+
+def _run(capsys):
+    run_pipeline(DATASET)
+    return capsys.readouterr().out
+
+
+def _incremental_then_full(capsys, edit):
+    """Outputs of the incremental update after `edit`, then of a full QC run over the same cleaned data"""
+    _run(capsys)
+    raw = read_raw()
+    write_raw(edit(raw))
+    assert "QC updated incrementally" in _run(capsys)
+    incremental = _snapshot_outputs()
+    qc.main(f"data/cleaned/{DATASET}_cleaned.csv")
+    return incremental, _snapshot_outputs()
+
+
+def _snapshot_outputs():
+    with open(f"data/cleaned/{DATASET}_qc_report.txt") as f:
+        report = f.read()
+    with open(qc.state_path(DATASET)) as f:
+        state = json.load(f)
+    charts = qc.read_chart_summary(DATASET)
+    charts.pop("source")
+    flags = pd.read_csv(f"data/cleaned/{DATASET}_qc_flags.csv", dtype=str, keep_default_na=False)
+    return {"report": report, "state": state, "charts": charts, "flags": flags}
+
+
+def _rule_flagged(flags):
+    flagged = flags[(flags[RULE_COLUMNS] == "True").any(axis=1)]
+    return flagged.drop(columns=[col for col in flags.columns if col.endswith("_outlier") and col not in RULE_COLUMNS])
+
+
+def _normalized(value):
+    """Chart summary values compared with float tolerance and category pairs without order"""
+    if isinstance(value, dict):
+        return {key: _normalized(item) for key, item in value.items()}
+    if isinstance(value, list) and value and isinstance(value[0], list):
+        return sorted((str(pair[0]), pair[1]) for pair in value)
+    if isinstance(value, list):
+        return [_normalized(item) for item in value]
+    if isinstance(value, float):
+        return pytest.approx(value, rel=1e-9, abs=1e-9)
+    return value
+
+
+def _assert_matches_full(incremental, full):
+    # Everything before the stratified sections, which keep the last full run's group statistics
+    assert incremental["report"].split("📍")[0] == full["report"].split("📍")[0]
+    for key in ("n_total", "counts", "missing"):
+        assert incremental["state"][key] == full["state"][key], key
+    for col, pairs in full["state"]["dists"].items():
+        assert sorted(map(tuple, incremental["state"]["dists"][col]), key=str) == sorted(map(tuple, pairs), key=str)
+    pd.testing.assert_frame_equal(_rule_flagged(incremental["flags"]).reset_index(drop=True),
+                                  _rule_flagged(full["flags"]).reset_index(drop=True))
+    assert _normalized(full["charts"]) == _normalized(incremental["charts"])
+
+
+def test_single_cell_edit_stays_incremental(workspace, capsys):
+    def edit(raw):
+        raw.loc[4, "IQ"] = str(int(float(raw.loc[4, "IQ"] or 100)) + 1)
+        return raw
+
+    incremental, full = _incremental_then_full(capsys, edit)
+    _assert_matches_full(incremental, full)
+    assert "last full QC run" in incremental["report"]
+
+
+def test_edits_removals_and_site_moves_match_full_qc(workspace, capsys):
+    def edit(raw):
+        raw.loc[3, "age"] = "-9999"
+        raw.loc[5, "IQ"] = ""
+        raw.loc[7, "site"] = raw.loc[8, "site"] if raw.loc[7, "site"] != raw.loc[8, "site"] else raw.loc[9, "site"]
+        raw.loc[9, "diagnosis"] = "TD" if raw.loc[9, "diagnosis"] == "ASD" else "ASD"
+        return raw.drop(index=[11, 12])
+
+    _assert_matches_full(*_incremental_then_full(capsys, edit))
+
+
+def test_moved_extreme_rebuilds_chart_summary(workspace, capsys):
+    def edit(raw):
+        raw.loc[6, "IQ"] = "190"
+        return raw
+
+    incremental, full = _incremental_then_full(capsys, edit)
+    _assert_matches_full(incremental, full)
+    assert incremental["charts"]["numeric"]["IQ"]["max"] == 190
+
+
+def test_changed_rows_are_scored_against_saved_group_statistics(workspace, capsys):
+    _run(capsys)
+    _, summary = qc.load_state(DATASET)
+    table = summary["strata"]["site"]["table"]
+    site = table["site"].iloc[0]
+    median, mad = table.loc[0, "IQ_median"], table.loc[0, "IQ_mad"]
+
+    raw = read_raw()
+    row = np.flatnonzero(raw["site"].to_numpy() == site)[0]
+    raw.loc[row, "IQ"] = str(median + (qc.ROBUST_Z + 1) * mad)
+    write_raw(raw)
+    assert "QC updated incrementally" in _run(capsys)
+    flags = pd.read_csv(f"data/cleaned/{DATASET}_qc_flags.csv", dtype=str, keep_default_na=False)
+    assert flags.set_index("subjectkey").loc[raw.loc[row, "subjectkey"].strip(), qc.strata_flag("site")] == "True"
@@ -0,0 +1,71 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from qc_rules import compile_rules, evaluate, load_rules, required_fields, rule_labels
+
+DF = pd.DataFrame({
+    "subjectkey": ["sub-1", "sub-2", "sub-3", "sub-4"],
+    "site": ["NYU", "UCLA", "NYU", None],
+    "age": [4.0, 30.0, np.nan, 70.0],
+    "IQ": [100.0, 150.0, 60.0, np.nan],
+    "sex": ["M", "F", "X", None],
+})
+
+RULES = [
+    {"name": "missing", "type": "required", "columns": ["age", "IQ", "handedness"]},
+    {"name": "age_range", "type": "range", "column": "age", "min": 5, "max": 64, "label": "Age outliers"},
+    {"name": "sex_allowed", "type": "allowed", "column": "sex", "values": ["M", "F"]},
+    {"name": "key_format", "type": "regex", "column": "subjectkey", "pattern": r"sub-[1-3]"},
+    {"name": "young_genius", "type": "cross_field", "expr": "age < 18 and IQ > 90"},
+    {"name": "site_iq", "type": "per_site_range", "column": "IQ", "ranges": {"NYU": [70, 120]}, "default": [50, 140]},
+]
+
+
+def test_every_rule_type():
+    flags = evaluate(DF, compile_rules(RULES))
+    assert list(flags.columns) == [rule["name"] for rule in RULES]
+    expected = {
+        # handedness is absent, which counts as missing in every row
+        "missing": [True, True, True, True],
+        "age_range": [True, False, False, True],
+        "sex_allowed": [False, False, True, False],
+        "key_format": [False, False, False, True],
+        "young_genius": [True, False, False, False],
+        "site_iq": [False, True, True, False],
+    }
+    for name, values in expected.items():
+        assert flags[name].tolist() == values, name
+
+
+def test_rule_metadata():
+    assert required_fields(RULES) == ["age", "IQ", "handedness"]
+    labels = rule_labels(RULES)
+    assert "missing" not in labels
+    assert labels["age_range"] == "Age outliers" and labels["sex_allowed"] == "sex_allowed flags"
+
+
+def test_dataset_override_is_validated(workspace):
+    os.makedirs("data/metadata")
+    path = "data/metadata/example_qc_rules.json"
+    with open(path, "w") as f:
+        json.dump({"rules": RULES[:2]}, f)
+    assert [rule["name"] for rule in load_rules("example")] == ["missing", "age_range"]
+    assert [rule["name"] for rule in load_rules("other")] == ["missing_flag", "age_outlier", "IQ_outlier"]
+
+    with open(path, "w") as f:
+        json.dump({"rules": [{"name": "odd", "type": "median"}]}, f)
+    with pytest.raises(ValueError, match="Unknown QC rule type"):
+        load_rules("example")
+    with open(path, "w") as f:
+        json.dump({"rules": RULES[:1] * 2}, f)
+    with pytest.raises(ValueError, match="Duplicate"):
+        load_rules("example")
+
+
+def test_unparseable_cross_field_expression_names_the_rule():
+    with pytest.raises(ValueError, match="bad_expr"):
+        evaluate(DF, compile_rules([{"name": "bad_expr", "type": "cross_field", "expr": "age <"}]))
@@ -0,0 +1,52 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from schema import load_schema, read_csv
+
+CSV = "subjectkey,sex,site,age,notes\n 007 ,M,UCLA,10,a\n008,F,NEWSITE,-9999,b\n009,,NYU,12.5,\n"
+
+
+def _write(workspace, text=CSV):
+    path = workspace / "data/raw/example.csv"
+    path.write_text(text)
+    return str(path)
+
+
+def test_declared_columns_load_typed(workspace):
+    df = read_csv(_write(workspace), "example")
+    # IDs stay text (leading zeros and padding kept); categories are dictionary-encoded in vocabulary order
+    assert df["subjectkey"].tolist() == [" 007 ", "008", "009"]
+    assert isinstance(df["site"].dtype, pd.CategoricalDtype)
+    assert list(df["site"].cat.categories[:2]) == ["NYU", "UCLA"] and "NEWSITE" in df["site"].cat.categories
+    assert df["age"].tolist() == [10.0, -9999.0, 12.5]
+    assert read_csv(_write(workspace), "example", sentinels=True)["age"].isna().tolist() == [False, True, False]
+
+
+def test_numeric_codes_come_back_as_plain_columns(workspace):
+    df = read_csv(_write(workspace, "subjectkey,sex,diagnosis\n1,1,0\n2,2,1\n3,,1\n"), "example")
+    assert df["sex"].dtype == float and df["sex"].tolist()[:2] == [1.0, 2.0]
+    assert df["diagnosis"].dtype == "int64"
+
+
+def test_chunks_and_column_subsets_use_the_schema(workspace):
+    path = _write(workspace)
+    chunks = list(read_csv(path, "example", chunksize=2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert all(isinstance(chunk["site"].dtype, pd.CategoricalDtype) for chunk in chunks)
+    assert list(read_csv(path, "example", columns=["subjectkey", "age", "absent"]).columns) == ["subjectkey", "age"]
+
+
+def test_dataset_override(workspace):
+    os.makedirs("data/metadata")
+    with open("data/metadata/example_schema.json", "w") as f:
+        json.dump({"usecols": ["subjectkey", "age"], "columns": {"age": {"type": "number", "dtype": "float32"}}}, f)
+    df = read_csv(_write(workspace), "example")
+    assert list(df.columns) == ["subjectkey", "age"] and df["age"].dtype == "float32"
+
+    with open("data/metadata/example_schema.json", "w") as f:
+        json.dump({"columns": {"age": {"type": "decimal"}}}, f)
+    with pytest.raises(ValueError, match="Unknown type"):
+        load_schema("example")
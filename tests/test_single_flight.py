@@ -0,0 +1,92 @@
+import threading
+import time
+
+from single_flight import dataset_lock, single_flight
+
+DS = "example"
+
+
+def _waiter(results, before_entering=None):
+    def run():
+        if before_entering:
+            before_entering()
+        with single_flight(DS) as flight:
+            if not flight.shared:
+                flight.publish(["own run"])
+            results.append((flight.shared, flight.result))
+    return threading.Thread(target=run)
+
+
+def _hold_run(result, started, release, edit=None):
+    with single_flight(DS) as flight:
+        started.set()
+        release.wait(10)
+        if edit:
+            edit()
+        flight.publish(result)
+
+
+def _raw(workspace, text):
+    (workspace / f"data/raw/{DS}.csv").write_text(text)
+
+
+def test_waiters_share_the_result_of_the_run_they_waited_on(workspace):
+    _raw(workspace, "subjectkey\nsub-1\n")
+    started, release, results = threading.Event(), threading.Event(), []
+    runner = threading.Thread(target=_hold_run, args=([{"subjectkey": "sub-1"}], started, release))
+    runner.start()
+    started.wait(10)
+    waiters = [_waiter(results) for _ in range(3)]
+    for waiter in waiters:
+        waiter.start()
+    time.sleep(0.2)
+    release.set()
+    for thread in [runner] + waiters:
+        thread.join(10)
+    assert results == [(True, [{"subjectkey": "sub-1"}])] * 3
+
+
+def test_a_changed_raw_file_gets_its_own_run(workspace):
+    _raw(workspace, "subjectkey\nsub-1\n")
+    started, release, results = threading.Event(), threading.Event(), []
+    runner = threading.Thread(target=_hold_run, args=(["first"], started, release))
+    runner.start()
+    started.wait(10)
+    # The waiter reads the raw file after the run it waited on, and finds a newer version
+    waiter = _waiter(results)
+    waiter.start()
+    time.sleep(0.2)
+    _raw(workspace, "subjectkey\nsub-1\nsub-2\n")
+    release.set()
+    runner.join(10)
+    waiter.join(10)
+    assert results == [(False, ["own run"])]
+
+
+def test_a_caller_that_did_not_wait_runs_again(workspace):
+    _raw(workspace, "subjectkey\nsub-1\n")
+    with single_flight(DS) as flight:
+        flight.publish(["first"])
+    with single_flight(DS) as flight:
+        assert not flight.shared
+
+
+def test_dataset_lock_reports_waiting(workspace):
+    held, release, waited = threading.Event(), threading.Event(), []
+
+    def hold():
+        with dataset_lock(DS, ("cleaned",)):
+            held.set()
+            release.wait(10)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    held.wait(10)
+    with dataset_lock(DS, ("snapshot",)) as w:
+        waited.append(w)  # a different scope is not blocked
+    timer = threading.Timer(0.2, release.set)
+    timer.start()
+    with dataset_lock(DS, ("cleaned",)) as w:
+        waited.append(w)
+    holder.join(10)
+    assert waited == [False, True]
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+import snapshot_store
+from snapshot_compare import load_keyed
+from snapshot_store import load_version, save_version, versions
+from conftest import DATASET
+
+
+def _as_text(df):
+    return df.astype(object).where(df.notna(), None).astype(str)
+
+
+def _versions(base, n_versions, seed=0):
+    """A random walk of versions: edited cells, removed, added and reordered rows, and a new column"""
+    rng = np.random.default_rng(seed)
+    df = base.copy()
+    yield df
+    next_key = 10_000
+    for i in range(1, n_versions):
+        df = df.copy()
+        rows = rng.choice(len(df), size=5, replace=False)
+        df.iloc[rows, df.columns.get_loc("IQ")] = rng.integers(60, 150, size=5).astype(float)
+        df = df.drop(index=df.index[rng.choice(len(df), size=2, replace=False)])
+        added = df.iloc[:3].copy()
+        added.index = pd.Index([f"sub-{next_key + j}" for j in range(3)], name=df.index.name)
+        next_key += 3
+        df = pd.concat([df, added])
+        if i == 4:
+            df = df.iloc[rng.permutation(len(df))]
+        if i == 7:
+            df["handedness"] = "R"
+        if i == 9:
+            # Most rows change: stored in full again
+            df["age"] = df["age"] + 1
+        yield df
+
+
+def test_every_version_reconstructs(workspace, monkeypatch):
+    monkeypatch.setattr(snapshot_store, "MAX_DELTAS", 4)
+    base = load_keyed(f"data/raw/{DATASET}.csv", DATASET)
+    saved = []
+    for df in _versions(base, 12):
+        if save_version(DATASET, df, raw_hash=f"hash{len(saved)}") is not None:
+            saved.append(df)
+
+    entries = versions(DATASET)
+    assert len(entries) == len(saved)
+    assert {entry["kind"] for entry in entries} == {"full", "delta"}
+    assert any(entry.get("reordered") for entry in entries)
+    for entry, df in zip(entries, saved):
+        restored = load_version(DATASET, entry["version"])
+        assert list(restored.index) == list(df.index)
+        assert list(restored.columns) == list(df.columns)
+        pd.testing.assert_frame_equal(_as_text(restored), _as_text(df), check_names=False)
+
+
+def test_unchanged_version_is_not_stored(workspace):
+    base = load_keyed(f"data/raw/{DATASET}.csv", DATASET)
+    assert save_version(DATASET, base) is not None
+    assert save_version(DATASET, base.copy()) is None
+    assert len(versions(DATASET)) == 1
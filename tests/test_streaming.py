@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+import preprocess
+import qc
+from streaming import stream_preprocess_qc
+from conftest import DATASET, read_raw, write_raw
+
+OUTPUTS = ["cleaned.csv", "qc_report.txt", "qc_flags.csv"]
+
+
+def _outputs():
+    files = {}
+    for name in OUTPUTS:
+        with open(f"data/cleaned/{DATASET}_{name}", "rb") as f:
+            files[name] = f.read()
+    charts = qc.read_chart_summary(DATASET)
+    charts.pop("source")
+    return files, charts
+
+
+@pytest.mark.parametrize("chunksize", [17, 64, 1000])
+def test_streaming_matches_in_memory(workspace, chunksize):
+    raw = read_raw()
+    raw.loc[3, "age"] = "-9999"
+    raw.loc[5, "IQ"] = ""
+    raw.loc[7, "site"] = "NEWSITE"
+    raw.loc[10, "scanner_type"] = " "
+    write_raw(raw)
+
+    preprocess.main(DATASET)
+    qc.main(f"data/cleaned/{DATASET}_cleaned.csv")
+    in_memory = _outputs()
+
+    stream_preprocess_qc(DATASET, chunksize)
+    assert _outputs() == in_memory
+
+
+def test_streaming_state_matches_in_memory(workspace):
+    preprocess.main(DATASET)
+    qc.main(f"data/cleaned/{DATASET}_cleaned.csv")
+    with open(qc.state_path(DATASET)) as f:
+        in_memory = json.load(f)
+
+    stream_preprocess_qc(DATASET, 23)
+    with open(qc.state_path(DATASET)) as f:
+        streamed = json.load(f)
+    for key in ("n_total", "counts", "missing", "dists", "strata"):
+        assert streamed[key] == in_memory[key], key
@@ -0,0 +1,27 @@
+from preprocess_qc_runner import run_pipeline
+from subject_index import search, subject_history
+from conftest import DATASET, read_raw, write_raw
+
+
+def test_subject_history_follows_versions_and_changes(workspace):
+    raw = read_raw()
+    kept, edited, dropped = (raw.loc[i, "subjectkey"].strip() for i in (0, 4, 7))
+    run_pipeline(DATASET)
+
+    raw.loc[4, "IQ"] = "77"
+    write_raw(raw.drop(index=7))
+    run_pipeline(DATASET)
+
+    spans, changes = subject_history(kept)
+    assert spans[["dataset", "first_version"]].values.tolist() == [[DATASET, 1]]
+    assert spans["last_version"].isna().all() and changes.empty
+
+    spans, changes = subject_history(edited)
+    assert spans["first_version"].tolist() == [1, 2] and spans["last_version"].tolist()[0] == 1
+    assert changes["column"].tolist() == ["IQ"] and float(changes["new_value"].iloc[0]) == 77
+
+    spans, changes = subject_history(dropped)
+    assert spans["last_version"].tolist() == [1]
+    assert changes["column"].tolist() == ["ROW_STATUS"]
+
+    assert kept in search(kept[:-1]) and search("no-such-subject") == []
@@ -0,0 +1,53 @@
+import os
+
+from version_compare import comparison_matrix, is_logged, log_comparison, presence, subject_diff
+
+
+def _versions(workspace):
+    paths = []
+    for name, ids in (("v1.csv", ["s1", "s2", "s3"]), ("v2.csv", [" s2", "s3 ", "s4", "s3"]), ("v3.csv", ["s4", "s5"])):
+        path = workspace / "data/raw" / name
+        path.write_text("subject_id,age\n" + "".join(f"{i},10\n" for i in ids))
+        paths.append(str(path))
+    return paths
+
+
+def test_matrix_and_presence(workspace):
+    v1, v2, v3 = _versions(workspace)
+    added, removed = subject_diff(v1, v2)
+    assert (added.tolist(), removed.tolist()) == (["s4"], ["s1"])
+
+    matrix = comparison_matrix([v1, v2, v3]).set_index(["from", "to"])
+    assert len(matrix) == 6
+    assert matrix.loc[("v1.csv", "v3.csv")].tolist() == [2, 3]
+    assert matrix.loc[("v3.csv", "v2.csv")].tolist() == [2, 1]
+
+    table = presence([v1, v2, v3])
+    assert table.index.tolist() == ["s1", "s2", "s3", "s4", "s5"]
+    assert table["v2.csv"].tolist() == [False, True, True, True, False]
+
+
+def test_signatures_are_reused_by_content(workspace):
+    v1, v2, _ = _versions(workspace)
+    subject_diff(v1, v2)
+    saved = set(os.listdir("data/signatures"))
+    assert len(saved) == 2
+    # Identical content under another name reuses the saved signature
+    copy = workspace / "data/raw/copy.csv"
+    copy.write_bytes(open(v1, "rb").read())
+    assert subject_diff(v1, str(copy))[0].size == 0
+    assert set(os.listdir("data/signatures")) == saved
+
+
+def test_comparisons_are_logged_once(workspace):
+    changelog, db = "CHANGELOG.md", "docs/changelog_index.sqlite"
+    assert log_comparison("v1.csv", "v2.csv", ["s4"], ["s1"], changelog, db)
+    assert not log_comparison("v1.csv", "v2.csv", ["s4"], ["s1"], changelog, db)
+    assert is_logged("v1.csv", "v2.csv", changelog, db) and not is_logged("v2.csv", "v3.csv", changelog, db)
+    text = open(changelog).read()
+    assert text.count("`v1.csv` → `v2.csv`") == 1 and "Added subjects: s4" in text
+
+    # Entries written by hand are picked up from the changelog itself
+    with open(changelog, "a") as f:
+        f.write("\n## 🔄 Comparison: `v2.csv` → `v3.csv` — 2024-01-01 00:00:00\n- ✅ No changes in subject IDs\n")
+    assert is_logged("v2.csv", "v3.csv", changelog, db)